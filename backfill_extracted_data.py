@@ -0,0 +1,91 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from database import SessionLocal, engine
+from models import ExtractedData, PDFFile
+from services import doc_format, documents, extracted_data, storage
+
+
+def _init_worker():
+    # Connections inherited from the parent process must not be reused after the fork
+    engine.dispose(close=False)
+
+
+def flatten(doc_id, store):
+    # Runs in the worker pool: read and flatten one stored body
+    doc = documents.read_body(doc_id, store)
+    return extracted_data.document_rows(doc) if doc is not None else None
+
+
+def unregistered_bodies(db, store):
+    # Stored bodies without a PDFFile row (uploads/*.json from before the database store), which the
+    # backfill can't attach rows to
+    registered = {doc_id for (doc_id,) in db.query(PDFFile.doc_id)}
+    missing = []
+    for name in store.list():
+        stem, ext = os.path.splitext(name)
+        if ext not in (".json", ".udoc") or stem in registered:
+            continue
+        # Legacy files may be named differently from the document they hold
+        if ext == ".json":
+            try:
+                if doc_format.loads(store.read(name)).get("id") in registered:
+                    continue
+            except (ValueError, TypeError, AttributeError):
+                pass
+        missing.append(name)
+    return missing
+
+
+def backfill_extracted_data(upload_dir=None, workers=os.cpu_count() or 1,
+                            batch_size=extracted_data.EXTRACTED_DATA_BATCH_SIZE, replace=False):
+    # Fill ExtractedData from the stored document bodies. Reading and flattening runs in parallel;
+    # rows are written from this process, one transaction per document, so SQLite works as well.
+    # Documents that already have rows are skipped unless replace is set. Only registered documents
+    # (with a PDFFile row) can be backfilled; stored bodies without one stop the run before anything is
+    # written, since import_documents.py has to register them first.
+    store = storage.storage_for(upload_dir)
+    print(f"Backfilling extracted data from {upload_dir or storage.STORAGE_BACKEND + ' storage'} "
+          f"with {workers} worker(s)...")
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        missing = unregistered_bodies(db, store)
+        if missing:
+            raise SystemExit(
+                f"{len(missing)} stored document(s) are not registered in the database "
+                f"(e.g. {', '.join(missing[:3])}). Run import_documents.py"
+                f"{' --upload-dir ' + upload_dir if upload_dir else ''} first, then run the backfill again.")
+        ids = dict(db.query(PDFFile.doc_id, PDFFile.id))
+        if not replace:
+            done = {pdf_file_id for (pdf_file_id,) in db.query(ExtractedData.pdf_file_id).distinct()}
+            ids = {doc_id: pdf_file_id for doc_id, pdf_file_id in ids.items() if pdf_file_id not in done}
+        pending = [doc_id for doc_id in sorted(ids) if documents.body_format(doc_id, store) is not None]
+        print(f"{len(pending)} document(s) to process.")
+        documents_done = rows_written = 0
+        with ProcessPoolExecutor(max_workers=max(1, workers), initializer=_init_worker) as pool:
+            for doc_id, rows in zip(pending, pool.map(flatten, pending, [store] * len(pending), chunksize=8)):
+                if rows is None:
+                    continue
+                rows_written += extracted_data.store_rows(db, ids[doc_id], rows, batch_size=batch_size)
+                documents_done += 1
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - started
+    print(f"Wrote {rows_written} row(s) for {documents_done} document(s) in {elapsed:.1f}s.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fill the extracted_data table from stored document bodies. Only documents registered in "
+                    "the database are processed: if the storage holds bodies without a database row (e.g. "
+                    "uploads/*.json written before the database store), the backfill stops and asks you to "
+                    "run import_documents.py first.")
+    parser.add_argument("--upload-dir", help="local directory to read instead of the configured storage")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=extracted_data.EXTRACTED_DATA_BATCH_SIZE)
+    parser.add_argument("--replace", action="store_true", help="rewrite documents that already have rows")
+    args = parser.parse_args()
+    backfill_extracted_data(args.upload_dir, args.workers, args.batch_size, args.replace)
@@ -0,0 +1 @@
+# Benchmarks for the extraction and comparison pipelines (python -m benchmarks.bench)
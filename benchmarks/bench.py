@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib import metadata
+from importlib.util import find_spec
+from multiprocessing import get_context
+
+from benchmarks.corpus import KINDS, corpus_name, ensure_corpus
+
+try:
+    import resource
+except ImportError:
+    # Windows: no getrusage, peak RSS is not reported
+    resource = None
+
+# Usage, from the repository root:
+#   python -m benchmarks.bench --sizes 1,10,100,500 --output benchmarks/results.json
+#   python -m benchmarks.bench --baseline benchmarks/baseline.json --threshold 0.25
+# Every measurement runs in a freshly spawned process so peak RSS belongs to that stage alone.
+
+DEFAULT_SIZES = (1, 10, 100, 500)
+TRACKED_PACKAGES = ("pymupdf", "pdfplumber", "PyPDF2", "easyocr", "numpy", "scipy", "orjson", "msgpack", "zstandard")
+
+
+def _setup(stage, paths):
+    # Untimed preparation; returns the argument of the timed call
+    from services import comparison, compare_index, documents, extraction, pdf_backends, storage
+
+    if stage in ("text", "tables", "ocr"):
+        return pdf_backends.open_document(paths[0])
+    if stage == "tableHeuristic":
+        with pdf_backends.open_document(paths[0]) as document:
+            return "".join(document.page_text(i) for i in range(document.page_count))
+    if stage == "extract":
+        return paths[0]
+    docs = [extraction.extract_document(path, os.path.basename(path), "application/pdf", str(i))[0]
+            for i, path in enumerate(paths)]
+    if stage == "compareIndex":
+        return docs[0]
+    if stage == "load":
+        # Stored in the configured DOCUMENT_FORMAT / DOCUMENT_COMPRESSION
+        store = storage.LocalStorage(tempfile.mkdtemp(prefix="bench-load-"))
+        documents.write_body(docs[0], store)
+        return docs[0]["id"], store
+    if stage == "compare":
+        return docs, [compare_index.build_index(doc) for doc in docs]
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def _run_stage(stage, prepared):
+    from services import comparison, compare_index, documents, extraction, ocr, table_detect
+
+    if stage == "text":
+        return "".join(prepared.page_text(i) for i in range(prepared.page_count))
+    if stage == "tables":
+        return [prepared.page_tables(i) for i in range(prepared.page_count)]
+    if stage == "ocr":
+        return ocr.ocr_pages(prepared.render_page, prepared.page_count)
+    if stage == "tableHeuristic":
+        return table_detect.detect_tables(prepared)
+    if stage == "extract":
+        return extraction.extract_document(prepared, os.path.basename(prepared), "application/pdf", "bench")
+    if stage == "compareIndex":
+        return compare_index.build_index(prepared)
+    if stage == "load":
+        return documents.read_body(*prepared)
+    if stage == "compare":
+        (doc1, doc2), (index1, index2) = prepared
+        return comparison.compare(doc1, doc2, index1, index2)
+    raise ValueError(f"Unknown stage: {stage}")
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS; None where the platform has no getrusage
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _round(value, digits=1):
+    return round(value, digits) if value is not None else None
+
+
+def measure(stage, paths, repeat):
+    # Runs inside the spawned child
+    prepared = _setup(stage, paths)
+    rss_before = _peak_rss_mb()
+    walls, cpus = [], []
+    for _ in range(repeat):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        _run_stage(stage, prepared)
+        walls.append(time.perf_counter() - wall_start)
+        cpus.append(time.process_time() - cpu_start)
+    return {
+        "wallSeconds": round(min(walls), 6),
+        "cpuSeconds": round(min(cpus), 6),
+        "peakRssMb": _round(_peak_rss_mb()),
+        "setupRssMb": _round(rss_before),
+        "repeat": repeat,
+    }
+
+
+def _measure_isolated(stage, paths, repeat):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(measure, stage, paths, repeat).result()
+
+
+def plan(corpus, sizes, kinds, max_ocr_pages):
+    # (result key, stage, corpus paths) for every measurement
+    jobs = []
+    for kind in kinds:
+        for pages in sizes:
+            name = corpus_name(kind, pages)
+            if name not in corpus:
+                continue
+            path = corpus[name]
+            revised = corpus.get(corpus_name(kind, pages, 1))
+            if kind == "scanned":
+                if find_spec("easyocr") is not None and pages <= max_ocr_pages:
+                    jobs.append((f"ocr/{name}", "ocr", [path]))
+                continue
+            jobs.append((f"text/{name}", "text", [path]))
+            jobs.append((f"tables/{name}", "tables", [path]))
+            jobs.append((f"tableHeuristic/{name}", "tableHeuristic", [path]))
+            jobs.append((f"extract/{name}", "extract", [path]))
+            jobs.append((f"compareIndex/{name}", "compareIndex", [path]))
+            jobs.append((f"load/{name}", "load", [path]))
+            if revised:
+                jobs.append((f"compare/{name}", "compare", [path, revised]))
+    return jobs
+
+
+def environment():
+    versions = {}
+    for package in TRACKED_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "packages": versions,
+    }
+
+
+def compare_to_baseline(results, baseline, threshold, metric="wallSeconds"):
+    # Measurements slower than baseline * (1 + threshold); returns a list of regression dicts
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get(key)
+        if not previous or not previous.get(metric) or current.get(metric) is None:
+            continue
+        ratio = current[metric] / previous[metric]
+        if ratio > 1 + threshold:
+            regressions.append({"key": key, "baseline": previous[metric], "current": current[metric], "ratio": round(ratio, 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark extraction and comparison on a synthetic PDF corpus.")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES), help="comma separated page counts")
+    parser.add_argument("--kinds", default=",".join(KINDS), help="comma separated corpus kinds")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement (best is kept)")
+    parser.add_argument("--max-ocr-pages", type=int, default=10, help="largest scanned document to OCR")
+    parser.add_argument("--only", default=None, help="only run measurements whose key contains this text")
+    parser.add_argument("--output", default=os.path.join("benchmarks", "results.json"))
+    parser.add_argument("--baseline", default=None, help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown before failing, 0.25 = 25%%")
+    parser.add_argument("--update-baseline", action="store_true", help="also write the results to --baseline")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    kinds = [k for k in args.kinds.split(",") if k]
+    corpus = ensure_corpus(sizes, kinds, max_scanned_pages=args.max_ocr_pages)
+    results = {}
+    for key, stage, paths in plan(corpus, sizes, kinds, args.max_ocr_pages):
+        if args.only and args.only not in key:
+            continue
+        results[key] = _measure_isolated(stage, paths, args.repeat)
+        r = results[key]
+        rss = f"{r['peakRssMb']:8.1f} MB" if r["peakRssMb"] is not None else "     n/a"
+        print(f"{key:40s} wall {r['wallSeconds']:9.4f}s  cpu {r['cpuSeconds']:9.4f}s  peak rss {rss}")
+
+    report = {"environment": environment(), "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Results written to {args.output}")
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Baseline updated: {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        for r in regressions:
+            print(f"REGRESSION {r['key']}: {r['baseline']:.4f}s -> {r['current']:.4f}s (x{r['ratio']})")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import os
+import random
+
+# Generated PDFs are cached here; the same name always produces the same content
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+KINDS = ("text", "tables", "scanned")
+
+_WORDS = (
+    "account amount balance charge credit debit deposit due fee invoice item late month net "
+    "opening order payment period price quantity rate reference service statement subtotal "
+    "supplier tax total transfer unit usage value withdrawal"
+).split()
+_LINES_PER_PAGE = 48
+_TABLE_ROWS = 18
+_TABLE_COLS = 5
+
+
+def _sentence(rng, words=10):
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize()
+
+
+def _revise(rng, lines, revision):
+    # Deterministically rewrite ~5% of the lines for revision > 0
+    if not revision:
+        return lines
+    return [_sentence(rng, 8) if rng.random() < 0.05 else line for line in lines]
+
+
+def _text_page(page, rng, revise_rng, revision, page_number):
+    lines = [f"Statement page {page_number}"] + [_sentence(rng) for _ in range(_LINES_PER_PAGE - 1)]
+    y = 40
+    for line in _revise(revise_rng, lines, revision):
+        page.insert_text((40, y), line, fontsize=9)
+        y += 15
+
+
+def _table_page(page, rng, revise_rng, revision, page_number):
+    page.insert_text((40, 40), f"Transactions page {page_number}", fontsize=11)
+    header = ["Date", "Reference", "Description", "Quantity", "Amount"]
+    rows = [header] + [
+        [
+            f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            f"REF{rng.randint(10000, 99999)}",
+            rng.choice(_WORDS).capitalize(),
+            str(rng.randint(1, 50)),
+            f"{rng.uniform(1, 5000):.2f}",
+        ]
+        for _ in range(_TABLE_ROWS)
+    ]
+    if revision:
+        for row in rows[1:]:
+            if revise_rng.random() < 0.05:
+                row[4] = f"{revise_rng.uniform(1, 5000):.2f}"
+    left, top, width, height = 40, 60, 100, 20
+    for r, row in enumerate(rows):
+        for c, cell in enumerate(row):
+            x, y = left + c * width, top + r * height
+            # Ruled cells so the table detectors have lines to work with
+            page.draw_rect((x, y, x + width, y + height), color=(0, 0, 0), width=0.5)
+            page.insert_text((x + 4, y + 14), cell, fontsize=8)
+
+
+def build_pdf(path, kind, pages, seed=0, revision=0):
+    import fitz
+
+    rng = random.Random(f"{kind}-{pages}-{seed}")
+    revise_rng = random.Random(f"{kind}-{pages}-{seed}-rev{revision}")
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        page = doc.new_page(width=595, height=842)
+        if kind == "tables":
+            _table_page(page, rng, revise_rng, revision, number)
+        else:
+            _text_page(page, rng, revise_rng, revision, number)
+    if kind == "scanned":
+        # Image-only copy: every page rasterised, no text layer left
+        scanned = fitz.open()
+        for page in doc:
+            pix = page.get_pixmap(dpi=100, colorspace=fitz.csGRAY)
+            target = scanned.new_page(width=page.rect.width, height=page.rect.height)
+            target.insert_image(target.rect, pixmap=pix)
+        doc.close()
+        doc = scanned
+    doc.set_metadata({})
+    doc.save(path, garbage=3, deflate=True, no_new_id=True)
+    doc.close()
+
+
+def corpus_name(kind, pages, revision=0):
+    return f"{kind}-{pages}" + (f"-rev{revision}" if revision else "")
+
+
+def ensure_corpus(sizes, kinds=KINDS, revisions=(0, 1), max_scanned_pages=None, directory=CORPUS_DIR):
+    # Build any missing corpus files and return {name: path}
+    os.makedirs(directory, exist_ok=True)
+    corpus = {}
+    for kind in kinds:
+        for pages in sizes:
+            if kind == "scanned" and max_scanned_pages is not None and pages > max_scanned_pages:
+                continue
+            for revision in revisions:
+                name = corpus_name(kind, pages, revision)
+                path = os.path.join(directory, f"{name}.pdf")
+                if not os.path.exists(path):
+                    build_pdf(path, kind, pages, revision=revision)
+                corpus[name] = path
+    return corpus
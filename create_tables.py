@@ -1,5 +1,5 @@
 from database import engine, Base
-from models import pdf_file, extracted_data
+from models import pdf_file, extracted_data, comparison_cache, monthly_rollup, document_rollup, extraction_job
 
 def create_tables():
     print("Creating tables in the database...")
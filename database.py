@@ -11,10 +11,47 @@ MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
 MYSQL_PORT = os.getenv("MYSQL_PORT", "3306")
 MYSQL_DB = os.getenv("MYSQL_DB", "doccompare")
 
-DATABASE_URL = (
-    f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}"
+# DATABASE_URL overrides the MySQL settings, e.g. sqlite:///./doccompare.db for local runs
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DB}",
 )
 
-engine = create_engine(DATABASE_URL, echo=True, future=True)
+# Log every SQL statement (noisy, for debugging)
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() == "true"
+
+# Connection pool of each process (every API worker and extraction worker process has its own), so
+# the database sees up to processes * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Reconnect connections older than this many seconds (stay under MySQL's wait_timeout); -1 never
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Test every connection on checkout, so connections dropped by the server are replaced transparently
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+if DATABASE_URL.startswith("sqlite"):
+    # SQLite picks its own pool; there is no server to share connections with
+    engine_args = {"connect_args": {"check_same_thread": False}}
+else:
+    engine_args = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO, future=True, **engine_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+
+def get_db():
+    # FastAPI dependency: one session per request
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
@@ -0,0 +1,39 @@
+import argparse
+
+from database import SessionLocal
+from services import compare_index, doc_format, documents, storage
+from services.similarity_index import similarity_index
+
+
+def import_documents(upload_dir=None):
+    # Register document JSON files written before the database store existed, build their comparison
+    # indexes and add them to the similarity search index
+    store = storage.storage_for(upload_dir)
+    print(f"Importing documents from {upload_dir or storage.STORAGE_BACKEND + ' storage'}...")
+    imported = 0
+    db = SessionLocal()
+    try:
+        for fname in store.list():
+            if not fname.endswith(".json"):
+                continue
+            doc = doc_format.loads(store.read(fname))
+            if "id" not in doc or documents.get_row(db, doc["id"]) is not None:
+                continue
+            # Rewrite the body compactly with its layout so ranged reads work for it
+            documents.write_body(doc, store)
+            db.add(documents.row_from_document(doc))
+            db.commit()
+            index = compare_index.build_index(doc)
+            documents.write_index(doc["id"], index, store)
+            similarity_index.add(doc["id"], index["searchMinhash"])
+            imported += 1
+    finally:
+        db.close()
+    print(f"Imported {imported} document(s).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Register document JSON files written before the database store existed.")
+    parser.add_argument("--upload-dir", help="local directory to import from instead of the configured storage")
+    args = parser.parse_args()
+    import_documents(args.upload_dir)
@@ -1,6 +1,12 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from routers import upload
+from routers import analytics, upload
+from services import batch_compare, ingest, telemetry
+from services.jobs import extraction_queue
+from services.similarity_index import similarity_index
+
+# LOG_LEVEL / LOG_FORMAT control what the services log and how
+telemetry.configure_logging()
 
 app = FastAPI(
     title="DocCompare Analytics API",
@@ -17,8 +23,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Oversized uploads are refused before FastAPI spools the multipart body to disk
+app.add_middleware(ingest.UploadSizeLimitMiddleware)
+
 app.include_router(upload.router)
+app.include_router(analytics.router)
 
 @app.get("/")
 def read_root():
     return {"message": "Welcome to DocCompare Analytics API"}
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape endpoint: per-stage extraction and comparison timings and failures
+    payload, content_type = telemetry.metrics_payload()
+    return Response(content=payload, media_type=content_type)
+
+@app.on_event("startup")
+def start_extraction_workers():
+    extraction_queue.start()
+    # Memory-maps the near-duplicate index and replays documents added since its last compaction
+    similarity_index.refresh()
+
+@app.on_event("shutdown")
+def shutdown_extraction_workers():
+    extraction_queue.shutdown(wait=False)
+    batch_compare.shutdown(wait=False)
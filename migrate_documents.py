@@ -0,0 +1,38 @@
+import argparse
+import os
+
+from services import doc_format, documents, storage
+
+
+def migrate_documents(upload_dir=None, fmt=doc_format.DOCUMENT_FORMAT, compression=doc_format.DOCUMENT_COMPRESSION):
+    # Rewrite every stored document body in the given format (pretty-printed JSON from older versions,
+    # compact JSON or binary containers). Bodies already stored that way are rewritten too, which also
+    # refreshes their layout. Without upload_dir the configured storage backend is converted.
+    store = storage.storage_for(upload_dir)
+    print(f"Converting documents in {upload_dir or storage.STORAGE_BACKEND + ' storage'} to {fmt}" + (f" ({compression})" if fmt == "msgpack" else "") + "...")
+    doc_ids = sorted({
+        os.path.splitext(name)[0] for name in store.list()
+        if name.endswith((".json", ".udoc"))
+    })
+    converted = 0
+    size_before = size_after = 0
+    for doc_id in doc_ids:
+        keys = [documents.body_key(doc_id), documents.container_key(doc_id), documents.layout_key(doc_id)]
+        size_before += sum(store.size(key) or 0 for key in keys)
+        doc = documents.read_body(doc_id, store)
+        if not isinstance(doc, dict) or doc.get("id") != doc_id:
+            print(f"Skipping {doc_id}: not a document body.")
+            continue
+        documents.write_body(doc, store, fmt=fmt, compression=compression)
+        size_after += sum(store.size(key) or 0 for key in keys)
+        converted += 1
+    print(f"Converted {converted} document(s): {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert stored document bodies to another storage format.")
+    parser.add_argument("--upload-dir", help="local directory to convert instead of the configured storage")
+    parser.add_argument("--format", choices=doc_format.FORMATS, default=doc_format.DOCUMENT_FORMAT)
+    parser.add_argument("--compression", choices=doc_format.COMPRESSIONS, default=doc_format.DOCUMENT_COMPRESSION)
+    args = parser.parse_args()
+    migrate_documents(args.upload_dir, args.format, args.compression)
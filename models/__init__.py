@@ -1 +1,7 @@
 # Models package for Pydantic and SQLAlchemy models
+from models.pdf_file import PDFFile
+from models.extracted_data import ExtractedData
+from models.comparison_cache import ComparisonCache
+from models.monthly_rollup import MonthlyRollup
+from models.document_rollup import DocumentRollup
+from models.extraction_job import ExtractionJob
@@ -0,0 +1,14 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy.dialects.mysql import LONGTEXT
+from datetime import datetime
+from database import Base
+
+class ComparisonCache(Base):
+    __tablename__ = "comparison_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), nullable=False, unique=True, index=True)  # digests + engine version + mode
+    doc1_id = Column(String(36), nullable=False, index=True)
+    doc2_id = Column(String(36), nullable=False, index=True)
+    result = Column(Text().with_variant(LONGTEXT, "mysql"), nullable=False)  # comparison result as JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
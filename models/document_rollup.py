@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Index
+from database import Base
+
+class DocumentRollup(Base):
+    # One document's contribution to a MonthlyRollup, so re-extraction can take it back out
+    __tablename__ = "document_rollups"
+    __table_args__ = (
+        Index("ix_document_rollups_key_month", "key", "month"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    pdf_file_id = Column(Integer, ForeignKey("pdf_files.id"), nullable=False, index=True)
+    key = Column(String(255), nullable=False)
+    month = Column(String(7), nullable=False)
+    value_count = Column(Integer, nullable=False, default=0)
+    numeric_count = Column(Integer, nullable=False, default=0)
+    total = Column(Float, nullable=False, default=0.0)
+    min_value = Column(Float, nullable=True)
+    max_value = Column(Float, nullable=True)
@@ -1,16 +1,19 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from ..database import Base
+from database import Base
 
 class ExtractedData(Base):
     __tablename__ = "extracted_data"
+    __table_args__ = (
+        Index("ix_extracted_data_key_month", "key", "month"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    pdf_file_id = Column(Integer, ForeignKey("pdf_files.id"), nullable=False)
-    key = Column(String(255), nullable=False)  # e.g., field name or label
+    pdf_file_id = Column(Integer, ForeignKey("pdf_files.id"), nullable=False, index=True)
+    key = Column(String(255), nullable=False, index=True)  # e.g., field name or label
     value = Column(String(255), nullable=True)  # extracted value as string
     extracted_date = Column(DateTime, default=datetime.utcnow)
-    month = Column(String(7), nullable=True)  # e.g., "2025-07"
+    month = Column(String(7), nullable=True, index=True)  # e.g., "2025-07"
 
     pdf_file = relationship("PDFFile", back_populates="extracted_data")
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy.dialects.mysql import LONGTEXT
+from datetime import datetime
+from database import Base
+
+class ExtractionJob(Base):
+    # Last known state of an extraction job, so any API worker can answer status queries for it
+    __tablename__ = "extraction_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(String(36), nullable=False, unique=True, index=True)
+    status = Column(String(16), nullable=False)
+    state = Column(Text().with_variant(LONGTEXT, "mysql"), nullable=False)  # job as returned by the API, as JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True, index=True)
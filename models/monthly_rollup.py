@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, String, DateTime, Float, Index, UniqueConstraint
+from datetime import datetime
+from database import Base
+
+class MonthlyRollup(Base):
+    # Running aggregates of ExtractedData per (key, month), maintained as documents are stored
+    __tablename__ = "monthly_rollups"
+    __table_args__ = (
+        UniqueConstraint("key", "month", name="uq_monthly_rollups_key_month"),
+        Index("ix_monthly_rollups_month_key", "month", "key"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String(255), nullable=False)
+    month = Column(String(7), nullable=False)  # e.g., "2025-07"
+    value_count = Column(Integer, nullable=False, default=0)  # all values, numeric or not
+    numeric_count = Column(Integer, nullable=False, default=0)  # values that parsed as numbers
+    total = Column(Float, nullable=False, default=0.0)  # sum of the numeric values
+    min_value = Column(Float, nullable=True)
+    max_value = Column(Float, nullable=True)
+    document_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,14 +1,26 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Float, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
-from ..database import Base
+from database import Base
 
 class PDFFile(Base):
     __tablename__ = "pdf_files"
 
     id = Column(Integer, primary_key=True, index=True)
+    doc_id = Column(String(36), nullable=False, unique=True, index=True)  # public document id (uuid)
     filename = Column(String(255), nullable=False)
-    upload_date = Column(DateTime, default=datetime.utcnow)
-    metadata = Column(String(1024), nullable=True)
+    file_type = Column(String(100), nullable=True)
+    file_size = Column(Integer, nullable=True)
+    sha256 = Column(String(64), nullable=True, unique=True, index=True)  # content hash of the uploaded PDF
+    content_digest = Column(String(64), nullable=True)  # hash of the extracted document, changes on re-extraction
+    upload_date = Column(DateTime, default=datetime.utcnow, index=True)
+    page_count = Column(Integer, nullable=True)
+    word_count = Column(Integer, nullable=True)
+    character_count = Column(Integer, nullable=True)
+    processing_status = Column(String(32), nullable=True)
+    processing_time = Column(Float, nullable=True)
+    accuracy = Column(Float, nullable=True)
+    # "metadata" is reserved on declarative classes, so the attribute is renamed but the column keeps its name
+    metadata_json = Column("metadata", Text, nullable=True)
 
     extracted_data = relationship("ExtractedData", back_populates="pdf_file")
@@ -0,0 +1,15 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class BatchCompareRequest(BaseModel):
+    # Compare referenceId against every id in docIds, or all pairs within docIds when no reference is given
+    referenceId: Optional[str] = None
+    docIds: List[str]
+    # Keep only the k most similar pairs and/or pairs whose estimated similarity reaches threshold
+    topK: Optional[int] = None
+    threshold: float = 0.0
+    mode: Optional[str] = None
+    # Include the full differences list of every pair instead of just the scores and summary
+    details: bool = False
@@ -0,0 +1,38 @@
+import argparse
+import time
+
+from database import SessionLocal
+from models import ExtractedData
+from services import analytics
+
+
+def rebuild_analytics(commit_every=100):
+    # Recompute the monthly analytics rollups from the extracted_data table, e.g. for rows written
+    # before the rollups existed. Ingestion keeps them current afterwards.
+    print("Rebuilding analytics rollups from extracted_data...")
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        analytics.clear(db)
+        ids = [pdf_file_id for (pdf_file_id,) in
+               db.query(ExtractedData.pdf_file_id).distinct().order_by(ExtractedData.pdf_file_id)]
+        for i, pdf_file_id in enumerate(ids, start=1):
+            rows = db.query(ExtractedData.key, ExtractedData.value, ExtractedData.month).filter(
+                ExtractedData.pdf_file_id == pdf_file_id).all()
+            analytics.apply_document(db, pdf_file_id, rows)
+            if i % commit_every == 0:
+                db.commit()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    print(f"Rolled up {len(ids)} document(s) in {time.perf_counter() - started:.1f}s.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the monthly analytics rollups from extracted_data.")
+    parser.add_argument("--commit-every", type=int, default=100, help="documents per transaction")
+    args = parser.parse_args()
+    rebuild_analytics(max(1, args.commit_every))
@@ -0,0 +1,59 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import Optional
+
+from database import get_db
+from services import analytics, documents
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["analytics"]
+)
+
+# Served from the monthly rollups kept up to date at ingestion, so the cost of a query depends on the
+# rows it returns and not on the number of documents
+
+
+def _check_month(value, name):
+    if value is not None and not analytics.is_month(value):
+        raise HTTPException(status_code=400, detail=f"{name} must be a month like 2025-07.")
+    return value
+
+@router.get("/months")
+def list_months(db: Session = Depends(get_db)):
+    # Months that have extracted values, newest first
+    return {"months": analytics.list_months(db)}
+
+@router.get("/months/{month}")
+def get_month(
+    month: str,
+    compareTo: Optional[str] = None,
+    prefix: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=documents.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    # Totals, counts, min/max and average of every key in the month (key order, paginated), with the
+    # change from compareTo, the previous month by default. Pass nextCursor back as cursor.
+    _check_month(month, "month")
+    _check_month(compareTo, "compareTo")
+    rollups, next_cursor = analytics.month_rollups(
+        db, month, compare_to=compareTo, prefix=prefix, cursor=cursor, limit=limit)
+    return {"month": month, "rollups": rollups, "nextCursor": next_cursor}
+
+@router.get("/keys")
+def get_key_series(
+    key: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = Query(120, ge=1, le=documents.MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    # Month-by-month rollups of one key (keys may contain "/" so it is a query parameter), each with
+    # the change from the preceding month that has data
+    _check_month(start, "start")
+    _check_month(end, "end")
+    series = analytics.key_series(db, key, start=start, end=end, limit=limit)
+    if not series:
+        raise HTTPException(status_code=404, detail="No analytics for this key.")
+    return {"key": key, "months": series}
@@ -1,427 +1,379 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
-from typing import List
-import os
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.orm import Session
+from typing import List, Optional
 
 router = APIRouter(
     prefix="/upload",
     tags=["upload"]
 )
 
-UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-
-import uuid
-from datetime import datetime
+import asyncio
 import json
+import uuid
+from concurrent.futures import BrokenExecutor
+
+from database import SessionLocal, get_db
+from models import PDFFile
+from models.schemas import BatchCompareRequest
+from services import batch_compare, compare_index, comparison, documents, ingest, telemetry, text_compare
+from services.storage import storage
+from services.compare_cache import result_cache
+from services.jobs import extraction_queue, QueueFullError
+from services.similarity_index import similarity_index
 
 @router.get("/list/")
-async def list_uploaded_documents():
-    # List all JSON files in the uploads directory and return their content
-    docs = []
-    for fname in os.listdir(UPLOAD_DIR):
-        if fname.endswith(".json"):
-            with open(os.path.join(UPLOAD_DIR, fname), "r", encoding="utf-8") as f:
-                doc = json.load(f)
-                docs.append(doc)
-    return {"documents": docs}
+def list_uploaded_documents(
+    limit: int = Query(50, ge=1, le=documents.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    # Paginated metadata listing, newest first. Pass nextCursor back as cursor for the following page
+    # and fields=id,fileName,... to choose the returned columns.
+    try:
+        field_names = documents.parse_fields(fields)
+        docs, next_cursor = documents.list_documents(db, limit=limit, cursor=cursor, fields=field_names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"documents": docs, "nextCursor": next_cursor}
 
 @router.get("/{doc_id}")
-async def get_document_by_id(doc_id: str):
-    # Return the extracted data for a single document by ID
-    doc_path = os.path.join(UPLOAD_DIR, f"{doc_id}.json")
-    if not os.path.exists(doc_path):
+def get_document_by_id(doc_id: str, db: Session = Depends(get_db)):
+    # Return the extracted data for a single document by ID. A stored JSON body is streamed as it is on
+    # disk, never parsed or re-encoded; use /pages, /tables and /sections for parts of large documents.
+    if documents.get_row(db, doc_id) is None or documents.body_format(doc_id) is None:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    return StreamingResponse(
+        documents.stream_body(doc_id, prefix=b'{"document":', suffix=b"}"), media_type="application/json"
+    )
+
+@router.get("/{doc_id}/pages")
+def get_document_pages(
+    doc_id: str,
+    start: int = Query(1, ge=1),
+    limit: int = Query(10, ge=1, le=documents.MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    # Text of pages start .. start + limit - 1 (1-based)
+    found = documents.read_pages(doc_id, start - 1, limit) if documents.get_row(db, doc_id) is not None else None
+    if found is None:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    page_count, texts = found
+    return {
+        "docId": doc_id,
+        "pageCount": page_count,
+        "pages": [{"page": start + i, "text": text} for i, text in enumerate(texts)],
+    }
+
+@router.get("/{doc_id}/tables")
+def get_document_tables(
+    doc_id: str,
+    start: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=documents.MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    # tables[start:start + limit], spliced from the stored bytes
+    found = documents.read_tables_json(doc_id, start, limit) if documents.get_row(db, doc_id) is not None else None
+    if found is None:
         raise HTTPException(status_code=404, detail="Document not found.")
-    with open(doc_path, "r", encoding="utf-8") as f:
-        doc = json.load(f)
-    return {"document": doc}
+    table_count, tables_json = found
+    head = json.dumps({"docId": doc_id, "tableCount": table_count, "start": start})[:-1].encode("utf-8")
+    return Response(content=head + b',"tables":' + tables_json + b"}", media_type="application/json")
 
-@router.post("/")
-async def upload_pdfs(files: List[UploadFile] = File(...)):
-    import PyPDF2
+@router.get("/{doc_id}/sections/{name}")
+def get_document_section(doc_id: str, name: str, db: Session = Depends(get_db)):
+    # One top-level field of the document (metadata, structure, extractedText, ...), as stored
+    section = documents.read_section_json(doc_id, name) if documents.get_row(db, doc_id) is not None else None
+    if section is None:
+        raise HTTPException(status_code=404, detail="Document or section not found.")
+    head = json.dumps({"docId": doc_id, "section": name})[:-1].encode("utf-8")
+    return Response(content=head + b',"value":' + section + b"}", media_type="application/json")
 
-    if not (1 <= len(files) <= 2):
+@router.get("/{doc_id}/similar")
+def get_similar_documents(
+    doc_id: str,
+    k: int = Query(10, ge=1, le=100),
+    min_similarity: float = Query(0.0, ge=0.0, le=1.0, alias="minSimilarity"),
+    db: Session = Depends(get_db),
+):
+    # Near-duplicate candidates from the MinHash LSH index; feed them to /compare/ or /compare/batch
+    row = documents.get_row(db, doc_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    signature = similarity_index.signature_of(doc_id)
+    if signature is None:
+        doc = documents.read_body(doc_id)
+        if doc is None:
+            raise HTTPException(status_code=404, detail="Document not found.")
+        signature = compare_index.index_for(doc, documents.read_index(doc_id))["searchMinhash"]
+    matches = similarity_index.query(signature, k=k, exclude=doc_id, min_similarity=min_similarity)
+    names = dict(
+        db.query(PDFFile.doc_id, PDFFile.filename).filter(PDFFile.doc_id.in_([m[0] for m in matches]))
+    ) if matches else {}
+    return {
+        "docId": doc_id,
+        "similar": [
+            {"id": match_id, "fileName": names.get(match_id), "estimatedSimilarity": score}
+            for match_id, score in matches if match_id in names
+        ],
+    }
+
+@router.get("/jobs/{job_id}")
+def get_extraction_job(job_id: str):
+    # Return the status and progress of a background extraction job
+    job = extraction_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {"job": job}
+
+@router.post("/", status_code=202)
+async def upload_pdfs(files: List[UploadFile] = File(...), db: Session = Depends(get_db)):
+    # Requests above ingest.MAX_REQUEST_BYTES never get here: UploadSizeLimitMiddleware refuses them
+    # before the body is parsed. Each file is held to MAX_UPLOAD_BYTES while it is stored.
+    if not (1 <= len(files) <= ingest.MAX_UPLOAD_FILES):
         raise HTTPException(status_code=400, detail="You must upload one or two PDF files.")
 
-    extracted_docs = []
+    specs = []
     for file in files:
         if not file.filename.lower().endswith(".pdf"):
             raise HTTPException(status_code=400, detail=f"{file.filename} is not a PDF file.")
-        file_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-
-        # Extract text from PDF using PyPDF2, fallback to OCR if needed
-        extracted_text = ""
-        try:
-            with open(file_path, "rb") as pdf_file:
-                reader = PyPDF2.PdfReader(pdf_file)
-                for page in reader.pages:
-                    extracted_text += page.extract_text() or ""
-            print(f"Extracted text length for {file.filename} (PyPDF2): {len(extracted_text)}")
-        except Exception as e:
-            print(f"Error extracting text from {file.filename} with PyPDF2: {e}")
-
-        # Extract tables using pdfplumber (regardless of OCR/text extraction)
-        tables = []
-        try:
-            import pdfplumber
-            with pdfplumber.open(file_path) as pdf:
-                for i, page in enumerate(pdf.pages):
-                    page_tables = page.extract_tables()
-                    for table in page_tables:
-                        # Convert table to a list of rows (each row is a list of cell values)
-                        tables.append(table)
-        except Exception as e:
-            print(f"Table extraction failed for {file.filename}: {e}")
-
-        # Fallback to OCR with EasyOCR if PyPDF2 fails or returns no text
-        if not extracted_text:
+    try:
+        for file in files:
+            timings = {}
             try:
-                import pdfplumber
-                import easyocr
-                ocr_reader = easyocr.Reader(['en'])
-                with pdfplumber.open(file_path) as pdf:
-                    for i, page in enumerate(pdf.pages):
-                        print(f"Running EasyOCR on page {i+1} of {len(pdf.pages)}...")
-                        img = page.to_image(resolution=200)
-                        import numpy as np
-                        np_image = np.array(img.original)
-                        # Use detail=1 to get bounding box data
-                        ocr_results = ocr_reader.readtext(np_image, detail=1, paragraph=False)
-                        # Group words by line (y coordinate)
-                        from collections import defaultdict
-                        line_dict = defaultdict(list)
-                        for bbox, text, conf in ocr_results:
-                            # bbox: [[x1, y1], [x2, y2], [x3, y3], [x4, y4]]
-                            y_center = (bbox[0][1] + bbox[2][1]) / 2
-                            line_dict[round(y_center, 0)].append((bbox[0][0], text))
-                        # Sort lines by y, then words by x
-                        for y in sorted(line_dict.keys()):
-                            words = sorted(line_dict[y], key=lambda x: x[0])
-                            # Insert enough spaces between words to simulate columns
-                            line = ""
-                            prev_x = None
-                            for x, word in words:
-                                if prev_x is not None:
-                                    # Add spaces proportional to distance between words
-                                    gap = int((x - prev_x) // 15)
-                                    line += " " * max(1, gap)
-                                line += word
-                                prev_x = x + len(word) * 10  # crude estimate of word width
-                            extracted_text += line + "\n"
-                print(f"Extracted text length for {file.filename} (EasyOCR): {len(extracted_text)}")
-            except Exception as e:
-                print(f"OCR extraction failed for {file.filename} (EasyOCR): {e}")
-
-        # Always attempt to extract tables from extracted_text and merge with any found tables
-        if extracted_text:
-            def parse_tables_from_text(text):
-                import re
-                lines = [line for line in text.splitlines() if line.strip()]
-                tables_from_text = []
-                current_table = []
-                col_counts = []
-                for line in lines:
-                    # Try splitting by 2+ spaces or tab
-                    cells = re.split(r"\s{2,}|\t", line.strip())
-                    # If not enough columns, try splitting by single space
-                    if len(cells) <= 1:
-                        cells = [c for c in line.strip().split(" ") if c]
-                    # If still not enough, try splitting by comma
-                    if len(cells) <= 1 and "," in line:
-                        cells = [c.strip() for c in line.split(",")]
-                    # Heuristic: consider as table row if 2+ columns and at least one cell is not empty
-                    if len(cells) > 1 and any(cell.strip() for cell in cells):
-                        col_counts.append(len(cells))
-                        # If previous rows had a different column count, allow for some raggedness (tolerance of 1)
-                        if current_table:
-                            prev_cols = max(set(col_counts[-3:]), key=col_counts[-3:].count) if len(col_counts) >= 3 else col_counts[-1]
-                            if abs(len(cells) - prev_cols) > 1:
-                                if len(current_table) > 1:
-                                    tables_from_text.append(current_table)
-                                current_table = []
-                                col_counts = [len(cells)]
-                        current_table.append(cells)
-                    else:
-                        if current_table:
-                            if len(current_table) > 1:
-                                tables_from_text.append(current_table)
-                            current_table = []
-                            col_counts = []
-                if current_table and len(current_table) > 1:
-                    tables_from_text.append(current_table)
-                return tables_from_text
-            tables_from_text = parse_tables_from_text(extracted_text)
-            # Merge: only add tables that are not already present (by header row)
-            def table_header(table):
-                return tuple(str(cell).strip().lower() for cell in table[0]) if table and len(table) > 0 else tuple()
-            existing_headers = {table_header(t) for t in tables}
-            for t in tables_from_text:
-                if table_header(t) not in existing_headers:
-                    tables.append(t)
-
-        doc_id = str(uuid.uuid4())
-        extracted_doc = {
-            "id": doc_id,
-            "fileName": file.filename,
-            "fileType": file.content_type,
-            "fileSize": os.path.getsize(file_path),
-            "uploadDate": datetime.utcnow().isoformat(),
-            "extractedText": extracted_text,
-            "metadata": {
-                "wordCount": len(extracted_text.split()),
-                "characterCount": len(extracted_text),
-                "pageCount": len(reader.pages) if extracted_text else 0,
-                "language": "en",
-                "author": "Unknown",
-                "title": file.filename,
-                "subject": "",
-                "creator": "",
-                "creationDate": datetime.utcnow().isoformat(),
-                "modificationDate": datetime.utcnow().isoformat(),
-            },
-            "tables": tables,
-            "images": [],
-            "structure": {
-                "headings": [],
-                "paragraphs": [],
-                "lists": [],
-            },
-            "processingStatus": "completed",
-            "processingTime": 1000,
-            "accuracy": 95.0,
-            "errors": [],
-        }
-        # Save extracted data as JSON file
-        with open(os.path.join(UPLOAD_DIR, f"{doc_id}.json"), "w", encoding="utf-8") as jf:
-            json.dump(extracted_doc, jf, ensure_ascii=False, indent=2)
-        extracted_docs.append(extracted_doc)
+                with telemetry.timed(timings, "upload"):
+                    sha256, pdf_key, _ = await ingest.store_upload(file)
+            except ingest.UploadTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            telemetry.observe("extraction", timings)
+            spec = {
+                "fileName": file.filename,
+                "fileType": file.content_type,
+                "sha256": sha256,
+                "pdfKey": pdf_key,
+            }
+            specs.append(spec)
+            # Database and queue calls are blocking; keep them off the event loop
+            existing = await run_in_threadpool(documents.find_by_sha256, db, sha256)
+            if existing is not None:
+                # Same bytes were extracted before, reuse that result
+                del spec["pdfKey"]
+                spec["docId"] = existing.doc_id
+                spec["existing"] = documents.row_summary(existing)
+            else:
+                spec["docId"] = str(uuid.uuid4())
 
-    return {"documents": extracted_docs}
+        # Extraction is CPU heavy, hand it to the worker pool and return straight away
+        try:
+            job = await run_in_threadpool(extraction_queue.submit, specs)
+        except QueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    except BaseException:
+        # Nothing will be extracted from the PDFs this request stored
+        for spec in specs:
+            if spec.get("pdfKey"):
+                await run_in_threadpool(extraction_queue.discard_pdf, spec["sha256"], spec["pdfKey"])
+        raise
+    return {"jobId": job["id"], "job": job}
 
-@router.post("/compare/")
-async def compare_documents(doc1_id: str, doc2_id: str):
-    # Load extracted data for both documents from disk
-    doc1_path = os.path.join(UPLOAD_DIR, f"{doc1_id}.json")
-    doc2_path = os.path.join(UPLOAD_DIR, f"{doc2_id}.json")
-    if not os.path.exists(doc1_path) or not os.path.exists(doc2_path):
-        raise HTTPException(status_code=404, detail="One or both documents not found for comparison.")
+@router.post("/{doc_id}/reextract", status_code=202)
+def reextract_document(doc_id: str, pages: Optional[str] = None, db: Session = Depends(get_db)):
+    # Extract a stored document again with the current engine settings. Page results of stages whose
+    # settings did not change are reused; pages=1,5 (1-based) forces those pages to be redone.
+    row = documents.get_row(db, doc_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    pdf_key = ingest.pdf_key(row.sha256) if row.sha256 else None
+    if pdf_key is None or not storage.exists(pdf_key):
+        raise HTTPException(status_code=409, detail="The original PDF of this document is not stored.")
+    try:
+        redo = sorted({int(p) - 1 for p in pages.split(",") if p.strip()}) if pages else []
+    except ValueError:
+        raise HTTPException(status_code=400, detail="pages must be a comma separated list of page numbers.")
+    if any(p < 0 for p in redo):
+        raise HTTPException(status_code=400, detail="Page numbers start at 1.")
+    spec = {
+        "pdfKey": pdf_key,
+        "fileName": row.filename,
+        "fileType": row.file_type,
+        "sha256": row.sha256,
+        "docId": doc_id,
+        "reextract": True,
+        "redoPages": redo,
+    }
+    try:
+        job = extraction_queue.submit([spec])
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"jobId": job["id"], "job": job}
 
-    with open(doc1_path, "r", encoding="utf-8") as f1, open(doc2_path, "r", encoding="utf-8") as f2:
-        doc1 = json.load(f1)
-        doc2 = json.load(f2)
+@router.get("/compare/cache/stats")
+def compare_cache_stats():
+    # Hit/miss counters of this worker's comparison result cache
+    return {"cache": result_cache.stats()}
 
-    def compare_dicts(d1, d2, prefix=""):
-        diffs = []
-        for key in set(d1.keys()).intersection(d2.keys()):
-            v1, v2 = d1[key], d2[key]
-            field_name = f"{prefix}{key}"
-            if isinstance(v1, dict) and isinstance(v2, dict):
-                diffs.extend(compare_dicts(v1, v2, prefix=field_name + "."))
-            elif v1 != v2:
-                diffs.append({"field": field_name, "doc1": v1, "doc2": v2})
-        return diffs
+@router.post("/compare/batch")
+def compare_documents_batch(request: BatchCompareRequest, db: Session = Depends(get_db)):
+    # One reference against many documents, or all pairs within a set, streamed back as NDJSON
+    # (one JSON object per line) in completion order. Pairs are ranked and filtered by their MinHash
+    # estimate first, so only the pairs that survive topK/threshold are compared in full.
+    if request.mode is not None and request.mode not in text_compare.MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(text_compare.MODES)}.")
+    doc_ids = list(dict.fromkeys(request.docIds))
+    if request.referenceId is None and len(doc_ids) < 2:
+        raise HTTPException(status_code=400, detail="Provide a referenceId or at least two docIds.")
+    if len(doc_ids) > batch_compare.MAX_BATCH_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {batch_compare.MAX_BATCH_DOCUMENTS} documents per batch.")
+    if request.topK is not None and request.topK < 1:
+        raise HTTPException(status_code=400, detail="topK must be at least 1.")
+    requested = set(doc_ids) | ({request.referenceId} if request.referenceId else set())
+    rows = {row.doc_id: row for row in db.query(PDFFile).filter(PDFFile.doc_id.in_(requested))}
+    missing = sorted(requested - rows.keys())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Documents not found: {', '.join(missing)}")
 
-    differences = compare_dicts(doc1, doc2)
+    pairs = batch_compare.candidate_pairs(
+        doc_ids, reference_id=request.referenceId, top_k=request.topK, threshold=request.threshold
+    )
+    digests = {doc_id: row.content_digest for doc_id, row in rows.items()}
 
-    # --- Extracted Text Similarity and Diff ---
-    import difflib
-    text1 = doc1.get("extractedText", "") or ""
-    text2 = doc2.get("extractedText", "") or ""
-    seq = difflib.SequenceMatcher(None, text1, text2)
-    text_similarity = seq.ratio()
-    text_diff = list(difflib.unified_diff(
-        text1.splitlines(), text2.splitlines(),
-        fromfile="doc1", tofile="doc2", lineterm=""
-    ))
-    differences.append({
-        "field": "extractedText",
-        "similarity": text_similarity,
-        "diff": text_diff[:200],  # Limit diff lines for response size
-    })
+    def shape(result, estimated, cached):
+        line = {
+            "doc1Id": result["doc1Id"],
+            "doc2Id": result["doc2Id"],
+            "estimatedSimilarity": estimated,
+            "textSimilarity": result["textSimilarity"],
+            "similarityScore": result["similarityScore"],
+            "summary": result["summary"],
+            "cached": cached,
+        }
+        if request.details:
+            line["differences"] = result["differences"]
+        return json.dumps(line, ensure_ascii=False) + "\n"
 
-    # --- Table Comparison ---
-    def parse_tables_from_text(text):
-        import re
-        lines = [line for line in text.splitlines() if line.strip()]
-        tables_from_text = []
-        current_table = []
-        last_col_count = None
-        for line in lines:
-            cells = re.split(r"\s{2,}|\t", line.strip())
-            if len(cells) > 1 and any(cell.strip() for cell in cells):
-                if last_col_count is not None and len(cells) != last_col_count and current_table:
-                    if len(current_table) > 1:
-                        tables_from_text.append(current_table)
-                    current_table = []
-                current_table.append(cells)
-                last_col_count = len(cells)
-            else:
-                if current_table:
-                    if len(current_table) > 1:
-                        tables_from_text.append(current_table)
-                    current_table = []
-                last_col_count = None
-        if current_table and len(current_table) > 1:
-            tables_from_text.append(current_table)
-        return tables_from_text
+    def failed(doc1_id, doc2_id, error):
+        telemetry.count_error("compare", "pair")
+        return json.dumps({"doc1Id": doc1_id, "doc2Id": doc2_id, "error": str(error)}) + "\n"
 
-    tables1 = doc1.get("tables") if "tables" in doc1 else []
-    doc1_tables_fallback = False
-    extracted_text1 = doc1.get("extractedText", "")
-    print(f"[COMPARE] doc1 tables: {tables1} (type: {type(tables1)}), extractedText length: {len(extracted_text1)}")
-    if (not tables1 or (isinstance(tables1, list) and len(tables1) == 0)):
-        if extracted_text1 and extracted_text1.strip():
-            print(f"[COMPARE] Fallback: extracting tables from extractedText for doc1 ({doc1.get('id', 'unknown')})")
-            tables1 = parse_tables_from_text(extracted_text1)
-            print(f"[COMPARE] Extracted {len(tables1)} tables for doc1 fallback")
-            doc1["tables"] = tables1
-            doc1_tables_fallback = True
-        else:
-            print(f"[COMPARE] Skipping fallback for doc1: extractedText is empty or whitespace")
-    tables2 = doc2.get("tables") if "tables" in doc2 else []
-    doc2_tables_fallback = False
-    extracted_text2 = doc2.get("extractedText", "")
-    print(f"[COMPARE] doc2 tables: {tables2} (type: {type(tables2)}), extractedText length: {len(extracted_text2)}")
-    if (not tables2 or (isinstance(tables2, list) and len(tables2) == 0)):
-        if extracted_text2 and extracted_text2.strip():
-            print(f"[COMPARE] Fallback: extracting tables from extractedText for doc2 ({doc2.get('id', 'unknown')})")
-            tables2 = parse_tables_from_text(extracted_text2)
-            print(f"[COMPARE] Extracted {len(tables2)} tables for doc2 fallback")
-            doc2["tables"] = tables2
-            doc2_tables_fallback = True
-        else:
-            print(f"[COMPARE] Skipping fallback for doc2: extractedText is empty or whitespace")
+    async def stream():
+        # The request session is gone once streaming starts, so the cache gets its own. Cache lookups and
+        # writes run in the thread pool. Pairs go to the workers in blocks of the pair matrix (see
+        # batch_compare.blocks), at most BATCH_IN_FLIGHT blocks at a time: the rest are only submitted
+        # as results come back.
+        cache_db = SessionLocal()
 
-    # Persist fallback tables if extracted
-    if doc1_tables_fallback:
-        with open(doc1_path, "w", encoding="utf-8") as f1:
-            json.dump(doc1, f1, ensure_ascii=False, indent=2)
-    if doc2_tables_fallback:
-        with open(doc2_path, "w", encoding="utf-8") as f2:
-            json.dump(doc2, f2, ensure_ascii=False, indent=2)
+        def lookup(block):
+            # Cached results of a block's pairs, and the pairs still to compare
+            cached, uncached = [], []
+            for pair in block:
+                key = result_cache.key(digests[pair[0]], digests[pair[1]], request.mode)
+                result = result_cache.get(cache_db, key) if key else None
+                if result is not None:
+                    cached.append((pair, result))
+                else:
+                    uncached.append(pair)
+            return cached, uncached
 
-    table_diffs = []
-    used_doc2 = set()
+        def store(outcomes):
+            for (doc1_id, doc2_id, _), result, _, error in outcomes:
+                key = result_cache.key(digests[doc1_id], digests[doc2_id], request.mode)
+                if key and error is None:
+                    result_cache.put(cache_db, key, doc1_id, doc2_id, result)
 
-    def table_header(table):
-        # Use first row as header, fallback to empty tuple
-        return tuple(str(cell).strip().lower() for cell in table[0]) if table and len(table) > 0 else tuple()
+        # asyncio future -> (pairs, retried)
+        pending = {}
+        try:
+            cached_count = 0
+            errors = 0
+            remaining = iter(batch_compare.blocks(pairs))
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < batch_compare.BATCH_IN_FLIGHT:
+                    block = next(remaining, None)
+                    if block is None:
+                        exhausted = True
+                        break
+                    cached, uncached = await run_in_threadpool(lookup, block)
+                    for pair, result in cached:
+                        cached_count += 1
+                        yield shape({**result, "doc1Id": pair[0], "doc2Id": pair[1]}, pair[2], True)
+                    if not uncached:
+                        continue
+                    try:
+                        future = batch_compare.submit_block(uncached, request.mode, digests)
+                    except Exception as e:
+                        for pair in uncached:
+                            errors += 1
+                            yield failed(pair[0], pair[1], e)
+                        continue
+                    pending[asyncio.wrap_future(future)] = (uncached, False)
+                if not pending:
+                    break
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    block, retried = pending.pop(finished)
+                    try:
+                        outcomes = finished.result()
+                    except Exception as e:
+                        if isinstance(e, BrokenExecutor) and not retried:
+                            # A worker died and took every block in flight with it; run each of them once more
+                            try:
+                                future = batch_compare.submit_block(block, request.mode, digests)
+                                pending[asyncio.wrap_future(future)] = (block, True)
+                                continue
+                            except Exception as resubmit_error:
+                                e = resubmit_error
+                        for pair in block:
+                            errors += 1
+                            yield failed(pair[0], pair[1], e)
+                        continue
+                    await run_in_threadpool(store, outcomes)
+                    for (doc1_id, doc2_id, estimated), result, timings, error in outcomes:
+                        if error is not None:
+                            errors += 1
+                            yield failed(doc1_id, doc2_id, error)
+                            continue
+                        telemetry.observe("compare", timings)
+                        yield shape(result, estimated, False)
+            yield json.dumps({"done": True, "pairs": len(pairs), "cached": cached_count, "errors": errors}) + "\n"
+        finally:
+            # The client went away (or the stream failed): don't leave its blocks queued in the pool
+            for future in pending:
+                future.cancel()
+            cache_db.close()
 
-    def table_similarity(t1, t2):
-        # Compare headers, then content similarity (Jaccard index of rows)
-        h1, h2 = table_header(t1), table_header(t2)
-        if not h1 or not h2:
-            return 0
-        header_score = len(set(h1) & set(h2)) / max(len(h1), len(h2))
-        # Compare row sets (excluding header)
-        rows1 = set(tuple(str(cell).strip().lower() for cell in row) for row in t1[1:])
-        rows2 = set(tuple(str(cell).strip().lower() for cell in row) for row in t2[1:])
-        row_score = len(rows1 & rows2) / max(1, len(rows1 | rows2))
-        return 0.7 * header_score + 0.3 * row_score
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
-    # Match tables by header/content similarity
-    for i, t1 in enumerate(tables1):
-        best_score = 0
-        best_j = None
-        for j, t2 in enumerate(tables2):
-            if j in used_doc2:
-                continue
-            score = table_similarity(t1, t2)
-            if score > best_score:
-                best_score = score
-                best_j = j
-        if best_score > 0.5 and best_j is not None:
-            # Consider as matched tables
-            used_doc2.add(best_j)
-            t2 = tables2[best_j]
-            # Normalize: compare headers, then sets of rows (excluding header)
-            h1, h2 = table_header(t1), table_header(t2)
-            rows1 = [tuple(str(cell).strip().lower() for cell in row) for row in t1[1:]]
-            rows2 = [tuple(str(cell).strip().lower() for cell in row) for row in t2[1:]]
-            # Flatten all cell values for content similarity
-            def flatten_cells(table):
-                return set(str(cell).strip().lower() for row in table for cell in row)
-            flat1 = flatten_cells(t1)
-            flat2 = flatten_cells(t2)
-            overlap = len(flat1 & flat2)
-            total = max(1, len(flat1 | flat2))
-            content_similarity = overlap / total
-            if h1 == h2 and set(rows1) == set(rows2):
-                # Content equivalent, even if order differs
-                table_diffs.append({
-                    "tableIndexDoc1": i + 1,
-                    "tableIndexDoc2": best_j + 1,
-                    "header": list(h1),
-                    "contentEquivalent": True,
-                    "table": t1,
-                })
-            elif content_similarity > 0.7:
-                # Similar content, different structure
-                table_diffs.append({
-                    "tableIndexDoc1": i + 1,
-                    "tableIndexDoc2": best_j + 1,
-                    "header1": list(h1),
-                    "header2": list(h2),
-                    "similarContent": True,
-                    "similarityScore": round(content_similarity, 2),
-                    "table1": t1,
-                    "table2": t2,
-                })
-            else:
-                t1_str = "\n".join([",".join([str(cell) for cell in row]) for row in t1])
-                t2_str = "\n".join([",".join([str(cell) for cell in row]) for row in t2])
-                diff = list(difflib.unified_diff(
-                    t1_str.splitlines(), t2_str.splitlines(),
-                    fromfile=f"doc1_table_{i+1}", tofile=f"doc2_table_{best_j+1}", lineterm=""
-                ))
-                table_diffs.append({
-                    "tableIndexDoc1": i + 1,
-                    "tableIndexDoc2": best_j + 1,
-                    "header": list(h1),
-                    "diff": diff[:100],  # Limit diff lines for response size
-                })
-        else:
-            # No match found in doc2
-            table_diffs.append({
-                "tableIndexDoc1": i + 1,
-                "onlyIn": "doc1",
-                "header": list(table_header(t1)),
-                "table": t1,
-            })
-    # Any tables in doc2 not matched
-    for j, t2 in enumerate(tables2):
-        if j not in used_doc2:
-            table_diffs.append({
-                "tableIndexDoc2": j + 1,
-                "onlyIn": "doc2",
-                "header": list(table_header(t2)),
-                "table": t2,
-            })
-    if table_diffs:
-        differences.append({
-            "field": "tables",
-            "tableDiffs": table_diffs,
-        })
+@router.post("/compare/")
+def compare_documents(doc1_id: str, doc2_id: str, mode: Optional[str] = None, db: Session = Depends(get_db)):
+    if mode is not None and mode not in text_compare.MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(text_compare.MODES)}.")
+    row1 = documents.get_row(db, doc1_id)
+    row2 = documents.get_row(db, doc2_id)
+    if row1 is None or row2 is None:
+        raise HTTPException(status_code=404, detail="One or both documents not found for comparison.")
 
-    # Calculate similarity score as percent of matching fields (excluding text similarity)
-    total_fields = len(differences) + 1  # +1 to avoid division by zero
-    similarity_score = 1.0 - (len(differences) / total_fields)
+    # Results are keyed by the extraction digests, so a re-extracted document never hits a stale entry
+    cache_key = result_cache.key(row1.content_digest, row2.content_digest, mode)
+    cached = result_cache.get(db, cache_key) if cache_key else None
+    if cached is not None:
+        return {"result": {**cached, "doc1Id": doc1_id, "doc2Id": doc2_id}}
 
-    summary = (
-        f"Documents are {(similarity_score * 100):.1f}% similar. "
-        f"Found {len(differences)} differing field(s)."
-        if differences else "Documents are identical."
-    )
-    summary += f" Extracted text similarity: {(text_similarity * 100):.1f}%."
+    # Load extracted data for both documents
+    timings = {}
+    with telemetry.timed(timings, "load"):
+        doc1 = documents.read_body(doc1_id)
+        doc2 = documents.read_body(doc2_id)
+        index1 = documents.read_index(doc1_id)
+        index2 = documents.read_index(doc2_id)
+    if doc1 is None or doc2 is None:
+        raise HTTPException(status_code=404, detail="One or both documents not found for comparison.")
 
-    comparison_result = {
-        "doc1Id": doc1_id,
-        "doc2Id": doc2_id,
-        "similarityScore": similarity_score,
-        "textSimilarity": text_similarity,
-        "differences": differences,
-        "summary": summary,
-    }
+    # Reads the bodies and the comparison indexes written at ingestion; never writes them
+    comparison_result = comparison.compare(doc1, doc2, index1, index2, mode=mode, timings=timings)
+    telemetry.observe("compare", timings)
+    if cache_key:
+        result_cache.put(db, cache_key, doc1_id, doc2_id, comparison_result)
     return {"result": comparison_result}
@@ -0,0 +1,236 @@
+import re
+from datetime import datetime
+
+from sqlalchemy import case, delete, func, select, update
+
+from models import DocumentRollup, MonthlyRollup
+
+# Monthly rollups of ExtractedData. Every stored document adds its per-(key, month) aggregates to
+# monthly_rollups in the same transaction as its rows, and keeps them in document_rollups so a
+# re-extraction can subtract them again. Reads only touch the rollup rows they return.
+
+_MONTH = re.compile(r"(?:19|20)\d{2}-(?:0[1-9]|1[0-2])")
+_NUMBER = re.compile(r"(?:\d+(?:\.\d*)?|\.\d+)")
+_CURRENCY = "$€£¥"
+_DELTA_FIELDS = ("value_count", "numeric_count", "total")
+
+
+def is_month(text):
+    return bool(text) and _MONTH.fullmatch(text) is not None
+
+
+def previous_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year - 1}-12" if number == 1 else f"{year}-{number - 1:02d}"
+
+
+def parse_number(value):
+    # Numeric value of a table cell ("1,234.50", "$12", "-3.5%", "(200)" for -200), or None
+    text = (value or "").strip()
+    negative = text.startswith("(") and text.endswith(")")
+    if negative:
+        text = text[1:-1].strip()
+    if text[:1] in ("+", "-"):
+        negative = negative != (text[0] == "-")
+        text = text[1:]
+    text = text.strip(_CURRENCY + "% ").replace(",", "")
+    if not _NUMBER.fullmatch(text):
+        return None
+    number = float(text)
+    return -number if negative else number
+
+
+def document_groups(rows):
+    # (key, value, month) triples -> {(key, month): aggregates}; rows without a month are not rolled up
+    groups = {}
+    for key, value, month in rows:
+        if not month:
+            continue
+        group = groups.get((key, month))
+        if group is None:
+            group = groups[(key, month)] = {
+                "value_count": 0, "numeric_count": 0, "total": 0.0, "min_value": None, "max_value": None,
+            }
+        group["value_count"] += 1
+        number = parse_number(value)
+        if number is None:
+            continue
+        group["numeric_count"] += 1
+        group["total"] += number
+        if group["min_value"] is None or number < group["min_value"]:
+            group["min_value"] = number
+        if group["max_value"] is None or number > group["max_value"]:
+            group["max_value"] = number
+    return groups
+
+
+def _insert(dialect):
+    # INSERT construct with an upsert clause for the dialects the service runs on
+    if dialect == "mysql":
+        from sqlalchemy.dialects.mysql import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+
+def _merge_bound(current, new, smaller):
+    # The bound of current and new, ignoring NULLs
+    better = new < current if smaller else new > current
+    return case((new.is_(None), current), (current.is_(None), new), (better, new), else_=current)
+
+
+def _add_deltas(db, deltas):
+    # Add each delta to its (key, month) rollup in one statement per batch; concurrent workers never
+    # overwrite each other's counts because the addition happens in the database
+    if not deltas:
+        return
+    table = MonthlyRollup.__table__
+    dialect = db.get_bind().dialect.name
+    statement = _insert(dialect)(table)
+    new = statement.inserted if dialect == "mysql" else statement.excluded
+    # Every assignment reads only its own column (MySQL applies them left to right)
+    merged = {name: table.c[name] + new[name] for name in _DELTA_FIELDS + ("document_count",)}
+    merged["min_value"] = _merge_bound(table.c.min_value, new.min_value, smaller=True)
+    merged["max_value"] = _merge_bound(table.c.max_value, new.max_value, smaller=False)
+    merged["updated_at"] = new.updated_at
+    if dialect == "mysql":
+        statement = statement.on_duplicate_key_update(**merged)
+    else:
+        statement = statement.on_conflict_do_update(index_elements=["key", "month"], set_=merged)
+    db.execute(statement, deltas)
+
+
+def apply_document(db, pdf_file_id, rows):
+    # Replace the document's contribution to the monthly rollups with the one of rows. Runs inside the
+    # caller's transaction (services.extracted_data.store_rows) and does not commit.
+    groups = document_groups(rows)
+    contributions = DocumentRollup.__table__
+    old = {
+        (row.key, row.month): row._mapping
+        for row in db.execute(select(contributions).where(contributions.c.pdf_file_id == pdf_file_id))
+    }
+    if old:
+        db.execute(delete(contributions).where(contributions.c.pdf_file_id == pdf_file_id))
+    if groups:
+        db.execute(contributions.insert(), [
+            {"pdf_file_id": pdf_file_id, "key": key, "month": month, **group}
+            for (key, month), group in groups.items()
+        ])
+
+    now = datetime.utcnow()
+    deltas = []
+    # Groups whose min/max may have come from the removed contribution
+    rebound = []
+    for key, month in set(old) | set(groups):
+        before, after = old.get((key, month)), groups.get((key, month))
+        if before is not None and after is not None and all(before[name] == after[name] for name in after):
+            continue
+        delta = {"key": key, "month": month, "updated_at": now,
+                 "document_count": (after is not None) - (before is not None),
+                 "min_value": after["min_value"] if after else None,
+                 "max_value": after["max_value"] if after else None}
+        for name in _DELTA_FIELDS:
+            delta[name] = (after[name] if after else 0) - (before[name] if before else 0)
+        deltas.append(delta)
+        if before is not None and before["numeric_count"]:
+            rebound.append((key, month))
+    _add_deltas(db, deltas)
+
+    table = MonthlyRollup.__table__
+    for key, month in rebound:
+        same_group = (contributions.c.key == key) & (contributions.c.month == month)
+        db.execute(update(table).where(table.c.key == key, table.c.month == month).values(
+            min_value=select(func.min(contributions.c.min_value)).where(same_group).scalar_subquery(),
+            max_value=select(func.max(contributions.c.max_value)).where(same_group).scalar_subquery(),
+        ))
+    for key, month in set(old) - set(groups):
+        db.execute(delete(table).where(table.c.key == key, table.c.month == month, table.c.value_count <= 0))
+
+
+def clear(db):
+    # Drop every rollup (before a rebuild); does not commit
+    db.execute(delete(MonthlyRollup.__table__))
+    db.execute(delete(DocumentRollup.__table__))
+
+
+def rollup_dict(rollup, previous=None):
+    # API shape of one MonthlyRollup row, with the change from the previous month's row when given
+    result = {
+        "key": rollup.key,
+        "month": rollup.month,
+        "count": rollup.value_count,
+        "numericCount": rollup.numeric_count,
+        "documentCount": rollup.document_count,
+        "total": rollup.total if rollup.numeric_count else None,
+        "min": rollup.min_value,
+        "max": rollup.max_value,
+        "average": rollup.total / rollup.numeric_count if rollup.numeric_count else None,
+        "previousMonth": None,
+        "change": None,
+        "changePercent": None,
+    }
+    if previous is not None:
+        result["previousMonth"] = previous.month
+        if rollup.numeric_count and previous.numeric_count:
+            result["change"] = rollup.total - previous.total
+            if previous.total:
+                result["changePercent"] = round(100 * result["change"] / abs(previous.total), 2)
+    return result
+
+
+def list_months(db):
+    # Every month with rollups, newest first, with its number of keys and values
+    rows = (
+        db.query(MonthlyRollup.month, func.count(MonthlyRollup.id), func.sum(MonthlyRollup.value_count))
+        .group_by(MonthlyRollup.month)
+        .order_by(MonthlyRollup.month.desc())
+    )
+    return [{"month": month, "keys": keys, "count": int(count or 0)} for month, keys, count in rows]
+
+
+def month_rollups(db, month, compare_to=None, prefix=None, cursor=None, limit=50):
+    # One page of the month's rollups in key order, each with its change from compare_to (by default
+    # the previous calendar month). Pass the returned cursor back for the next page.
+    compare_to = compare_to or previous_month(month)
+    query = db.query(MonthlyRollup).filter(MonthlyRollup.month == month)
+    if prefix:
+        query = query.filter(MonthlyRollup.key.startswith(prefix, autoescape=True))
+    if cursor:
+        query = query.filter(MonthlyRollup.key > cursor)
+    rows = query.order_by(MonthlyRollup.key).limit(limit + 1).all()
+    next_cursor = rows[limit - 1].key if len(rows) > limit else None
+    rows = rows[:limit]
+    previous = {}
+    if rows:
+        previous = {
+            row.key: row
+            for row in db.query(MonthlyRollup).filter(
+                MonthlyRollup.month == compare_to, MonthlyRollup.key.in_([row.key for row in rows]))
+        }
+    return [rollup_dict(row, previous.get(row.key)) for row in rows], next_cursor
+
+
+def key_series(db, key, start=None, end=None, limit=120):
+    # The key's rollups month by month (oldest first), each with its change from the preceding month
+    # that has data, looking one month before start so the first entry has a change as well
+    query = db.query(MonthlyRollup).filter(MonthlyRollup.key == key)
+    if start:
+        query = query.filter(MonthlyRollup.month >= start)
+    if end:
+        query = query.filter(MonthlyRollup.month <= end)
+    rows = query.order_by(MonthlyRollup.month).limit(limit).all()
+    previous = None
+    if rows and start:
+        previous = (
+            db.query(MonthlyRollup)
+            .filter(MonthlyRollup.key == key, MonthlyRollup.month < start)
+            .order_by(MonthlyRollup.month.desc())
+            .first()
+        )
+    series = []
+    for row in rows:
+        series.append(rollup_dict(row, previous))
+        previous = row
+    return series
@@ -0,0 +1,175 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from services import compare_index, comparison, documents, telemetry
+
+# Processes used for the pairwise work of batch comparisons
+COMPARE_WORKERS = int(os.getenv("COMPARE_WORKERS", str(os.cpu_count() or 1)))
+# Largest number of documents accepted in one batch request
+MAX_BATCH_DOCUMENTS = int(os.getenv("MAX_BATCH_DOCUMENTS", "1000"))
+# Documents each worker keeps loaded, so a reference document is read and normalised once per worker
+WORKER_DOCUMENT_CACHE_SIZE = int(os.getenv("WORKER_DOCUMENT_CACHE_SIZE", "32"))
+# Blocks of pairs of one batch request submitted to the pool at a time (keeps the workers busy without
+# queueing every pair of a large batch up front)
+BATCH_IN_FLIGHT = int(os.getenv("BATCH_IN_FLIGHT", str(2 * max(1, COMPARE_WORKERS))))
+# Documents on each side of a block of the pair matrix; one worker compares a whole block, so both
+# sides together should fit in WORKER_DOCUMENT_CACHE_SIZE
+BATCH_BLOCK_SIZE = int(os.getenv("BATCH_BLOCK_SIZE", str(max(1, WORKER_DOCUMENT_CACHE_SIZE // 2))))
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_loaded = OrderedDict()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=max(1, COMPARE_WORKERS))
+        return _executor
+
+
+def _replace_executor(broken):
+    # A worker process died: the pool refuses all further work, so the next submission starts a new one
+    global _executor
+    with _executor_lock:
+        if _executor is not broken:
+            return
+        _executor = None
+    logger.warning("compare worker pool broken, starting a new one")
+    broken.shutdown(wait=False)
+
+
+def _on_block_done(executor, future):
+    if not future.cancelled() and isinstance(future.exception(), BrokenExecutor):
+        _replace_executor(executor)
+
+
+def submit_block(pairs, mode=None, digests=None):
+    # compare_block on the worker pool. A pool broken by a dead worker is replaced, whether that shows at
+    # submission or in the result; the blocks it lost fail with BrokenExecutor and may be submitted again.
+    digests = digests or {}
+    # Only the block's own digests travel to the worker
+    digests = {doc_id: digests.get(doc_id) for pair in pairs for doc_id in pair[:2]}
+    for attempt in range(2):
+        executor = get_executor()
+        try:
+            future = executor.submit(compare_block, pairs, mode, digests)
+        except BrokenExecutor:
+            if attempt:
+                raise
+            _replace_executor(executor)
+            continue
+        future.add_done_callback(partial(_on_block_done, executor))
+        return future
+
+
+def shutdown(wait=True):
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
+            _executor = None
+
+
+def _load(doc_id, digest=None):
+    # Worker-side LRU of (body, comparison index), keyed by the extraction's content digest so a
+    # re-extracted document is read again. Documents without a digest are never kept.
+    key = (doc_id, digest)
+    entry = _loaded.get(key) if digest else None
+    if entry is None:
+        doc = documents.read_body(doc_id)
+        if doc is None:
+            raise LookupError(f"Document {doc_id} not found.")
+        entry = (doc, compare_index.index_for(doc, documents.read_index(doc_id)))
+        if digest:
+            # Older extractions of the document are not asked for again
+            for stale in [k for k in _loaded if k[0] == doc_id]:
+                del _loaded[stale]
+            _loaded[key] = entry
+            while len(_loaded) > WORKER_DOCUMENT_CACHE_SIZE:
+                _loaded.popitem(last=False)
+    else:
+        _loaded.move_to_end(key)
+    return entry
+
+
+def compare_pair(doc1_id, doc2_id, mode=None, digest1=None, digest2=None):
+    # Runs in the worker pool; returns (result, stage timings) so the API process can record the metrics.
+    # digest1/digest2 are the documents' content digests as the request saw them.
+    timings = {}
+    with telemetry.timed(timings, "load"):
+        doc1, index1 = _load(doc1_id, digest1)
+        doc2, index2 = _load(doc2_id, digest2)
+    return comparison.compare_loaded(doc1, doc2, index1, index2, mode, timings), timings
+
+
+def signature(doc_id):
+    # MinHash signature of a document, from its stored index when it is current
+    index = compare_index.load_index(documents.read_index(doc_id))
+    if index is None:
+        doc = documents.read_body(doc_id)
+        index = compare_index.index_for(doc or {}, None)
+    return index["minhash"]
+
+
+def compare_block(pairs, mode=None, digests=None):
+    # Runs in the worker pool: every (doc1_id, doc2_id, estimate) pair of one block, each loaded document
+    # reused from the LRU. Returns (pair, result, timings, error message) per pair; one failing pair
+    # doesn't fail the block.
+    digests = digests or {}
+    outcomes = []
+    for pair in pairs:
+        try:
+            result, timings = compare_pair(pair[0], pair[1], mode, digests.get(pair[0]), digests.get(pair[1]))
+            outcomes.append((pair, result, timings, None))
+        except Exception as e:
+            outcomes.append((pair, None, None, str(e) or type(e).__name__))
+    return outcomes
+
+
+def blocks(pairs, size=None):
+    # Split the pairs of a batch into blocks of the pair matrix with at most size documents on each side,
+    # in row order. A worker compares a whole block, so it loads each of the block's documents once, and
+    # a document is loaded about 2 * len(documents) / size times per batch instead of once per pair.
+    size = max(1, size or BATCH_BLOCK_SIZE)
+    position = {}
+    for doc1_id, doc2_id, _ in pairs:
+        position.setdefault(doc1_id, len(position))
+        position.setdefault(doc2_id, len(position))
+    grouped = {}
+    for pair in pairs:
+        i, j = position[pair[0]], position[pair[1]]
+        grouped.setdefault((i // size, j // size), []).append(pair)
+    return [grouped[key] for key in sorted(grouped)]
+
+
+def candidate_pairs(doc_ids, reference_id=None, top_k=None, threshold=0.0):
+    # Score every requested pair by MinHash agreement (vectorised, no text or diffs touched),
+    # then keep the ones reaching threshold, best first, at most top_k.
+    # Returns a list of (doc1_id, doc2_id, estimated_similarity).
+    ids = list(dict.fromkeys(doc_ids))
+    if reference_id is not None and reference_id not in ids:
+        ids.insert(0, reference_id)
+    signatures = np.vstack([signature(doc_id) for doc_id in ids]) if ids else np.empty((0, 0))
+    position = {doc_id: i for i, doc_id in enumerate(ids)}
+    pairs = []
+    if reference_id is not None:
+        ref = position[reference_id]
+        scores = (signatures == signatures[ref]).mean(axis=1)
+        pairs = [(reference_id, doc_id, float(scores[i])) for doc_id, i in position.items() if i != ref]
+    else:
+        for i in range(len(ids) - 1):
+            scores = (signatures[i + 1:] == signatures[i]).mean(axis=1)
+            pairs.extend((ids[i], ids[i + 1 + k], float(score)) for k, score in enumerate(scores))
+    pairs = [pair for pair in pairs if pair[2] >= threshold]
+    pairs.sort(key=lambda pair: pair[2], reverse=True)
+    return pairs[:top_k] if top_k is not None else pairs
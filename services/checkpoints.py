@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from services import storage
+
+# Per-page extraction results, kept per PDF (by content hash) so an interrupted or repeated
+# extraction only redoes the pages it has no result for
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", os.path.join(storage.UPLOAD_DIR, "checkpoints"))
+# "true" keeps the page results once the document is stored, so re-extraction with other settings
+# reuses the stages those settings don't affect. By default they are deleted when extraction completes
+# (the stored body holds the same text).
+CHECKPOINT_RETAIN = os.getenv("CHECKPOINT_RETAIN", "false").lower() == "true"
+# Marks the worker process extracting a PDF; its modification time is the last sign of progress
+WORKER_FILE = "worker.json"
+
+
+def settings_key(settings):
+    # Short stable key of the engine settings a stage's output depends on
+    raw = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class PageCheckpoint:
+    # One append-only JSON-lines file per (stage, settings); every line is {"page": i, ...result}.
+    # Lines are flushed as pages finish, so a killed worker loses at most the pages in progress.
+    # A torn last line is ignored when loading.
+
+    def __init__(self, sha256, directory=CHECKPOINT_DIR):
+        self.directory = os.path.join(directory, sha256)
+        self._lock = threading.Lock()
+        self._handles = {}
+
+    def _path(self, stage, settings):
+        return os.path.join(self.directory, f"{stage}-{settings_key(settings)}.jsonl")
+
+    def load(self, stage, settings):
+        # {page index: result} of the pages already done for this stage and settings
+        path = self._path(stage, settings)
+        done = {}
+        if not os.path.exists(path):
+            return done
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                done[record.pop("page")] = record
+        return done
+
+    def save(self, stage, settings, page, result):
+        # Safe to call from several threads (OCR pages finish concurrently)
+        line = json.dumps({"page": page, **result}, ensure_ascii=False) + "\n"
+        path = self._path(stage, settings)
+        with self._lock:
+            handle = self._handles.get(path)
+            if handle is None:
+                os.makedirs(self.directory, exist_ok=True)
+                handle = self._handles[path] = open(path, "a", encoding="utf-8")
+                # A torn line from an earlier crash must not swallow the first new record
+                if handle.tell() and not _ends_with_newline(path):
+                    handle.write("\n")
+            handle.write(line)
+            handle.flush()
+
+    def claim(self):
+        # Record the extracting process, so a stalled attempt can be found and stopped (see progress)
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, WORKER_FILE), "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid()}, f)
+
+    def touch(self):
+        # Progress without a new page result (a stage starting, or the document being stored)
+        try:
+            os.utime(os.path.join(self.directory, WORKER_FILE))
+        except OSError:
+            pass
+
+    def release(self):
+        release(os.path.basename(self.directory), os.path.dirname(self.directory))
+
+    def discard(self, pages):
+        # Forget the given pages in every stage, so the next extraction redoes them
+        pages = set(pages)
+        self.close()
+        if not pages or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(self.directory, name)
+            with open(path, "r", encoding="utf-8") as f:
+                kept = [line for line in f if _page_of(line) not in pages]
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                f.writelines(kept)
+            os.replace(f"{path}.tmp", path)
+
+    def close(self):
+        with self._lock:
+            for handle in self._handles.values():
+                handle.close()
+            self._handles = {}
+
+    def clear(self):
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def progress(sha256, directory=CHECKPOINT_DIR):
+    # (pid, seconds since the last page result or touch) of the attempt extracting sha256, or None
+    path = os.path.join(directory, sha256)
+    try:
+        with open(os.path.join(path, WORKER_FILE), "r", encoding="utf-8") as f:
+            pid = json.load(f)["pid"]
+        last = max(os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path))
+    except (OSError, ValueError, KeyError):
+        return None
+    return pid, time.time() - last
+
+
+def release(sha256, directory=CHECKPOINT_DIR):
+    try:
+        os.remove(os.path.join(directory, sha256, WORKER_FILE))
+    except OSError:
+        pass
+
+
+def _ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def _page_of(line):
+    try:
+        return json.loads(line)["page"]
+    except (ValueError, KeyError):
+        return None
@@ -0,0 +1,103 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from models import ComparisonCache
+from services import compare_index, text_compare
+
+# Bump when comparison output changes so cached results from older code are not served
+COMPARE_ENGINE_VERSION = "3"
+# Entries kept in the per-process LRU
+COMPARE_CACHE_SIZE = int(os.getenv("COMPARE_CACHE_SIZE", "512"))
+# Also keep results in the comparison_cache table, shared by all workers and kept across restarts
+COMPARE_CACHE_PERSIST = os.getenv("COMPARE_CACHE_PERSIST", "false").lower() == "true"
+
+
+class ResultCache:
+    def __init__(self, max_size=COMPARE_CACHE_SIZE, persist=COMPARE_CACHE_PERSIST):
+        self.max_size = max_size
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {"memoryHits": 0, "persistentHits": 0, "misses": 0, "invalidations": 0}
+
+    def key(self, digest1, digest2, mode=None):
+        # None when either document predates content digests, which disables caching for the pair
+        if not digest1 or not digest2:
+            return None
+        raw = f"{COMPARE_ENGINE_VERSION}:{compare_index.INDEX_VERSION}:{mode or text_compare.COMPARE_MODE}:{digest1}:{digest2}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, db, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["memoryHits"] += 1
+                return entry[2]
+        if self.persist:
+            row = db.query(ComparisonCache).filter(ComparisonCache.cache_key == key).first()
+            if row is not None:
+                result = json.loads(row.result)
+                self._remember(key, row.doc1_id, row.doc2_id, result)
+                with self._lock:
+                    self._stats["persistentHits"] += 1
+                return result
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, db, key, doc1_id, doc2_id, result):
+        self._remember(key, doc1_id, doc2_id, result)
+        if self.persist:
+            db.add(ComparisonCache(
+                cache_key=key, doc1_id=doc1_id, doc2_id=doc2_id,
+                result=json.dumps(result, ensure_ascii=False),
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker stored the same comparison first
+                db.rollback()
+
+    def _remember(self, key, doc1_id, doc2_id, result):
+        with self._lock:
+            self._entries[key] = (doc1_id, doc2_id, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, db, doc_id):
+        # Drop every cached comparison involving doc_id (called when a document is re-extracted)
+        with self._lock:
+            stale = [k for k, (d1, d2, _) in self._entries.items() if doc_id in (d1, d2)]
+            for k in stale:
+                del self._entries[k]
+            self._stats["invalidations"] += len(stale)
+        if self.persist and db is not None:
+            removed = db.query(ComparisonCache).filter(
+                or_(ComparisonCache.doc1_id == doc_id, ComparisonCache.doc2_id == doc_id)
+            ).delete(synchronize_session=False)
+            db.commit()
+            with self._lock:
+                self._stats["invalidations"] += removed
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["memoryHits"] + self._stats["persistentHits"] + self._stats["misses"]
+            hits = lookups - self._stats["misses"]
+            return {
+                **self._stats,
+                "size": len(self._entries),
+                "maxSize": self.max_size,
+                "persistent": self.persist,
+                "hitRate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+result_cache = ResultCache()
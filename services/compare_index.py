@@ -0,0 +1,95 @@
+import hashlib
+
+import numpy as np
+
+from services import table_compare, table_detect, text_compare
+
+# Bump whenever the layout or the hashing of the index changes; stale indexes are rebuilt in memory
+INDEX_VERSION = 3
+
+
+def line_hash(line):
+    return int.from_bytes(hashlib.blake2b(line.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def comparison_tables(doc):
+    # Tables used for comparison: the extracted ones, or tables parsed from the text when there are none
+    tables = doc.get("tables") or []
+    if not tables:
+        text = doc.get("extractedText") or ""
+        if text.strip():
+            tables = table_detect.detect_tables(text)
+    return tables
+
+
+def index_tables(doc, index):
+    # Tables to compare: those parsed from the text are kept in the index, extracted ones only in the body
+    tables = index.get("tables")
+    return tables if tables is not None else doc.get("tables") or []
+
+
+def build_index(doc):
+    # Everything compare needs that only depends on one document, computed once at ingestion
+    text = doc.get("extractedText") or ""
+    tables = comparison_tables(doc)
+    fallback_tables = tables if tables and not doc.get("tables") else None
+    fingerprints = table_compare.fingerprint_tables(tables)
+    text_shingles = text_compare.shingle_hashes(text)
+    # Corpus search signature: text shingles plus table rows (folded to the same 32-bit space)
+    row_hashes = [fp["rowHashes"] & np.uint64(0xFFFFFFFF) for fp in fingerprints]
+    search_hashes = np.unique(np.concatenate([text_shingles] + row_hashes))
+    return {
+        "version": INDEX_VERSION,
+        "shingleSize": text_compare.COMPARE_SHINGLE_SIZE,
+        "numPerm": text_compare.COMPARE_NUM_PERM,
+        "docId": doc.get("id"),
+        "sha256": doc.get("sha256"),
+        "textLength": len(text),
+        "lineHashes": [line_hash(line) for line in text.splitlines()],
+        "minhash": text_compare.minhash(text_shingles).tolist(),
+        "searchMinhash": text_compare.minhash(search_hashes).tolist(),
+        # Only the text fallback, which the body doesn't have; None means use the body's tables
+        "tables": fallback_tables,
+        "tableFingerprints": [
+            {
+                "header": fp["header"],
+                "headerLength": fp["headerLength"],
+                "headerHashes": fp["headerHashes"].tolist(),
+                "rowHashes": fp["rowHashes"].tolist(),
+                "cellHashes": fp["cellHashes"].tolist(),
+            }
+            for fp in fingerprints
+        ],
+        "headerKeys": sorted({"|".join(fp["header"]) for fp in fingerprints if fp["header"]}),
+    }
+
+
+def load_index(stored):
+    # Turn a stored index back into arrays; returns None when it was built by another version or sketch setup
+    if not stored or stored.get("version") != INDEX_VERSION:
+        return None
+    if (stored.get("shingleSize"), stored.get("numPerm")) != (text_compare.COMPARE_SHINGLE_SIZE, text_compare.COMPARE_NUM_PERM):
+        return None
+    return {
+        **stored,
+        "minhash": np.array(stored["minhash"], dtype=np.uint64),
+        "searchMinhash": np.array(stored["searchMinhash"], dtype=np.uint64),
+        "tableFingerprints": [
+            {
+                "header": fp["header"],
+                "headerLength": fp["headerLength"],
+                "headerHashes": np.array(fp["headerHashes"], dtype=np.uint64),
+                "rowHashes": np.array(fp["rowHashes"], dtype=np.uint64),
+                "cellHashes": np.array(fp["cellHashes"], dtype=np.uint64),
+            }
+            for fp in stored["tableFingerprints"]
+        ],
+    }
+
+
+def index_for(doc, stored):
+    # Stored index when it is current, otherwise one built in memory (never written back from compare)
+    index = load_index(stored)
+    if index is None:
+        index = load_index(build_index(doc))
+    return index
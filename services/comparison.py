@@ -0,0 +1,85 @@
+from services import compare_index, table_compare, telemetry, text_compare
+
+# Measurements of the extraction run and text positions already covered by the text diff,
+# left out of the field comparison
+IGNORED_FIELDS = {"processingTime", "processingStages", "pageOffsets"}
+
+
+def compare_dicts(d1, d2, prefix=""):
+    diffs = []
+    for key in set(d1.keys()).intersection(d2.keys()) - IGNORED_FIELDS:
+        v1, v2 = d1[key], d2[key]
+        field_name = f"{prefix}{key}"
+        if isinstance(v1, dict) and isinstance(v2, dict):
+            diffs.extend(compare_dicts(v1, v2, prefix=field_name + "."))
+        elif v1 != v2:
+            diffs.append({"field": field_name, "doc1": v1, "doc2": v2})
+    return diffs
+
+
+def compare(doc1, doc2, index1=None, index2=None, mode=None, timings=None):
+    # Compare two stored documents using their precomputed comparison indexes (as stored).
+    # Read-only: indexes missing or built by an older version are rebuilt in memory only.
+    # When given, timings receives the seconds spent in each stage (see telemetry.timed).
+    timings = {} if timings is None else timings
+    with telemetry.timed(timings, "index"):
+        index1 = compare_index.index_for(doc1, index1)
+        index2 = compare_index.index_for(doc2, index2)
+    return compare_loaded(doc1, doc2, index1, index2, mode, timings)
+
+
+def compare_loaded(doc1, doc2, index1, index2, mode=None, timings=None):
+    # Same as compare() for indexes already turned into arrays by compare_index.index_for
+    timings = {} if timings is None else timings
+    with telemetry.timed(timings, "fields"):
+        differences = compare_dicts(doc1, doc2)
+
+    # --- Extracted Text Similarity and Diff ---
+    text1 = doc1.get("extractedText", "") or ""
+    text2 = doc2.get("extractedText", "") or ""
+    # Line-level patience diff over the stored line hashes; similarity is exact or MinHash-estimated
+    with telemetry.timed(timings, "text"):
+        text_similarity, text_diff, text_mode = text_compare.compare_text(
+            text1, text2, mode=mode, diff_limit=200,  # Limit diff lines for response size
+            keys1=index1["lineHashes"], keys2=index2["lineHashes"],
+            signature1=index1["minhash"], signature2=index2["minhash"],
+        )
+    differences.append({
+        "field": "extractedText",
+        "similarity": text_similarity,
+        "similarityMode": text_mode,
+        "diff": text_diff,
+    })
+
+    # --- Table Comparison ---
+    # Tables (the body's, or the text fallback kept in the index) and their fingerprints
+    with telemetry.timed(timings, "tables"):
+        table_diffs = table_compare.compare_tables(
+            compare_index.index_tables(doc1, index1), compare_index.index_tables(doc2, index2),
+            fingerprints1=index1["tableFingerprints"], fingerprints2=index2["tableFingerprints"],
+        )
+    if table_diffs:
+        differences.append({
+            "field": "tables",
+            "tableDiffs": table_diffs,
+        })
+
+    # Calculate similarity score as percent of matching fields (excluding text similarity)
+    total_fields = len(differences) + 1  # +1 to avoid division by zero
+    similarity_score = 1.0 - (len(differences) / total_fields)
+
+    summary = (
+        f"Documents are {(similarity_score * 100):.1f}% similar. "
+        f"Found {len(differences)} differing field(s)."
+        if differences else "Documents are identical."
+    )
+    summary += f" Extracted text similarity: {(text_similarity * 100):.1f}%."
+
+    return {
+        "doc1Id": doc1.get("id"),
+        "doc2Id": doc2.get("id"),
+        "similarityScore": similarity_score,
+        "textSimilarity": text_similarity,
+        "differences": differences,
+        "summary": summary,
+    }
@@ -0,0 +1,220 @@
+import json
+import os
+import struct
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# How new document bodies are written:
+#   "json"    compact JSON plus a layout sidecar; served to clients without re-encoding
+#   "msgpack" binary container: a small header (every field but the text and tables) followed by one
+#             block per page of text and one columnar block per table
+DOCUMENT_FORMAT = os.getenv("DOCUMENT_FORMAT", "json")
+# "zstd" compresses every block of the binary container, "none" leaves them as they are
+DOCUMENT_COMPRESSION = os.getenv("DOCUMENT_COMPRESSION", "none")
+DOCUMENT_ZSTD_LEVEL = int(os.getenv("DOCUMENT_ZSTD_LEVEL", "3"))
+
+FORMATS = ("json", "msgpack")
+COMPRESSIONS = ("none", "zstd")
+
+MAGIC = b"UDOC"
+CONTAINER_VERSION = 1
+# magic, container version, compression (0 none, 1 zstd), header length
+_PREAMBLE = struct.Struct("<4sBBI")
+# Top-level fields kept out of the header
+BLOCK_FIELDS = ("extractedText", "tables")
+
+
+def dumps(value):
+    # Compact UTF-8 JSON
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _contiguous(offsets, length):
+    position = 0
+    for start, end in offsets:
+        if start != position or end < start:
+            return False
+        position = end
+    return position == length
+
+
+def encode_json(doc):
+    # Compact JSON of the document plus its layout: the byte span of every top-level value, of every
+    # table and of every page's text (the escaped characters inside the extractedText string).
+    # JSON escaping is per character, so the page fragments concatenate to the full string and a page
+    # range is one contiguous slice of the file. Returns (bytes, layout).
+    out = bytearray(b"{")
+    layout = {"sections": {}, "pages": [], "tables": []}
+    offsets = doc.get("pageOffsets") or []
+    for i, (key, value) in enumerate(doc.items()):
+        if i:
+            out += b","
+        out += dumps(key) + b":"
+        start = len(out)
+        if key == "extractedText" and isinstance(value, str) and offsets and _contiguous(offsets, len(value)):
+            out += b'"'
+            for page_start, page_end in offsets:
+                fragment_start = len(out)
+                out += dumps(value[page_start:page_end])[1:-1]
+                layout["pages"].append([fragment_start, len(out)])
+            out += b'"'
+        elif key == "tables" and isinstance(value, list):
+            out += b"["
+            for j, table in enumerate(value):
+                if j:
+                    out += b","
+                table_start = len(out)
+                out += dumps(table)
+                layout["tables"].append([table_start, len(out)])
+            out += b"]"
+        else:
+            out += dumps(value)
+        layout["sections"][key] = [start, len(out)]
+    out += b"}"
+    layout["bodySize"] = len(out)
+    return bytes(out), layout
+
+
+def columnar_table(table):
+    # Rows -> one array per column plus the row lengths, so ragged rows round-trip exactly
+    lengths = [len(row) for row in table]
+    width = max(lengths, default=0)
+    columns = [[row[j] if j < len(row) else None for row in table] for j in range(width)]
+    return {"rowLengths": lengths, "columns": columns}
+
+
+def row_table(block):
+    lengths = block["rowLengths"]
+    if not block["columns"]:
+        return [[] for _ in lengths]
+    width = len(block["columns"])
+    rows = [list(row) for row in zip(*block["columns"])]
+    for i, length in enumerate(lengths):
+        if length != width:
+            rows[i] = rows[i][:length]
+    return rows
+
+
+def _compressor(compression):
+    if compression == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=DOCUMENT_ZSTD_LEVEL).compress
+    return None
+
+
+def _decompressor(compression_code):
+    if compression_code == 1:
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress
+    return None
+
+
+def encode_container(doc, compression=DOCUMENT_COMPRESSION):
+    # Binary container: preamble, msgpack header, then the blocks. The header holds every other
+    # top-level field, the field order and (offset, length) of each block relative to the first one.
+    import msgpack
+
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown document compression: {compression}")
+    compress = _compressor(compression)
+    text = doc.get("extractedText") or ""
+    offsets = doc.get("pageOffsets") or []
+    pages = [text[a:b] for a, b in offsets] if offsets and _contiguous(offsets, len(text)) else [text]
+    blocks = [page.encode("utf-8") for page in pages]
+    blocks += [msgpack.packb(columnar_table(table), use_bin_type=True) for table in doc.get("tables") or []]
+    if compress is not None:
+        blocks = [compress(block) for block in blocks]
+    spans = []
+    position = 0
+    for block in blocks:
+        spans.append([position, len(block)])
+        position += len(block)
+    header = msgpack.packb({
+        "fields": {key: value for key, value in doc.items() if key not in BLOCK_FIELDS},
+        "order": list(doc.keys()),
+        "pages": spans[:len(pages)],
+        "tables": spans[len(pages):],
+    }, use_bin_type=True)
+    preamble = _PREAMBLE.pack(MAGIC, CONTAINER_VERSION, 1 if compress is not None else 0, len(header))
+    return preamble + header + b"".join(blocks)
+
+
+class Container:
+    # Random access to a binary container: the header is read on open, blocks on demand.
+    # source is a path or a seekable binary file object, which the container closes.
+
+    def __init__(self, source):
+        import msgpack
+
+        self._file = open(source, "rb") if isinstance(source, (str, os.PathLike)) else source
+        magic, version, compression, header_size = _PREAMBLE.unpack(self._file.read(_PREAMBLE.size))
+        if magic != MAGIC or version != CONTAINER_VERSION:
+            self._file.close()
+            raise ValueError(f"{source} is not a document container this version can read")
+        self._decompress = _decompressor(compression)
+        header = msgpack.unpackb(self._file.read(header_size), raw=False)
+        self._base = _PREAMBLE.size + header_size
+        self.fields = header["fields"]
+        self.order = header["order"]
+        self.page_spans = header["pages"]
+        self.table_spans = header["tables"]
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _blocks(self, spans):
+        # Consecutive blocks are read with a single read
+        if not spans:
+            return []
+        start = spans[0][0]
+        self._file.seek(self._base + start)
+        data = self._file.read(spans[-1][0] + spans[-1][1] - start)
+        blocks = [data[offset - start:offset - start + size] for offset, size in spans]
+        if self._decompress is not None:
+            blocks = [self._decompress(block) for block in blocks]
+        return blocks
+
+    def pages(self, start=0, count=None):
+        end = len(self.page_spans) if count is None else start + count
+        return [block.decode("utf-8") for block in self._blocks(self.page_spans[start:end])]
+
+    def tables(self, start=0, count=None):
+        import msgpack
+
+        end = len(self.table_spans) if count is None else start + count
+        return [row_table(msgpack.unpackb(block, raw=False)) for block in self._blocks(self.table_spans[start:end])]
+
+    def field(self, name):
+        # (found, value) for one top-level field
+        if name == "extractedText" and name in self.order:
+            return True, "".join(self.pages())
+        if name == "tables" and name in self.order:
+            return True, self.tables()
+        if name in self.fields:
+            return True, self.fields[name]
+        return False, None
+
+    def document(self):
+        doc = {}
+        for name in self.order:
+            doc[name] = self.field(name)[1]
+        return doc
@@ -0,0 +1,384 @@
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+
+from models import PDFFile
+from services import doc_format, storage
+
+# API field name -> column, for the metadata listing. Text and tables live in the document body
+# and are only read by the single-document endpoint.
+LIST_FIELDS = {
+    "id": PDFFile.doc_id,
+    "fileName": PDFFile.filename,
+    "fileType": PDFFile.file_type,
+    "fileSize": PDFFile.file_size,
+    "sha256": PDFFile.sha256,
+    "uploadDate": PDFFile.upload_date,
+    "pageCount": PDFFile.page_count,
+    "wordCount": PDFFile.word_count,
+    "characterCount": PDFFile.character_count,
+    "processingStatus": PDFFile.processing_status,
+    "processingTime": PDFFile.processing_time,
+    "accuracy": PDFFile.accuracy,
+    "metadata": PDFFile.metadata_json,
+}
+DEFAULT_LIST_FIELDS = ["id", "fileName", "fileSize", "uploadDate", "pageCount", "processingStatus"]
+MAX_PAGE_SIZE = 500
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def _store(store):
+    return store if store is not None else storage.storage
+
+
+def body_key(doc_id):
+    return f"{doc_id}.json"
+
+
+def container_key(doc_id):
+    return f"{doc_id}.udoc"
+
+
+def layout_key(doc_id):
+    return f"layout/{doc_id}.json"
+
+
+def index_key(doc_id):
+    return f"index/{doc_id}.json"
+
+
+def body_format(doc_id, store=None):
+    # "msgpack" or "json" for the stored body, None when the document has none
+    store = _store(store)
+    if store.exists(container_key(doc_id)):
+        return "msgpack"
+    if store.exists(body_key(doc_id)):
+        return "json"
+    # A rewrite from JSON to a container writes the container before removing the JSON body
+    if store.exists(container_key(doc_id)):
+        return "msgpack"
+    return None
+
+
+def _read_stored(doc_id, store, from_container, from_json):
+    # Result of from_container(Container) or from_json() for the stored body, or None when there is
+    # none. A rewrite in the other format (migration) removes the old copy only once the new one is
+    # complete, so a copy vanishing under the reader means looking again.
+    for _ in range(3):
+        fmt = body_format(doc_id, store)
+        if fmt is None:
+            return None
+        try:
+            if fmt == "msgpack":
+                with doc_format.Container(store.open(container_key(doc_id))) as container:
+                    return from_container(container)
+            return from_json()
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def _json_body(doc_id, store):
+    data = store.read(body_key(doc_id))
+    if data is None:
+        raise FileNotFoundError(body_key(doc_id))
+    return doc_format.loads(data)
+
+
+def read_body(doc_id, store=None):
+    # Full extracted document (text, tables, ...) or None when it is not stored
+    store = _store(store)
+    return _read_stored(doc_id, store, lambda container: container.document(), lambda: _json_body(doc_id, store))
+
+
+def write_body(doc, store=None, fmt=None, compression=None):
+    # Store the body in the configured format and drop any copy in the other one. Every file is
+    # replaced atomically and the document is locked meanwhile, so concurrent writers of one document
+    # (workers, re-extraction, migrations) apply their writes one after the other.
+    store = _store(store)
+    fmt = fmt or doc_format.DOCUMENT_FORMAT
+    if fmt not in doc_format.FORMATS:
+        raise ValueError(f"Unknown document format: {fmt}")
+    doc_id = doc["id"]
+    if fmt == "msgpack":
+        writes = [(container_key(doc_id), doc_format.encode_container(doc, compression or doc_format.DOCUMENT_COMPRESSION))]
+        stale = [body_key(doc_id), layout_key(doc_id)]
+    else:
+        data, layout = doc_format.encode_json(doc)
+        writes = [(body_key(doc_id), data), (layout_key(doc_id), doc_format.dumps(layout))]
+        stale = [container_key(doc_id)]
+    with store.lock(doc_id):
+        for key, data in writes:
+            store.write(key, data)
+        for key in stale:
+            store.delete(key)
+
+
+def delete_body(doc_id, store=None):
+    store = _store(store)
+    with store.lock(doc_id):
+        for key in (body_key(doc_id), container_key(doc_id), layout_key(doc_id)):
+            store.delete(key)
+
+
+def read_layout(doc_id, store=None):
+    # Byte spans written with a JSON body, or None when missing or the body was rewritten without them
+    store = _store(store)
+    data = store.read(layout_key(doc_id))
+    if data is None:
+        return None
+    layout = doc_format.loads(data)
+    if store.size(body_key(doc_id)) != layout.get("bodySize"):
+        return None
+    return layout
+
+
+def read_span(doc_id, start, end, store=None):
+    return _store(store).read_range(body_key(doc_id), start, end)
+
+
+def stream_body(doc_id, prefix=b"", suffix=b"", chunk_size=65536, store=None):
+    # Yields the document as JSON between prefix and suffix. JSON bodies are sent as they are stored;
+    # binary containers are decoded and encoded once.
+    store = _store(store)
+    for _ in range(3):
+        if body_format(doc_id, store) == "msgpack":
+            doc = read_body(doc_id, store)
+            if doc is None:
+                continue
+            yield prefix
+            yield doc_format.dumps(doc)
+            yield suffix
+            return
+        chunks = store.iter_chunks(body_key(doc_id), chunk_size)
+        try:
+            # Opens the body; from here on the stream keeps reading the content it opened
+            first = next(chunks, b"")
+        except FileNotFoundError:
+            continue
+        yield prefix
+        yield first
+        yield from chunks
+        yield suffix
+        return
+    raise FileNotFoundError(body_key(doc_id))
+
+
+def read_pages(doc_id, start, count, store=None):
+    # Text of pages [start, start + count) (0-based). Returns (page_count, [text, ...]) or None when the
+    # document is not stored. Reads only those pages' bytes when the body has page spans.
+    store = _store(store)
+
+    def from_json():
+        layout = read_layout(doc_id, store)
+        if layout is not None and layout["pages"]:
+            spans = layout["pages"][start:start + count]
+            texts = [doc_format.loads(b'"' + read_span(doc_id, a, b, store) + b'"') for a, b in spans]
+            return len(layout["pages"]), texts
+        doc = _json_body(doc_id, store)
+        text = doc.get("extractedText") or ""
+        # Documents extracted before page offsets were stored count as one page
+        offsets = doc.get("pageOffsets") or [[0, len(text)]]
+        return len(offsets), [text[a:b] for a, b in offsets[start:start + count]]
+
+    return _read_stored(
+        doc_id, store, lambda container: (len(container.page_spans), container.pages(start, count)), from_json)
+
+
+def read_tables_json(doc_id, start, count, store=None):
+    # Serialized JSON array of tables [start, start + count). Returns (table_count, bytes) or None when
+    # the document is not stored.
+    store = _store(store)
+
+    def from_json():
+        layout = read_layout(doc_id, store)
+        if layout is not None:
+            spans = layout["tables"][start:start + count]
+            data = read_span(doc_id, spans[0][0], spans[-1][1], store) if spans else b""
+            return len(layout["tables"]), b"[" + data + b"]"
+        tables = _json_body(doc_id, store).get("tables") or []
+        return len(tables), doc_format.dumps(tables[start:start + count])
+
+    return _read_stored(
+        doc_id, store,
+        lambda container: (len(container.table_spans), doc_format.dumps(container.tables(start, count))), from_json)
+
+
+def read_section_json(doc_id, name, store=None):
+    # Serialized JSON of one top-level field, or None when the document or the field is missing.
+    # Header fields of a binary container are read without touching its text and table blocks.
+    store = _store(store)
+
+    def from_container(container):
+        found, value = container.field(name)
+        return doc_format.dumps(value) if found else None
+
+    def from_json():
+        layout = read_layout(doc_id, store)
+        if layout is not None:
+            span = layout["sections"].get(name)
+            return read_span(doc_id, *span, store) if span else None
+        doc = _json_body(doc_id, store)
+        return doc_format.dumps(doc[name]) if name in doc else None
+
+    return _read_stored(doc_id, store, from_container, from_json)
+
+
+def read_index(doc_id, store=None):
+    # Comparison index written at ingestion, or None
+    data = _store(store).read(index_key(doc_id))
+    return doc_format.loads(data) if data is not None else None
+
+
+def write_index(doc_id, index, store=None):
+    _store(store).write(index_key(doc_id), doc_format.dumps(index))
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def content_digest(doc):
+    # Identifies one extraction result; used to key cached comparisons
+    canonical = json.dumps(doc, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def row_from_document(doc):
+    metadata = doc.get("metadata") or {}
+    return PDFFile(
+        doc_id=doc["id"],
+        filename=doc.get("fileName") or "",
+        file_type=doc.get("fileType"),
+        file_size=doc.get("fileSize"),
+        sha256=doc.get("sha256"),
+        content_digest=content_digest(doc),
+        upload_date=_parse_date(doc.get("uploadDate")) or datetime.utcnow(),
+        page_count=metadata.get("pageCount"),
+        word_count=metadata.get("wordCount"),
+        character_count=metadata.get("characterCount"),
+        processing_status=doc.get("processingStatus"),
+        processing_time=doc.get("processingTime"),
+        accuracy=doc.get("accuracy"),
+        metadata_json=json.dumps(metadata, ensure_ascii=False),
+    )
+
+
+def save_document(db, doc, index=None, store=None):
+    # Persist the body (and its comparison index) first, then register it. Returns the stored row; when
+    # another upload of the same content won the race, that row is returned and this body is dropped.
+    write_body(doc, store)
+    if index is not None:
+        write_index(doc["id"], index, store)
+    row = row_from_document(doc)
+    db.add(row)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        existing = find_by_sha256(db, doc.get("sha256")) if doc.get("sha256") else None
+        if existing is None:
+            raise
+        delete_body(doc["id"], store)
+        _store(store).delete(index_key(doc["id"]))
+        return existing
+    db.refresh(row)
+    return row
+
+
+def update_document(db, row, doc, index=None, store=None):
+    # Store a re-extraction of an already registered document in place; the upload date is kept
+    doc["uploadDate"] = row.upload_date.isoformat()
+    write_body(doc, store)
+    if index is not None:
+        write_index(doc["id"], index, store)
+    fresh = row_from_document(doc)
+    for column in ("filename", "file_type", "file_size", "content_digest", "page_count", "word_count",
+                   "character_count", "processing_status", "processing_time", "accuracy", "metadata_json"):
+        setattr(row, column, getattr(fresh, column))
+    db.commit()
+    db.refresh(row)
+    return row
+
+
+def get_row(db, doc_id):
+    return db.query(PDFFile).filter(PDFFile.doc_id == doc_id).first()
+
+
+def find_by_sha256(db, sha256):
+    return db.query(PDFFile).filter(PDFFile.sha256 == sha256).first()
+
+
+def _field_value(name, value):
+    if name == "uploadDate" and value is not None:
+        return value.isoformat()
+    if name == "metadata":
+        return json.loads(value) if value else {}
+    return value
+
+
+def row_summary(row, fields=None):
+    fields = fields or DEFAULT_LIST_FIELDS
+    return {name: _field_value(name, getattr(row, LIST_FIELDS[name].key)) for name in fields}
+
+
+def parse_fields(fields):
+    # "id,fileName" -> ["id", "fileName"]; raises ValueError on unknown names
+    if not fields:
+        return list(DEFAULT_LIST_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in LIST_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return names
+
+
+def encode_cursor(upload_date, row_id):
+    raw = json.dumps([upload_date.isoformat(), row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        upload_date, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(upload_date), int(row_id)
+    except Exception:
+        raise InvalidCursorError("Invalid cursor.")
+
+
+def list_documents(db, limit=50, cursor=None, fields=None):
+    # Newest first, keyset paginated on (upload_date, id) so every page is an index range scan.
+    # Returns (documents, next_cursor).
+    fields = fields or DEFAULT_LIST_FIELDS
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    columns = [LIST_FIELDS[name] for name in fields]
+    query = db.query(PDFFile.id, PDFFile.upload_date, *columns)
+    if cursor:
+        upload_date, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            PDFFile.upload_date < upload_date,
+            and_(PDFFile.upload_date == upload_date, PDFFile.id < row_id),
+        ))
+    rows = query.order_by(PDFFile.upload_date.desc(), PDFFile.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][1], rows[-1][0])
+    documents = [
+        {name: _field_value(name, value) for name, value in zip(fields, row[2:])}
+        for row in rows
+    ]
+    return documents, next_cursor
+
@@ -0,0 +1,108 @@
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import delete
+
+from models import ExtractedData
+from services import analytics
+
+# Rows sent per INSERT statement (executemany); all batches of a document share one transaction
+EXTRACTED_DATA_BATCH_SIZE = int(os.getenv("EXTRACTED_DATA_BATCH_SIZE", "1000"))
+# Column limit of ExtractedData.key / ExtractedData.value
+MAX_LENGTH = 255
+
+_MONTH_NAMES = {
+    name: number
+    for number, names in enumerate((
+        ("jan", "january"), ("feb", "february"), ("mar", "march"), ("apr", "april"), ("may",), ("jun", "june"),
+        ("jul", "july"), ("aug", "august"), ("sep", "sept", "september"), ("oct", "october"),
+        ("nov", "november"), ("dec", "december"),
+    ), start=1)
+    for name in names
+}
+_ISO_MONTH = re.compile(r"\b((?:19|20)\d{2})[-/.](0[1-9]|1[0-2])\b")
+_NUMERIC_MONTH = re.compile(r"\b(0?[1-9]|1[0-2])[-/.]((?:19|20)\d{2})\b")
+_NAMED_MONTH = re.compile(r"\b([A-Za-z]{3,9})\.?,?\s+((?:19|20)\d{2})\b")
+
+
+def find_month(text):
+    # First "YYYY-MM" mentioned in text ("2025-07", "07/2025", "Jul 2025", "July 2025"), or None
+    found = []
+    for pattern, year_group, month_of in (
+        (_ISO_MONTH, 1, lambda m: int(m.group(2))),
+        (_NUMERIC_MONTH, 2, lambda m: int(m.group(1))),
+        (_NAMED_MONTH, 2, lambda m: _MONTH_NAMES.get(m.group(1).lower())),
+    ):
+        for match in pattern.finditer(text):
+            month = month_of(match)
+            if month:
+                found.append((match.start(), f"{match.group(year_group)}-{month:02d}"))
+                break
+    return min(found)[1] if found else None
+
+
+def _cell(value):
+    return " ".join(str(value).split()) if value is not None else ""
+
+
+def flatten_tables(tables, default_month=None):
+    # Table cells -> (key, value, month) triples. The first row is the header and the first column
+    # labels the rows. A column whose header names a month gives that month and the row label as key;
+    # any other column gives "label | header" as key and the document's month.
+    rows = []
+    for table in tables:
+        if len(table) < 2:
+            continue
+        header = [_cell(cell) for cell in table[0]]
+        months = [find_month(name) if name else None for name in header]
+        for row in table[1:]:
+            cells = [_cell(cell) for cell in row]
+            if not cells:
+                continue
+            label = cells[0]
+            for j in range(1, len(cells)):
+                value = cells[j]
+                if not value:
+                    continue
+                name = header[j] if j < len(header) else ""
+                month = months[j] if j < len(months) else None
+                if month:
+                    key = label or name
+                else:
+                    key = f"{label} | {name}" if label and name else (label or name)
+                    month = default_month
+                if key:
+                    rows.append((key[:MAX_LENGTH], value[:MAX_LENGTH], month))
+    return rows
+
+
+def document_rows(doc):
+    # Flattened ExtractedData triples of one extracted document
+    month = find_month(doc.get("extractedText") or "")
+    return flatten_tables(doc.get("tables") or [], default_month=month)
+
+
+def store_rows(db, pdf_file_id, rows, batch_size=EXTRACTED_DATA_BATCH_SIZE, extracted_date=None):
+    # Replace the document's ExtractedData with rows, using batched executemany inserts in one
+    # transaction that also updates the monthly analytics rollups. Returns the number of rows written.
+    extracted_date = extracted_date or datetime.utcnow()
+    table = ExtractedData.__table__
+    try:
+        db.execute(delete(table).where(table.c.pdf_file_id == pdf_file_id))
+        for start in range(0, len(rows), batch_size):
+            db.execute(table.insert(), [
+                {"pdf_file_id": pdf_file_id, "key": key, "value": value, "month": month,
+                 "extracted_date": extracted_date}
+                for key, value, month in rows[start:start + batch_size]
+            ])
+        analytics.apply_document(db, pdf_file_id, rows)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(rows)
+
+
+def store_document(db, row, doc, batch_size=EXTRACTED_DATA_BATCH_SIZE):
+    return store_rows(db, row.id, document_rows(doc), batch_size=batch_size)
@@ -0,0 +1,156 @@
+import logging
+import os
+import time
+from datetime import datetime
+
+from services import ocr, pdf_backends, table_detect, telemetry
+
+logger = logging.getLogger(__name__)
+
+
+def page_offsets(pages):
+    # [start, end) character offsets of every page's text within "".join(pages)
+    offsets = []
+    position = 0
+    for text in pages:
+        offsets.append([position, position + len(text)])
+        position += len(text)
+    return offsets
+
+
+def table_header(table):
+    return tuple(str(cell).strip().lower() for cell in table[0]) if table and len(table) > 0 else tuple()
+
+
+def extract_document(source, file_name, content_type, doc_id, checkpoint=None):
+    # Run the full extraction pipeline for one PDF and return the document dict.
+    # source is a file path or the raw upload bytes; the PDF is parsed once and every stage reads from that parse.
+    # With a checkpoint (services.checkpoints.PageCheckpoint) every page result is persisted as soon as
+    # it is done and pages already done with the same engine settings are not redone.
+    # Stage wall times end up in processingStages (ms) and processingTime (ms, whole pipeline).
+    # Returns (document, timings) where timings holds seconds per stage and per OCR page for the metrics.
+    started = time.perf_counter()
+    timings = {}
+    errors = []
+    pages = []
+    tables = []
+    layer_settings = {"backend": pdf_backends.EXTRACTION_BACKEND}
+    resumed = {}
+
+    def run_pages(stage, settings, indices, compute):
+        # {page: result} for indices, computing (and checkpointing) only the missing ones
+        if checkpoint is not None:
+            checkpoint.touch()
+        done = checkpoint.load(stage, settings) if checkpoint is not None else {}
+        resumed[stage] = sum(1 for i in indices if i in done)
+        for i in indices:
+            if i not in done:
+                done[i] = compute(i)
+                if checkpoint is not None:
+                    checkpoint.save(stage, settings, i, done[i])
+        return done
+
+    with telemetry.timed(timings, "open"):
+        document = pdf_backends.open_document(source)
+    with document:
+        page_count = document.page_count
+
+        # Extract text from the PDF, fallback to OCR if needed
+        try:
+            with telemetry.timed(timings, "text"):
+                done = run_pages("text", layer_settings, range(page_count), lambda i: {"text": document.page_text(i)})
+                pages = [done[i]["text"] for i in range(page_count)]
+            logger.info("text extracted", extra=telemetry.log_fields(
+                fileName=file_name, backend=pdf_backends.EXTRACTION_BACKEND, characters=sum(map(len, pages))))
+        except Exception as e:
+            logger.warning("text extraction failed", extra=telemetry.log_fields(fileName=file_name, error=str(e)))
+            errors.append({"stage": "text", "error": str(e)})
+
+        # Extract tables (regardless of OCR/text extraction)
+        try:
+            with telemetry.timed(timings, "tables"):
+                # Each table is a list of rows (each row is a list of cell values)
+                done = run_pages("tables", layer_settings, range(page_count), lambda i: {"tables": document.page_tables(i)})
+                for i in range(page_count):
+                    tables.extend(done[i]["tables"])
+        except Exception as e:
+            logger.warning("table extraction failed", extra=telemetry.log_fields(fileName=file_name, error=str(e)))
+            errors.append({"stage": "tables", "error": str(e)})
+
+        # Fallback to OCR with EasyOCR if the text layer is missing or empty
+        if not any(text.strip() for text in pages):
+            try:
+                page_timings = []
+                ocr_settings = ocr.settings()
+                with telemetry.timed(timings, "ocr"):
+                    if checkpoint is not None:
+                        checkpoint.touch()
+                    done = checkpoint.load("ocr", ocr_settings) if checkpoint is not None else {}
+                    todo = [i for i in range(page_count) if i not in done]
+                    resumed["ocr"] = page_count - len(todo)
+                    save = (lambda i, text: checkpoint.save("ocr", ocr_settings, i, {"text": text})) \
+                        if checkpoint is not None else None
+                    recognised = ocr.ocr_pages(document.render_page, page_count, page_timings=page_timings,
+                                               indices=todo, on_page=save)
+                    done.update((i, {"text": text}) for i, text in zip(todo, recognised))
+                    pages = [done[i]["text"] for i in range(page_count)]
+                timings["ocrPage"] = page_timings
+                logger.info("text recognised", extra=telemetry.log_fields(
+                    fileName=file_name, pages=page_count, characters=sum(map(len, pages))))
+            except Exception as e:
+                logger.warning("OCR failed", extra=telemetry.log_fields(fileName=file_name, error=str(e)))
+                errors.append({"stage": "ocr", "error": str(e)})
+
+    if any(resumed.values()):
+        logger.info("resumed from checkpoint", extra=telemetry.log_fields(fileName=file_name, pages=resumed))
+
+    extracted_text = "".join(pages)
+
+    # Always attempt to extract tables from extracted_text and merge with any found tables
+    if extracted_text:
+        with telemetry.timed(timings, "tableHeuristic"):
+            tables_from_text = table_detect.detect_tables(extracted_text)
+            # Merge: only add tables that are not already present (by header row)
+            existing_headers = {table_header(t) for t in tables}
+            for t in tables_from_text:
+                if table_header(t) not in existing_headers:
+                    tables.append(t)
+
+    stage_ms = {
+        stage: round(1000 * (sum(value) if isinstance(value, list) else value), 1)
+        for stage, value in timings.items()
+    }
+    return {
+        "id": doc_id,
+        "fileName": file_name,
+        "fileType": content_type,
+        "fileSize": len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source),
+        "uploadDate": datetime.utcnow().isoformat(),
+        "extractedText": extracted_text,
+        # Where each page's text sits in extractedText, for page-ranged reads
+        "pageOffsets": page_offsets(pages),
+        "metadata": {
+            "wordCount": len(extracted_text.split()),
+            "characterCount": len(extracted_text),
+            "pageCount": page_count,
+            "language": "en",
+            "author": "Unknown",
+            "title": file_name,
+            "subject": "",
+            "creator": "",
+            "creationDate": datetime.utcnow().isoformat(),
+            "modificationDate": datetime.utcnow().isoformat(),
+        },
+        "tables": tables,
+        "images": [],
+        "structure": {
+            "headings": [],
+            "paragraphs": [],
+            "lists": [],
+        },
+        "processingStatus": "completed",
+        "processingTime": round(1000 * (time.perf_counter() - started)),
+        "processingStages": stage_ms,
+        "accuracy": 95.0,
+        "errors": errors,
+    }, timings
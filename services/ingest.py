@@ -0,0 +1,97 @@
+import hashlib
+import os
+import tempfile
+
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+from services import storage
+
+# Size of the reads from the incoming upload stream
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Largest accepted PDF, in bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+# Files accepted per upload request
+MAX_UPLOAD_FILES = 2
+# Largest upload request: every file at the limit plus room for the multipart headers
+MAX_REQUEST_BYTES = MAX_UPLOAD_FILES * MAX_UPLOAD_BYTES + 65536
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    # ASGI middleware refusing upload requests above max_bytes before the endpoint parses the
+    # multipart body into temporary files. A declared Content-Length over the limit is answered with
+    # 413 without reading the body; a body without one (chunked) is cut off with 413 as soon as the
+    # bytes received pass the limit.
+
+    def __init__(self, app, paths=("/upload", "/upload/"), max_bytes=MAX_REQUEST_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        detail = f"Upload exceeds the maximum allowed size of {self.max_bytes} bytes."
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Passed through FastAPI's body parsing and answered by its exception handler
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def pdf_key(sha256):
+    return f"pdf/{sha256}.pdf"
+
+
+async def store_upload(file, store=None, max_bytes=MAX_UPLOAD_BYTES, chunk_size=UPLOAD_CHUNK_SIZE):
+    # Stream the upload to a local temporary file in chunks, hashing as we go, and move it to its
+    # content-addressed key in the storage backend. Returns (sha256, key, size).
+    # File and storage I/O runs in the thread pool: an object store upload of a large PDF must not
+    # hold up the event loop.
+    store = store if store is not None else storage.storage
+    size = getattr(file, "size", None)
+    if size is not None and size > max_bytes:
+        raise UploadTooLargeError(f"{file.filename} exceeds the {max_bytes} byte upload limit.")
+
+    staging_dir = await run_in_threadpool(store.staging_dir, "pdf")
+    fd, tmp_path = tempfile.mkstemp(dir=staging_dir, suffix=".part")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"{file.filename} exceeds the {max_bytes} byte upload limit.")
+                hasher.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+        sha256 = hasher.hexdigest()
+        key = pdf_key(sha256)
+        # Identical content lands on the same key, so concurrent uploads can't clobber each other
+        await run_in_threadpool(store.put_file, key, tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return sha256, key, size
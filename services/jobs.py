@@ -0,0 +1,450 @@
+import json
+import logging
+import os
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+
+from database import SessionLocal, engine
+from models import ExtractionJob
+from services import checkpoints, compare_index, documents, extracted_data, ocr, storage, telemetry
+from services.compare_cache import result_cache
+from services.extraction import extract_document
+from services.similarity_index import similarity_index
+
+# Number of files extracted at the same time (defaults to one per core)
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", str(os.cpu_count() or 1)))
+# "process" runs extraction on all cores, "thread" keeps it in the API process
+EXTRACTION_EXECUTOR = os.getenv("EXTRACTION_EXECUTOR", "process")
+# Maximum number of files waiting for or undergoing extraction before uploads are refused
+EXTRACTION_QUEUE_SIZE = int(os.getenv("EXTRACTION_QUEUE_SIZE", "64"))
+# Number of finished jobs kept in memory for status queries
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "1000"))
+# Days a finished job stays queryable from the database (by any API worker)
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+# Times a file is submitted again after the worker extracting it died (e.g. killed for memory during
+# OCR); the new attempt resumes from the pages checkpointed so far
+EXTRACTION_RETRIES = int(os.getenv("EXTRACTION_RETRIES", "1"))
+# Seconds an extraction may go without finishing a page or starting a stage. A stalled worker process
+# is killed and the file retried from its checkpoint like a crash (process executor only; 0 disables)
+EXTRACTION_PAGE_TIMEOUT = float(os.getenv("EXTRACTION_PAGE_TIMEOUT", "600"))
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _init_worker():
+    # Initializer of worker processes only (a thread pool must keep the API process's connections).
+    # Connections inherited from the parent process must not be reused after the fork.
+    engine.dispose(close=False)
+    # Each worker process keeps its own OCR reader; load it before the first scanned page arrives
+    if ocr.OCR_WARMUP:
+        ocr.warmup()
+
+
+def process_file(spec):
+    # Runs inside the worker pool: extract one file, store its body and index it in the database.
+    # Returns the document summary plus the stage timings and failed stages, which the API process
+    # records in its metrics (worker processes don't serve /metrics).
+    # Page results are checkpointed per PDF, so a retry after a crash, or a re-extraction ("reextract"
+    # spec, optionally with "redoPages") only redoes the pages and stages it has no results for.
+    # While it runs, the checkpoint directory names the worker process, so the queue can stop an attempt
+    # that makes no progress for EXTRACTION_PAGE_TIMEOUT.
+    checkpoint = checkpoints.PageCheckpoint(spec["sha256"]) if spec.get("sha256") else None
+    if checkpoint is None:
+        return _process_file(spec, None)
+    if spec.get("redoPages"):
+        checkpoint.discard(spec["redoPages"])
+    checkpoint.claim()
+    try:
+        return _process_file(spec, checkpoint)
+    finally:
+        checkpoint.release()
+
+
+def _process_file(spec, checkpoint):
+    try:
+        if spec.get("data") is not None:
+            doc, timings = extract_document(spec["data"], spec["fileName"], spec["fileType"], spec["docId"],
+                                            checkpoint=checkpoint)
+        else:
+            # The stored PDF; a local file as is, an object store download for the time of the extraction
+            with storage.storage.local_copy(spec["pdfKey"]) as path:
+                doc, timings = extract_document(path, spec["fileName"], spec["fileType"], spec["docId"],
+                                                checkpoint=checkpoint)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+    doc["sha256"] = spec.get("sha256")
+    if checkpoint is not None:
+        checkpoint.touch()
+    with telemetry.timed(timings, "compareIndex"):
+        index = compare_index.build_index(doc)
+    db = SessionLocal()
+    try:
+        with telemetry.timed(timings, "persist"):
+            existing = documents.get_row(db, doc["id"]) if spec.get("reextract") else None
+            if existing is not None:
+                row = documents.update_document(db, existing, doc, index=index)
+            else:
+                row = documents.save_document(db, doc, index=index)
+            if row.doc_id == doc["id"]:
+                similarity_index.add(doc["id"], index["searchMinhash"])
+        failed = [e["stage"] for e in doc["errors"]]
+        if row.doc_id == doc["id"]:
+            # Table cells as key/value/month ExtractedData rows, for querying across documents
+            try:
+                with telemetry.timed(timings, "extractedData"):
+                    extracted_data.store_document(db, row, doc)
+            except Exception as e:
+                logger.error("storing extracted data failed", extra=telemetry.log_fields(docId=doc["id"], error=str(e)))
+                failed.append("extractedData")
+        if checkpoint is not None and not checkpoints.CHECKPOINT_RETAIN:
+            checkpoint.clear()
+        return {
+            "summary": documents.row_summary(row),
+            "timings": timings,
+            "errors": failed,
+            "reextracted": existing is not None,
+        }
+    finally:
+        db.close()
+
+
+def _public_error(error):
+    if isinstance(error, TimeoutError):
+        return "Extraction timed out."
+    return "Extraction failed."
+
+
+class ExtractionQueue:
+    def __init__(self, max_workers=EXTRACTION_CONCURRENCY, executor_kind=EXTRACTION_EXECUTOR,
+                 max_pending=EXTRACTION_QUEUE_SIZE, history_size=JOB_HISTORY_SIZE):
+        self.max_workers = max(1, max_workers)
+        self.executor_kind = executor_kind
+        self.max_pending = max_pending
+        self.history_size = history_size
+        self._executor = None
+        self._lock = threading.RLock()
+        self._jobs = OrderedDict()
+        self._futures = {}
+        self._inflight = {}
+        self._attempts = {}
+        self._pending = 0
+        # Pools whose worker was killed for making no progress -> the outcome it was extracting
+        self._stalled = weakref.WeakKeyDictionary()
+        self._watchdog = None
+        self._stopping = threading.Event()
+        # Serialises job state writes, so the last write of a job is always its latest state
+        self._persist_lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_kind == "thread":
+                # Threads share the API process's connection pool and OCR reader (start() warms it up)
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="extract")
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+                if self._watchdog is None and EXTRACTION_PAGE_TIMEOUT > 0:
+                    self._watchdog = threading.Thread(target=self._watch, name="extract-watchdog", daemon=True)
+                    self._watchdog.start()
+        return self._executor
+
+    def _watch(self):
+        # Kill worker processes that made no progress for EXTRACTION_PAGE_TIMEOUT. The pool breaks, every
+        # attempt on it is retried from its checkpoint, and only the stalled file uses up a retry.
+        while not self._stopping.wait(min(10.0, EXTRACTION_PAGE_TIMEOUT / 4)):
+            with self._lock:
+                running = [(outcome, spec, executor) for outcome, (attempt, spec, executor) in self._attempts.items()
+                           if spec.get("sha256") and attempt.running()]
+            for outcome, spec, executor in running:
+                state = checkpoints.progress(spec["sha256"])
+                if state is None or state[1] < EXTRACTION_PAGE_TIMEOUT:
+                    continue
+                process = dict(getattr(executor, "_processes", None) or {}).get(state[0])
+                if process is None:
+                    continue
+                logger.error("extraction stalled, killing its worker", extra=telemetry.log_fields(
+                    fileName=spec["fileName"], sha256=spec["sha256"], idleSeconds=round(state[1])))
+                with self._lock:
+                    self._stalled[executor] = outcome
+                checkpoints.release(spec["sha256"])
+                process.kill()
+
+    def _replace_executor(self, broken):
+        # A worker process died: the pool refuses all further work, so start a new one
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+        logger.warning("extraction worker pool broken, starting a new one")
+        broken.shutdown(wait=False)
+
+    def _submit_to_pool(self, spec):
+        # (future, executor) of one extraction, replacing the pool once if it turns out to be broken
+        for attempt in range(2):
+            with self._lock:
+                executor = self._get_executor()
+            try:
+                return executor.submit(process_file, spec), executor
+            except BrokenExecutor:
+                if attempt:
+                    raise
+                self._replace_executor(executor)
+
+    def _start(self, spec, outcome, retries):
+        # Run one attempt of spec; outcome (the future jobs wait on) is resolved by _on_attempt
+        attempt, executor = self._submit_to_pool(spec)
+        with self._lock:
+            self._attempts[outcome] = (attempt, spec, executor)
+        attempt.add_done_callback(partial(self._on_attempt, spec, outcome, executor, retries))
+
+    def _on_attempt(self, spec, outcome, executor, retries, attempt):
+        if attempt.cancelled():
+            error = RuntimeError("Extraction was cancelled.")
+        else:
+            error = attempt.exception()
+        stalled = None
+        if isinstance(error, BrokenExecutor):
+            self._replace_executor(executor)
+            with self._lock:
+                stalled = self._stalled.get(executor)
+            if stalled is not None and stalled is not outcome:
+                # Lost with another file's stalled worker, not through a fault of its own
+                retries += 1
+            if retries > 0:
+                logger.warning("extraction worker died, retrying from checkpoint",
+                               extra=telemetry.log_fields(fileName=spec["fileName"], sha256=spec.get("sha256")))
+                try:
+                    self._start(spec, outcome, retries - 1)
+                    return
+                except Exception as e:
+                    error = e
+            elif stalled is outcome:
+                error = TimeoutError(f"Extraction made no progress for {EXTRACTION_PAGE_TIMEOUT:g} seconds.")
+        with self._lock:
+            self._attempts.pop(outcome, None)
+        if error is not None:
+            outcome.set_exception(error)
+        else:
+            outcome.set_result(attempt.result())
+
+    def start(self):
+        # Create the pool eagerly; with OCR_WARMUP every worker loads its OCR models right away
+        executor = self._get_executor()
+        if ocr.OCR_WARMUP:
+            for _ in range(self.max_workers):
+                executor.submit(ocr.warmup)
+
+    def submit(self, specs):
+        # specs: list of dicts with pdfKey (or data), fileName, fileType, sha256 and docId.
+        # A spec carrying "existing" (a document summary) is a duplicate upload and completes immediately;
+        # a spec whose sha256 is already being extracted waits on that extraction instead of starting another.
+        with self._lock:
+            new_files = sum(1 for s in specs if "existing" not in s and s.get("sha256") not in self._inflight)
+            if self._pending + new_files > self.max_pending:
+                raise QueueFullError("Extraction queue is full, retry later.")
+            job_id = str(uuid.uuid4())
+            job = {
+                "id": job_id,
+                "status": "queued",
+                "createdAt": datetime.utcnow().isoformat(),
+                "finishedAt": None,
+                "files": [
+                    {"docId": s["docId"], "fileName": s["fileName"], "status": "queued"}
+                    for s in specs
+                ],
+                "documents": [],
+                "errors": [],
+            }
+            self._jobs[job_id] = job
+            self._futures[job_id] = []
+            try:
+                for index, spec in enumerate(specs):
+                    if "existing" in spec:
+                        future = Future()
+                        future.set_result({"summary": spec["existing"], "timings": {}, "errors": []})
+                        job["files"][index]["deduplicated"] = True
+                    elif spec.get("sha256") in self._inflight:
+                        future, doc_id = self._inflight[spec["sha256"]]
+                        job["files"][index]["docId"] = doc_id
+                        job["files"][index]["deduplicated"] = True
+                    else:
+                        future = Future()
+                        self._start(spec, future, EXTRACTION_RETRIES)
+                        self._pending += 1
+                        if spec.get("sha256"):
+                            self._inflight[spec["sha256"]] = (future, spec["docId"])
+                        future.add_done_callback(partial(self._on_extracted, spec))
+                    self._futures[job_id].append(future)
+            except Exception:
+                # Don't leave a job behind that can never finish; files already started complete unseen
+                self._jobs.pop(job_id, None)
+                self._futures.pop(job_id, None)
+                raise
+            futures = list(self._futures[job_id])
+        self._persist(job_id)
+        # Outside _lock: callbacks of finished futures run right away and write the job state
+        for index, future in enumerate(futures):
+            future.add_done_callback(partial(self._on_done, job_id, index))
+        return self.get(job_id)
+
+    def _on_extracted(self, spec, future):
+        sha256 = spec.get("sha256")
+        with self._lock:
+            self._pending -= 1
+            if sha256:
+                self._inflight.pop(sha256, None)
+        # Once per extraction, even when several jobs wait on it
+        if future.exception() is not None:
+            telemetry.count_error("extraction", "job")
+            logger.error("extraction failed", extra=telemetry.log_fields(
+                fileName=spec["fileName"], sha256=sha256, error=repr(future.exception())))
+            if spec.get("pdfKey"):
+                self.discard_pdf(sha256, spec["pdfKey"])
+            return
+        outcome = future.result()
+        if outcome.get("reextracted"):
+            # Results computed from the previous extraction must not be served again
+            db = SessionLocal()
+            try:
+                result_cache.invalidate(db, outcome["summary"]["id"])
+            finally:
+                db.close()
+        telemetry.observe("extraction", outcome["timings"])
+        for stage in outcome["errors"]:
+            telemetry.count_error("extraction", stage)
+
+    def discard_pdf(self, sha256, key):
+        # Delete a stored PDF no document was made from (upload refused, extraction failed). It stays
+        # while another upload of the same content is being extracted or a document refers to it.
+        with self._lock:
+            if sha256 in self._inflight:
+                return
+        db = SessionLocal()
+        try:
+            if documents.find_by_sha256(db, sha256) is not None:
+                return
+            storage.storage.delete(key)
+        except Exception as e:
+            logger.warning("removing an unused PDF failed", extra=telemetry.log_fields(key=key, error=str(e)))
+        finally:
+            db.close()
+
+    def _on_done(self, job_id, index, future):
+        final = None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            file_state = job["files"][index]
+            try:
+                job["documents"].append(future.result()["summary"])
+                file_state["status"] = "completed"
+            except Exception as e:
+                file_state["status"] = "failed"
+                # The details (paths, library messages) are logged by _on_extracted, not sent to clients
+                job["errors"].append({"fileName": file_state["fileName"], "error": _public_error(e)})
+            if all(f["status"] in ("completed", "failed") for f in job["files"]):
+                job["status"] = "failed" if len(job["errors"]) == len(job["files"]) else "completed"
+                job["finishedAt"] = datetime.utcnow().isoformat()
+                self._futures.pop(job_id, None)
+                final = self._snapshot(job_id)
+                self._evict_finished()
+        self._persist(job_id, final)
+
+    def _evict_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["finishedAt"]]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
+
+    def _persist(self, job_id, final=None):
+        # Write the job's current state (or its final one, if it has been evicted from memory since) to
+        # the database. Callbacks finishing on several threads may call this out of order; each write
+        # takes a fresh snapshot under _persist_lock, so the row always ends up with the latest state.
+        db = SessionLocal()
+        try:
+            with self._persist_lock:
+                with self._lock:
+                    job = self._snapshot(job_id) or final
+                if job is None:
+                    return
+                table = ExtractionJob.__table__
+                now = datetime.utcnow()
+                values = {
+                    "status": job["status"],
+                    "state": json.dumps(job, ensure_ascii=False),
+                    "updated_at": now,
+                    "finished_at": datetime.fromisoformat(job["finishedAt"]) if job["finishedAt"] else None,
+                }
+                updated = db.execute(table.update().where(table.c.job_id == job_id).values(**values)).rowcount
+                if not updated:
+                    db.execute(table.insert().values(job_id=job_id, created_at=now, **values))
+                if job["finishedAt"]:
+                    db.execute(table.delete().where(
+                        table.c.finished_at < now - timedelta(days=JOB_RETENTION_DAYS)))
+                db.commit()
+        except Exception as e:
+            # Status queries on this worker are still answered from memory
+            db.rollback()
+            logger.error("storing job state failed", extra=telemetry.log_fields(jobId=job_id, error=str(e)))
+        finally:
+            db.close()
+
+    def _load(self, job_id):
+        # A job submitted to another API worker (or before a restart): its last persisted state
+        db = SessionLocal()
+        try:
+            row = db.query(ExtractionJob).filter(ExtractionJob.job_id == job_id).first()
+            return json.loads(row.state) if row is not None else None
+        finally:
+            db.close()
+
+    def get(self, job_id):
+        # Jobs are tracked in the memory of the worker that accepted them; other workers see the state
+        # persisted on submission and after each finished file
+        with self._lock:
+            job = self._snapshot(job_id)
+        return job if job is not None else self._load(job_id)
+
+    def _snapshot(self, job_id):
+        # Called with _lock held
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        futures = self._futures.get(job_id, [])
+        for file_state, future in zip(job["files"], futures):
+            attempt = self._attempts.get(future, (None,))[0]
+            if file_state["status"] == "queued" and attempt is not None and attempt.running():
+                file_state["status"] = "running"
+        if job["status"] == "queued" and any(f["status"] != "queued" for f in job["files"]):
+            job["status"] = "running"
+        done = sum(1 for f in job["files"] if f["status"] in ("completed", "failed"))
+        total = len(job["files"])
+        return {
+            **job,
+            "files": [dict(f) for f in job["files"]],
+            "documents": list(job["documents"]),
+            "errors": list(job["errors"]),
+            "progress": {
+                "completed": done,
+                "total": total,
+                "percent": round(100.0 * done / total, 1) if total else 100.0,
+            },
+        }
+
+    def shutdown(self, wait=True):
+        self._stopping.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+extraction_queue = ExtractionQueue()
@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+OCR_LANGUAGES = [lang.strip() for lang in os.getenv("OCR_LANGUAGES", "en").split(",") if lang.strip()]
+OCR_GPU = os.getenv("OCR_GPU", "true").lower() == "true"
+# Rasterisation resolution used for scanned pages
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+# Batch size handed to the EasyOCR recogniser for the text boxes of one page
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+# Number of pages rendered and recognised at the same time within one process
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+# Load the models when a worker starts instead of on the first scanned page
+OCR_WARMUP = os.getenv("OCR_WARMUP", "false").lower() == "true"
+
+logger = logging.getLogger(__name__)
+
+_reader = None
+_reader_lock = threading.Lock()
+
+
+def get_reader():
+    # One EasyOCR reader per process: loading the detection and recognition models is the expensive part
+    global _reader
+    if _reader is None:
+        with _reader_lock:
+            if _reader is None:
+                import easyocr
+                _reader = easyocr.Reader(OCR_LANGUAGES, gpu=OCR_GPU)
+    return _reader
+
+
+def warmup():
+    get_reader()
+
+
+def text_from_results(ocr_results):
+    # Group words by line (y coordinate)
+    line_dict = defaultdict(list)
+    for bbox, text, conf in ocr_results:
+        # bbox: [[x1, y1], [x2, y2], [x3, y3], [x4, y4]]
+        y_center = (bbox[0][1] + bbox[2][1]) / 2
+        line_dict[round(y_center, 0)].append((bbox[0][0], text))
+    # Sort lines by y, then words by x
+    lines = []
+    for y in sorted(line_dict.keys()):
+        words = sorted(line_dict[y], key=lambda x: x[0])
+        # Insert enough spaces between words to simulate columns
+        parts = []
+        prev_x = None
+        for x, word in words:
+            if prev_x is not None:
+                # Add spaces proportional to distance between words
+                gap = int((x - prev_x) // 15)
+                parts.append(" " * max(1, gap))
+            parts.append(word)
+            prev_x = x + len(word) * 10  # crude estimate of word width
+        lines.append("".join(parts) + "\n")
+    return "".join(lines)
+
+
+def ocr_image(image, batch_size=OCR_BATCH_SIZE):
+    # Use detail=1 to get bounding box data
+    ocr_results = get_reader().readtext(image, detail=1, paragraph=False, batch_size=batch_size)
+    return text_from_results(ocr_results)
+
+
+def ocr_pages(render_page, page_count, dpi=OCR_DPI, batch_size=OCR_BATCH_SIZE, workers=OCR_WORKERS, page_timings=None,
+              indices=None, on_page=None):
+    # render_page(index, dpi) must return an RGB numpy array and be safe to call from several threads.
+    # Returns the recognised text of the pages in indices (default: every page), in that order.
+    # When given, page_timings receives the render + recognition seconds of every page and
+    # on_page(index, text) is called as each page finishes (from the OCR threads).
+    indices = list(range(page_count)) if indices is None else list(indices)
+    if not indices:
+        return []
+    # Load the models up front so the page threads don't race to do it
+    get_reader()
+
+    def run(index):
+        logger.debug("OCR page", extra={"fields": {"page": index + 1, "pages": page_count}})
+        start = time.perf_counter()
+        text = ocr_image(render_page(index, dpi), batch_size=batch_size)
+        if page_timings is not None:
+            page_timings.append(time.perf_counter() - start)
+        if on_page is not None:
+            on_page(index, text)
+        return text
+
+    if workers <= 1 or len(indices) <= 1:
+        return [run(i) for i in indices]
+    with ThreadPoolExecutor(max_workers=min(workers, len(indices)), thread_name_prefix="ocr") as pool:
+        return list(pool.map(run, indices))
+
+
+def settings():
+    # What OCR output depends on; a change invalidates OCR page checkpoints
+    return {"engine": "easyocr", "languages": OCR_LANGUAGES, "dpi": OCR_DPI}
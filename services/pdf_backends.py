@@ -0,0 +1,108 @@
+import io
+import os
+import threading
+
+# "pymupdf" parses each file once with PyMuPDF; "legacy" keeps the PyPDF2 + pdfplumber pair
+EXTRACTION_BACKEND = os.getenv("EXTRACTION_BACKEND", "pymupdf")
+
+
+class PyMuPDFDocument:
+    # Text, tables, page count and page images all served from a single PyMuPDF parse
+
+    def __init__(self, source):
+        import fitz
+
+        self._fitz = fitz
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self._doc = fitz.open(stream=bytes(source), filetype="pdf")
+        else:
+            self._doc = fitz.open(source)
+        # MuPDF documents must not be used from several threads at once
+        self._lock = threading.Lock()
+
+    @property
+    def page_count(self):
+        return self._doc.page_count
+
+    def page_text(self, index):
+        with self._lock:
+            return self._doc[index].get_text() or ""
+
+    def page_tables(self, index):
+        with self._lock:
+            page = self._doc[index]
+            return [table.extract() for table in page.find_tables().tables]
+
+    def render_page(self, index, dpi):
+        import numpy as np
+
+        with self._lock:
+            pix = self._doc[index].get_pixmap(dpi=dpi, colorspace=self._fitz.csRGB, alpha=False)
+            return np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+
+    def close(self):
+        self._doc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class LegacyDocument:
+    # PyPDF2 for text and pdfplumber for tables and rendering, both opened once from the same bytes
+
+    def __init__(self, source):
+        import pdfplumber
+        import PyPDF2
+
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = bytes(source)
+        else:
+            with open(source, "rb") as f:
+                data = f.read()
+        self._reader = PyPDF2.PdfReader(io.BytesIO(data))
+        self._pdf = pdfplumber.open(io.BytesIO(data))
+        self._lock = threading.Lock()
+
+    @property
+    def page_count(self):
+        return len(self._pdf.pages)
+
+    def page_text(self, index):
+        with self._lock:
+            return self._reader.pages[index].extract_text() or ""
+
+    def page_tables(self, index):
+        with self._lock:
+            return self._pdf.pages[index].extract_tables()
+
+    def render_page(self, index, dpi):
+        import numpy as np
+
+        with self._lock:
+            return np.array(self._pdf.pages[index].to_image(resolution=dpi).original)
+
+    def close(self):
+        self._pdf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+BACKENDS = {
+    "pymupdf": PyMuPDFDocument,
+    "legacy": LegacyDocument,
+}
+
+
+def open_document(source, backend=None):
+    # source is either a file path or the raw PDF bytes
+    backend = backend or EXTRACTION_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown extraction backend: {backend}")
+    return BACKENDS[backend](source)
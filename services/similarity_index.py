@@ -0,0 +1,239 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from services import storage, text_compare
+
+# On-disk home of the index; the base segment is memory-mapped, new documents go to an append-only log
+SIMILARITY_INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", os.path.join(storage.UPLOAD_DIR, "similarity"))
+# LSH bands; each band hashes COMPARE_NUM_PERM / LSH_BANDS signature values
+LSH_BANDS = int(os.getenv("LSH_BANDS", "32"))
+# Log records folded into a new base segment once there are this many
+SIMILARITY_COMPACT_THRESHOLD = int(os.getenv("SIMILARITY_COMPACT_THRESHOLD", "1000"))
+
+_ID_BYTES = 36
+_RECORD_BYTES = _ID_BYTES + 8 * text_compare.COMPARE_NUM_PERM
+
+
+def band_keys(signatures, bands=LSH_BANDS):
+    # (n, num_perm) signatures -> (n, bands) uint64 bucket keys, FNV-style mix of each band's values
+    signatures = np.asarray(signatures, dtype=np.uint64).reshape(len(signatures), bands, -1)
+    keys = np.full(signatures.shape[:2], 0xCBF29CE484222325, dtype=np.uint64)
+    for column in range(signatures.shape[2]):
+        keys = (keys ^ signatures[:, :, column]) * np.uint64(0x100000001B3)
+    return keys
+
+
+class SimilarityIndex:
+    # MinHash LSH over the corpus search signatures. The base segment (ids, signatures and per-band
+    # sorted bucket keys) is memory-mapped, so lookups are binary searches and startup reads nothing
+    # but the manifest. Uploads append to a log that every reader replays incrementally.
+
+    def __init__(self, directory=SIMILARITY_INDEX_DIR, bands=LSH_BANDS):
+        if text_compare.COMPARE_NUM_PERM % bands:
+            raise ValueError("COMPARE_NUM_PERM must be divisible by LSH_BANDS")
+        self.directory = directory
+        self.bands = bands
+        self._lock = threading.Lock()
+        self._generation = None
+        self._log_offset = 0
+        self._base_ids = np.empty(0, dtype=f"S{_ID_BYTES}")
+        self._base_signatures = np.empty((0, text_compare.COMPARE_NUM_PERM), dtype=np.uint64)
+        self._base_keys = np.empty((bands, 0), dtype=np.uint64)
+        self._base_positions = np.empty((bands, 0), dtype=np.int64)
+        # Base positions in id order, for binary searches by id (loaded on first use)
+        self._base_order = None
+        # Latest log position of each document added since the base segment was built
+        self._log_positions = {}
+        self._log_ids = []
+        self._log_signatures = []
+        self._log_buckets = [dict() for _ in range(bands)]
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _locked(self):
+        # Cross-process lock serialising log appends with compaction
+        os.makedirs(self.directory, exist_ok=True)
+        return storage.file_lock(self._path("lock"))
+
+    def _read_manifest(self):
+        path = self._path("manifest.json")
+        if not os.path.exists(path):
+            return {"generation": 0, "count": 0}
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("numPerm") != text_compare.COMPARE_NUM_PERM or manifest.get("bands") != self.bands:
+            raise ValueError("Similarity index was built with different MinHash/LSH settings, rebuild it.")
+        return manifest
+
+    def _load_base(self, manifest):
+        generation = manifest["generation"]
+        self._generation = generation
+        self._log_offset = 0
+        self._log_ids, self._log_signatures = [], []
+        self._log_positions = {}
+        self._log_buckets = [dict() for _ in range(self.bands)]
+        self._base_order = None
+        if manifest["count"]:
+            prefix = self._path(f"base-{generation}")
+            self._base_ids = np.load(f"{prefix}-ids.npy", mmap_mode="r")
+            self._base_signatures = np.load(f"{prefix}-signatures.npy", mmap_mode="r")
+            self._base_keys = np.load(f"{prefix}-keys.npy", mmap_mode="r")
+            self._base_positions = np.load(f"{prefix}-positions.npy", mmap_mode="r")
+        else:
+            self._base_ids = np.empty(0, dtype=f"S{_ID_BYTES}")
+            self._base_signatures = np.empty((0, text_compare.COMPARE_NUM_PERM), dtype=np.uint64)
+            self._base_keys = np.empty((self.bands, 0), dtype=np.uint64)
+            self._base_positions = np.empty((self.bands, 0), dtype=np.int64)
+
+    def _base_position(self, doc_id):
+        # Position of doc_id in the base segment (ids are unique there), or None; called with _lock held
+        if not len(self._base_ids):
+            return None
+        if self._base_order is None:
+            path = self._path(f"base-{self._generation}-order.npy")
+            # Bases written before the order file existed are sorted once, in memory
+            self._base_order = np.load(path, mmap_mode="r") if os.path.exists(path) \
+                else np.argsort(self._base_ids, kind="stable")
+        target = doc_id.encode("ascii")
+        lo, hi = 0, len(self._base_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._base_ids[self._base_order[mid]] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self._base_order) and self._base_ids[self._base_order[lo]] == target:
+            return int(self._base_order[lo])
+        return None
+
+    def refresh(self):
+        # Pick up a new base segment and any log records written by other processes
+        with self._lock:
+            manifest = self._read_manifest()
+            if manifest["generation"] != self._generation:
+                self._load_base(manifest)
+            log_path = self._path(f"log-{self._generation}.bin")
+            if not os.path.exists(log_path):
+                return
+            with open(log_path, "rb") as f:
+                f.seek(self._log_offset)
+                data = f.read()
+            complete = len(data) - len(data) % _RECORD_BYTES
+            for start in range(0, complete, _RECORD_BYTES):
+                record = data[start:start + _RECORD_BYTES]
+                doc_id = record[:_ID_BYTES].rstrip(b"\0").decode("ascii")
+                signature = np.frombuffer(record[_ID_BYTES:], dtype=np.uint64)
+                position = len(self._log_ids)
+                self._log_ids.append(doc_id)
+                self._log_signatures.append(signature)
+                for band, key in enumerate(band_keys(signature[None, :], self.bands)[0]):
+                    self._log_buckets[band].setdefault(int(key), []).append(position)
+                self._log_positions[doc_id] = position
+            self._log_offset += complete
+
+    def add(self, doc_id, signature):
+        # Append one document; safe to call from any process
+        record = doc_id.encode("ascii").ljust(_ID_BYTES, b"\0")[:_ID_BYTES]
+        record += np.asarray(signature, dtype=np.uint64).tobytes()
+        with self._locked():
+            generation = self._read_manifest()["generation"]
+            with open(self._path(f"log-{generation}.bin"), "ab") as log:
+                log.write(record)
+            log_records = os.path.getsize(self._path(f"log-{generation}.bin")) // _RECORD_BYTES
+        if log_records >= SIMILARITY_COMPACT_THRESHOLD:
+            self.compact()
+
+    def compact(self):
+        # Fold the log into a new memory-mappable base segment
+        with self._locked():
+            self.refresh()
+            with self._lock:
+                ids = list(self._base_ids) + [doc_id.encode("ascii") for doc_id in self._log_ids]
+                signatures = np.vstack([np.asarray(self._base_signatures)] + self._log_signatures) \
+                    if self._log_signatures else np.asarray(self._base_signatures)
+                old_generation = self._generation
+            if not self._log_signatures:
+                return
+            # Later entries for the same document win
+            latest = {doc_id: i for i, doc_id in enumerate(ids)}
+            keep = np.array(sorted(latest.values()), dtype=np.int64)
+            ids = np.array([ids[i] for i in keep], dtype=f"S{_ID_BYTES}")
+            signatures = signatures[keep]
+            keys = band_keys(signatures, self.bands).T
+            positions = np.argsort(keys, axis=1, kind="stable")
+            keys = np.take_along_axis(keys, positions, axis=1)
+            generation = old_generation + 1
+            prefix = self._path(f"base-{generation}")
+            np.save(f"{prefix}-ids.npy", ids)
+            np.save(f"{prefix}-signatures.npy", signatures)
+            np.save(f"{prefix}-keys.npy", keys)
+            np.save(f"{prefix}-positions.npy", positions)
+            np.save(f"{prefix}-order.npy", np.argsort(ids, kind="stable"))
+            manifest = {
+                "generation": generation,
+                "count": len(ids),
+                "numPerm": text_compare.COMPARE_NUM_PERM,
+                "bands": self.bands,
+            }
+            tmp_path = self._path("manifest.json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_path, self._path("manifest.json"))
+            # Readers that still map the old generation keep their open file handles. Windows refuses to
+            # remove mapped files; those go at a later compaction.
+            for name in os.listdir(self.directory):
+                if not name.startswith(("base-", "log-")):
+                    continue
+                if int(name.split("-")[1].split(".")[0]) < generation:
+                    try:
+                        os.remove(self._path(name))
+                    except OSError:
+                        pass
+        self.refresh()
+
+    def signature_of(self, doc_id):
+        with self._lock:
+            position = self._log_positions.get(doc_id)
+            if position is not None:
+                return self._log_signatures[position]
+            position = self._base_position(doc_id)
+            return np.asarray(self._base_signatures[position]) if position is not None else None
+
+    def query(self, signature, k=10, exclude=None, min_similarity=0.0):
+        # Top-k documents sharing at least one LSH bucket with signature, ranked by MinHash agreement
+        self.refresh()
+        keys = band_keys(np.asarray(signature, dtype=np.uint64)[None, :], self.bands)[0]
+        with self._lock:
+            candidates = {}
+            for band, key in enumerate(keys):
+                row = self._base_keys[band]
+                lo, hi = np.searchsorted(row, key, side="left"), np.searchsorted(row, key, side="right")
+                for position in self._base_positions[band][lo:hi]:
+                    doc_id = self._base_ids[position].decode("ascii")
+                    # Superseded by a later log entry
+                    if doc_id not in self._log_positions:
+                        candidates[doc_id] = self._base_signatures[position]
+                for position in self._log_buckets[band].get(int(key), []):
+                    doc_id = self._log_ids[position]
+                    if self._log_positions.get(doc_id) == position:
+                        candidates[doc_id] = self._log_signatures[position]
+        candidates.pop(exclude, None)
+        if not candidates:
+            return []
+        ids = list(candidates)
+        scores = (np.vstack([np.asarray(candidates[doc_id]) for doc_id in ids]) == signature).mean(axis=1)
+        ranked = sorted(zip(ids, scores.tolist()), key=lambda item: item[1], reverse=True)
+        return [(doc_id, score) for doc_id, score in ranked if score >= min_similarity][:k]
+
+    def size(self):
+        self.refresh()
+        with self._lock:
+            return len(self._base_ids) + sum(
+                1 for doc_id in self._log_positions if self._base_position(doc_id) is None)
+
+
+similarity_index = SimilarityIndex()
@@ -0,0 +1,418 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Where document bodies, layouts, comparison indexes and uploaded PDFs are kept:
+#   "local" a directory (UPLOAD_DIR); share it between nodes through a network file system
+#   "s3"    an S3-compatible bucket (AWS, MinIO, ...), for workers on several nodes
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+# Root directory of the local backend, and of the node-local data (checkpoints, similarity index)
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+STORAGE_S3_BUCKET = os.getenv("STORAGE_S3_BUCKET", "")
+# Key prefix inside the bucket, e.g. "doccompare/"
+STORAGE_S3_PREFIX = os.getenv("STORAGE_S3_PREFIX", "")
+# Endpoint of an S3-compatible service other than AWS, e.g. http://localhost:9000 for MinIO
+STORAGE_S3_ENDPOINT_URL = os.getenv("STORAGE_S3_ENDPOINT_URL") or None
+STORAGE_S3_REGION = os.getenv("STORAGE_S3_REGION") or None
+# Seconds to wait for a document lock before giving up
+STORAGE_LOCK_TIMEOUT = float(os.getenv("STORAGE_LOCK_TIMEOUT", "30"))
+# Seconds after which an S3 lock left behind by a crashed worker is broken
+STORAGE_LOCK_TTL = float(os.getenv("STORAGE_LOCK_TTL", "300"))
+
+
+class StorageLockTimeout(Exception):
+    pass
+
+
+def _wait(started, timeout, name, delay):
+    # Sleep before the next lock attempt (timeout None waits forever); returns the next delay
+    if timeout is not None:
+        remaining = timeout - (time.monotonic() - started)
+        if remaining <= 0:
+            raise StorageLockTimeout(f"Timed out waiting for the lock on {name}.")
+        delay = min(delay, remaining)
+    time.sleep(delay)
+    return min(delay * 2, 0.5)
+
+
+def _try_lock(handle):
+    # Non-blocking exclusive lock on an open file: flock, or a one-byte msvcrt lock on Windows
+    if fcntl is not None:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+    try:
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+@contextmanager
+def file_lock(path, timeout=None):
+    # Exclusive lock on path across threads and processes of this machine (or file system). The OS
+    # releases it when the holder dies, so there is nothing to clean up after a crash.
+    handle = open(path, "a+")
+    try:
+        started, delay = time.monotonic(), 0.01
+        while not _try_lock(handle):
+            delay = _wait(started, timeout, os.path.basename(path), delay)
+        yield
+    finally:
+        handle.close()
+
+
+class LocalStorage:
+    # Keys are relative paths under root ("abc.json", "layout/abc.json", "pdf/<sha256>.pdf").
+    # Writes go to a unique temporary file in the target directory that is renamed over the key, so
+    # readers in any process see either the old or the new content, never a partial file.
+
+    def __init__(self, root=UPLOAD_DIR):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def size(self, key):
+        # Size in bytes, or None when the key is missing
+        try:
+            return os.path.getsize(self.path(key))
+        except OSError:
+            return None
+
+    def read(self, key):
+        # Content, or None when the key is missing
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def read_range(self, key, start, end):
+        with open(self.path(key), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def open(self, key):
+        # Seekable binary file object; raises FileNotFoundError when the key is missing
+        return open(self.path(key), "rb")
+
+    def iter_chunks(self, key, chunk_size=65536):
+        # An open file keeps the content it was opened with even if the key is replaced meanwhile
+        with open(self.path(key), "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def write(self, key, data):
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def staging_dir(self, prefix):
+        # Where to spool a file that put_file will move under prefix; the same file system, so the
+        # move is a rename
+        directory = self.path(prefix)
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def put_file(self, key, local_path):
+        # Move a complete local file to key
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        os.replace(local_path, self.path(key))
+
+    @contextmanager
+    def local_copy(self, key):
+        # Path of a local file with the key's content, for libraries that need one
+        yield self.path(key)
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix=""):
+        # Names of the keys directly under prefix ("" or "dir/"), without the prefix
+        directory = self.path(prefix.rstrip("/")) if prefix else self.root
+        try:
+            return sorted(
+                name for name in os.listdir(directory)
+                if not name.startswith(".") and os.path.isfile(os.path.join(directory, name))
+            )
+        except FileNotFoundError:
+            return []
+
+    @contextmanager
+    def lock(self, name, timeout=STORAGE_LOCK_TIMEOUT):
+        # Exclusive lock across threads and processes on this file system (see file_lock)
+        directory = os.path.join(self.root, "locks")
+        os.makedirs(directory, exist_ok=True)
+        with file_lock(os.path.join(directory, f"{name}.lock"), timeout):
+            yield
+
+
+class _S3Reader:
+    # Seekable read-only view of an object, fetched with ranged GETs. Reads smaller than
+    # read_ahead fetch read_ahead bytes, so a container's preamble and header cost one request.
+
+    def __init__(self, client, bucket, key, read_ahead=65536):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._read_ahead = read_ahead
+        self._position = 0
+        self._buffer_start = 0
+        self._buffer = b""
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence != os.SEEK_SET:
+            raise ValueError("Only absolute seeks are supported")
+        self._position = offset
+        return offset
+
+    def tell(self):
+        return self._position
+
+    def read(self, size=-1):
+        start = self._position
+        if size == 0:
+            return b""
+        if size is None or size < 0:
+            data = _get(self._client, self._bucket, self._key, f"bytes={start}-")
+        else:
+            buffer_end = self._buffer_start + len(self._buffer)
+            if not (self._buffer_start <= start and start + size <= buffer_end):
+                fetch = max(size, self._read_ahead)
+                self._buffer = _get(self._client, self._bucket, self._key, f"bytes={start}-{start + fetch - 1}")
+                self._buffer_start = start
+            offset = start - self._buffer_start
+            data = self._buffer[offset:offset + size]
+        self._position += len(data)
+        return data
+
+    def close(self):
+        self._buffer = b""
+
+
+def _missing(error):
+    return error.response.get("Error", {}).get("Code") in ("NoSuchKey", "404", "NotFound")
+
+
+def _get(client, bucket, key, byte_range=None):
+    from botocore.exceptions import ClientError
+
+    try:
+        if byte_range is None:
+            return client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        return client.get_object(Bucket=bucket, Key=key, Range=byte_range)["Body"].read()
+    except ClientError as e:
+        if _missing(e):
+            raise FileNotFoundError(key) from e
+        # A range starting at the end of the object
+        if e.response.get("Error", {}).get("Code") == "InvalidRange":
+            return b""
+        raise
+
+
+class S3Storage:
+    # Same keys as LocalStorage, stored as objects under prefix. A PUT replaces an object atomically.
+    # Locks are lock objects created with a conditional PUT (If-None-Match), which AWS S3 and MinIO
+    # both honour; a lock older than STORAGE_LOCK_TTL is taken to be abandoned and broken.
+
+    def __init__(self, bucket=STORAGE_S3_BUCKET, prefix=STORAGE_S3_PREFIX, endpoint_url=STORAGE_S3_ENDPOINT_URL,
+                 region=STORAGE_S3_REGION, client=None):
+        if not bucket:
+            raise ValueError("STORAGE_S3_BUCKET must be set for the s3 storage backend")
+        self.bucket = bucket
+        self.prefix = prefix if not prefix or prefix.endswith("/") else f"{prefix}/"
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self._client = client
+        self._client_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Clients don't survive pickling (process pools); each process creates its own
+        return {**self.__dict__, "_client": None, "_client_lock": None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+
+                    self._client = boto3.client("s3", endpoint_url=self.endpoint_url, region_name=self.region)
+        return self._client
+
+    def _key(self, key):
+        return f"{self.prefix}{key}"
+
+    def _head(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if _missing(e):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def size(self, key):
+        head = self._head(key)
+        return head["ContentLength"] if head is not None else None
+
+    def read(self, key):
+        try:
+            return _get(self.client, self.bucket, self._key(key))
+        except FileNotFoundError:
+            return None
+
+    def read_range(self, key, start, end):
+        if end <= start:
+            return b""
+        return _get(self.client, self.bucket, self._key(key), f"bytes={start}-{end - 1}")
+
+    def open(self, key):
+        if not self.exists(key):
+            raise FileNotFoundError(key)
+        return _S3Reader(self.client, self.bucket, self._key(key))
+
+    def iter_chunks(self, key, chunk_size=65536):
+        from botocore.exceptions import ClientError
+
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self._key(key))["Body"]
+        except ClientError as e:
+            if _missing(e):
+                raise FileNotFoundError(key) from e
+            raise
+        yield from body.iter_chunks(chunk_size)
+
+    def write(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=data)
+
+    def staging_dir(self, prefix):
+        return tempfile.gettempdir()
+
+    def put_file(self, key, local_path):
+        # Upload a complete local file (multipart for large ones) and remove it
+        self.client.upload_file(local_path, self.bucket, self._key(key))
+        os.remove(local_path)
+
+    @contextmanager
+    def local_copy(self, key):
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self._key(key), path)
+            yield path
+        finally:
+            os.remove(path)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+    def list(self, prefix=""):
+        names = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        full_prefix = self._key(prefix)
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=full_prefix, Delimiter="/"):
+            names.extend(item["Key"][len(full_prefix):] for item in page.get("Contents", []))
+        return sorted(names)
+
+    @contextmanager
+    def lock(self, name, timeout=STORAGE_LOCK_TIMEOUT):
+        from botocore.exceptions import ClientError
+
+        key = self._key(f"locks/{name}.lock")
+        token = uuid.uuid4().hex.encode("ascii")
+        started, delay = time.monotonic(), 0.01
+        while True:
+            try:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=token, IfNoneMatch="*")
+                break
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                # ConditionalRequestConflict: another PUT of the lock was in flight
+                if code not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                    raise
+            self._break_stale_lock(key)
+            delay = _wait(started, timeout, name, delay)
+        try:
+            yield
+        finally:
+            # Only remove the lock if it is still ours (it may have been broken as stale)
+            try:
+                if _get(self.client, self.bucket, key) == token:
+                    self.client.delete_object(Bucket=self.bucket, Key=key)
+            except FileNotFoundError:
+                pass
+
+    def _break_stale_lock(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if _missing(e):
+                return
+            raise
+        age = (datetime.now(timezone.utc) - head["LastModified"]).total_seconds()
+        if age > STORAGE_LOCK_TTL:
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "local":
+        return LocalStorage()
+    if backend == "s3":
+        return S3Storage()
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def storage_for(upload_dir=None):
+    # The configured storage, or a local directory given on a tool's command line
+    return LocalStorage(upload_dir) if upload_dir else storage
+
+
+# Shared by the API, the extraction workers and the command line tools; nothing is created on disk
+# or in the bucket until the first write
+storage = create_storage()
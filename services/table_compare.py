@@ -0,0 +1,159 @@
+import hashlib
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+
+from services import text_compare
+
+# Tables scoring above this are considered the same table in both documents
+MATCH_THRESHOLD = 0.5
+# Matched tables whose cell sets overlap more than this are reported as similar instead of diffed
+SIMILAR_CONTENT_THRESHOLD = 0.7
+
+
+def _normalize_cell(cell):
+    return str(cell).strip().lower()
+
+
+def _hash(value):
+    # Stable 64-bit hash so fingerprints can be stored and compared across processes
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _hash_array(values):
+    return np.unique(np.fromiter((_hash(v) for v in values), dtype=np.uint64, count=len(values)))
+
+
+def fingerprint_table(table):
+    # Normalise a table once: header, and hashed sets of header cells, body rows and all cells
+    header = tuple(_normalize_cell(cell) for cell in table[0]) if table else tuple()
+    rows = {"\x1f".join(_normalize_cell(cell) for cell in row) for row in table[1:]}
+    cells = {_normalize_cell(cell) for row in table for cell in row}
+    return {
+        "header": list(header),
+        "headerLength": len(header),
+        "headerHashes": _hash_array(set(header)),
+        "rowHashes": _hash_array(rows),
+        "cellHashes": _hash_array(cells),
+    }
+
+
+def fingerprint_tables(tables):
+    return [fingerprint_table(table) for table in tables]
+
+
+def _incidence(hash_sets, vocabulary):
+    # Sparse 0/1 matrix: one row per table, one column per distinct hash
+    lengths = [len(h) for h in hash_sets]
+    rows = np.repeat(np.arange(len(hash_sets)), lengths)
+    cols = np.searchsorted(vocabulary, np.concatenate(hash_sets)) if rows.size else np.empty(0, dtype=np.int64)
+    data = np.ones(len(rows), dtype=np.float64)
+    return csr_matrix((data, (rows, cols)), shape=(len(hash_sets), len(vocabulary)))
+
+
+def _intersections(sets1, sets2):
+    # |s1 & s2| for every pair, as one sparse matrix product
+    vocabulary = np.unique(np.concatenate(list(sets1) + list(sets2) + [np.empty(0, dtype=np.uint64)]))
+    return (_incidence(sets1, vocabulary) @ _incidence(sets2, vocabulary).T).toarray()
+
+
+def similarity_matrix(fingerprints1, fingerprints2):
+    # 0.7 * header overlap + 0.3 * Jaccard of body rows, for all table pairs at once
+    if not fingerprints1 or not fingerprints2:
+        return np.zeros((len(fingerprints1), len(fingerprints2)))
+    header_inter = _intersections([f["headerHashes"] for f in fingerprints1], [f["headerHashes"] for f in fingerprints2])
+    row_inter = _intersections([f["rowHashes"] for f in fingerprints1], [f["rowHashes"] for f in fingerprints2])
+    header_len1 = np.array([f["headerLength"] for f in fingerprints1], dtype=np.float64)[:, None]
+    header_len2 = np.array([f["headerLength"] for f in fingerprints2], dtype=np.float64)[None, :]
+    rows1 = np.array([len(f["rowHashes"]) for f in fingerprints1], dtype=np.float64)[:, None]
+    rows2 = np.array([len(f["rowHashes"]) for f in fingerprints2], dtype=np.float64)[None, :]
+    header_score = header_inter / np.maximum(1, np.maximum(header_len1, header_len2))
+    row_score = row_inter / np.maximum(1, rows1 + rows2 - row_inter)
+    scores = 0.7 * header_score + 0.3 * row_score
+    # Tables without a header never match
+    scores[(header_len1 == 0) | (header_len2 == 0)] = 0
+    return scores
+
+
+def match_tables(fingerprints1, fingerprints2, threshold=MATCH_THRESHOLD):
+    # Optimal one-to-one assignment (Hungarian) maximising the total similarity; returns {i: (j, score)}
+    scores = similarity_matrix(fingerprints1, fingerprints2)
+    if not scores.size:
+        return {}
+    weights = np.where(scores > threshold, scores, 0.0)
+    rows, cols = linear_sum_assignment(weights, maximize=True)
+    return {int(i): (int(j), float(scores[i, j])) for i, j in zip(rows, cols) if scores[i, j] > threshold}
+
+
+def _jaccard(hashes1, hashes2):
+    overlap = len(np.intersect1d(hashes1, hashes2, assume_unique=True))
+    return overlap / max(1, len(hashes1) + len(hashes2) - overlap)
+
+
+def compare_tables(tables1, tables2, fingerprints1=None, fingerprints2=None):
+    # Table diff entries in the /upload/compare/ response format
+    if fingerprints1 is None:
+        fingerprints1 = fingerprint_tables(tables1)
+    if fingerprints2 is None:
+        fingerprints2 = fingerprint_tables(tables2)
+    matches = match_tables(fingerprints1, fingerprints2)
+    table_diffs = []
+    for i, t1 in enumerate(tables1):
+        fp1 = fingerprints1[i]
+        if i not in matches:
+            # No match found in doc2
+            table_diffs.append({
+                "tableIndexDoc1": i + 1,
+                "onlyIn": "doc1",
+                "header": fp1["header"],
+                "table": t1,
+            })
+            continue
+        j, _ = matches[i]
+        t2, fp2 = tables2[j], fingerprints2[j]
+        content_similarity = _jaccard(fp1["cellHashes"], fp2["cellHashes"])
+        if fp1["header"] == fp2["header"] and np.array_equal(fp1["rowHashes"], fp2["rowHashes"]):
+            # Content equivalent, even if order differs
+            table_diffs.append({
+                "tableIndexDoc1": i + 1,
+                "tableIndexDoc2": j + 1,
+                "header": fp1["header"],
+                "contentEquivalent": True,
+                "table": t1,
+            })
+        elif content_similarity > SIMILAR_CONTENT_THRESHOLD:
+            # Similar content, different structure
+            table_diffs.append({
+                "tableIndexDoc1": i + 1,
+                "tableIndexDoc2": j + 1,
+                "header1": fp1["header"],
+                "header2": fp2["header"],
+                "similarContent": True,
+                "similarityScore": round(content_similarity, 2),
+                "table1": t1,
+                "table2": t2,
+            })
+        else:
+            lines1 = [",".join(str(cell) for cell in row) for row in t1]
+            lines2 = [",".join(str(cell) for cell in row) for row in t2]
+            table_diffs.append({
+                "tableIndexDoc1": i + 1,
+                "tableIndexDoc2": j + 1,
+                "header": fp1["header"],
+                "diff": text_compare.unified_diff(
+                    lines1, lines2, fromfile=f"doc1_table_{i+1}", tofile=f"doc2_table_{j+1}",
+                    limit=100,  # Limit diff lines for response size
+                ),
+            })
+    # Any tables in doc2 not matched
+    matched2 = {j for j, _ in matches.values()}
+    for j, t2 in enumerate(tables2):
+        if j not in matched2:
+            table_diffs.append({
+                "tableIndexDoc2": j + 1,
+                "onlyIn": "doc2",
+                "header": fingerprints2[j]["header"],
+                "table": t2,
+            })
+    return table_diffs
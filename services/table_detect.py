@@ -0,0 +1,136 @@
+import re
+
+# A cell is a run of words joined by single spaces; tabs and runs of two or more spaces separate cells
+_CELL = re.compile(r"\S+(?:[^\S\t]\S+)*")
+# A row whose cells start within this many characters of the table's known columns is aligned with it
+ALIGN_SLACK = 2
+# Aligned rows may have this many cells more or fewer than the table's usual count (empty cells)
+RAGGED_TOLERANCE = 1
+MIN_ROWS = 2
+
+
+def split_row(line):
+    # Cells of one line, and whether they came from comma separation rather than column gaps
+    if "\t" not in line and "  " not in line:
+        # A single run of words; the common case for prose, decided without the regex
+        if "," not in line:
+            return ([line.strip()] if line.strip() else []), False
+        cells = [cell.strip() for cell in line.split(",")]
+        return (cells if any(cells) else []), True
+    cells = _CELL.findall(line)
+    if len(cells) <= 1 and "," in line:
+        cells = [cell.strip() for cell in line.split(",")]
+        return (cells if any(cells) else []), True
+    return cells, False
+
+
+# Byte per character: 1 for ink, 0 for a space
+_INK = bytes(0 if byte == 0x20 else 1 for byte in range(256))
+
+
+def cell_starts(line):
+    # Integer with byte i set to 1 when a cell starts at column i (ink after two spaces or at the
+    # start of the line), so whole rows are compared with a few big-integer operations
+    ink = int.from_bytes(line.encode("ascii", "replace").translate(_INK), "little")
+    return ink & ~(ink << 8) & ~(ink << 16)
+
+
+def _widen(starts):
+    # Every column within ALIGN_SLACK of a cell start
+    widened = starts
+    for shift in range(8, 8 * ALIGN_SLACK + 1, 8):
+        widened |= (starts << shift) | (starts >> shift)
+    return widened
+
+
+def _positions(starts):
+    # Columns of the cell starts set in a cell_starts() integer, left to right
+    positions = []
+    while starts:
+        lowest = starts & -starts
+        positions.append((lowest.bit_length() - 1) // 8)
+        starts ^= lowest
+    return positions
+
+
+def _place_cells(rows, row_starts):
+    # Put each cell of a row shorter than the table's widest rows under the column it starts in (the
+    # cell starts of the widest rows, give or take ALIGN_SLACK), with "" for the missing cells
+    width = max(len(cells) for cells in rows)
+    if all(len(cells) == width for cells in rows):
+        return rows
+    # Per column, a bit for every character position a cell of that column starts at
+    known = [0] * width
+    for cells, starts in zip(rows, row_starts):
+        if starts and len(cells) == width:
+            for column, position in enumerate(_positions(starts)):
+                known[column] |= 1 << position
+    if not all(known):
+        return rows
+    for shift in range(1, ALIGN_SLACK + 1):
+        known = [mask | (mask << shift) | (mask >> shift) for mask in known]
+    placed = []
+    for cells, starts in zip(rows, row_starts):
+        positions = _positions(starts) if starts and len(cells) < width else ()
+        if len(positions) != len(cells):
+            placed.append(cells)
+            continue
+        row = [""] * width
+        column = 0
+        for cell, position in zip(cells, positions):
+            while column < width and not (known[column] >> position) & 1:
+                column += 1
+            if column == width:
+                break
+            row[column] = cell
+            column += 1
+        else:
+            placed.append(row)
+            continue
+        # A cell that lines up with none of the remaining columns: keep the row as it was
+        placed.append(cells)
+    return placed
+
+
+def detect_tables(text, min_rows=MIN_ROWS):
+    # Tables in plain (or OCR) text, in one pass over the lines: consecutive lines with two or more
+    # cells form a table while their cell count stays the usual one, or differs by at most
+    # RAGGED_TOLERANCE with every cell after the first starting near one of the table's columns (so a
+    # row with an empty cell stays in its table). The columns are the union of the cell starts seen
+    # so far, a histogram of where the whitespace gaps end. The cells of rows shorter than the widest
+    # ones are placed under the columns they start in, with "" for the missing ones.
+    tables = []
+    rows = []
+    row_starts = []
+    counts = {}
+    usual = 0
+    columns = 0
+    for line in text.splitlines():
+        cells, comma_separated = split_row(line)
+        n = len(cells)
+        if n < 2:
+            if rows and line.strip():
+                if len(rows) >= min_rows:
+                    tables.append(_place_cells(rows, row_starts))
+                rows, row_starts, counts, usual, columns = [], [], {}, 0, 0
+            continue
+        # Tab and comma separated rows carry no column positions
+        starts = 0 if comma_separated or "\t" in line else cell_starts(line)
+        if rows and n != usual:
+            aligned = False
+            if starts and abs(n - usual) <= RAGGED_TOLERANCE:
+                # Drop the first cell (lowest set bit): a row always starts somewhere
+                aligned = not (starts & (starts - 1)) & ~_widen(columns)
+            if not aligned:
+                if len(rows) >= min_rows:
+                    tables.append(_place_cells(rows, row_starts))
+                rows, row_starts, counts, usual, columns = [], [], {}, 0, 0
+        rows.append(cells)
+        row_starts.append(starts)
+        columns |= starts & (starts - 1)
+        counts[n] = counts.get(n, 0) + 1
+        if counts[n] > counts.get(usual, 0):
+            usual = n
+    if len(rows) >= min_rows:
+        tables.append(_place_cells(rows, row_starts))
+    return tables
@@ -0,0 +1,86 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" for one JSON object per line, "text" for plain messages
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+STAGE_SECONDS = Histogram(
+    "doccompare_stage_seconds",
+    "Wall time of each extraction and comparison stage",
+    ["pipeline", "stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+STAGE_ERRORS = Counter(
+    "doccompare_stage_errors_total",
+    "Stages that raised and were skipped",
+    ["pipeline", "stage"],
+)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+
+
+def log_fields(**fields):
+    # Structured fields for a log call: logger.info("...", extra=log_fields(fileName=...))
+    return {"fields": fields}
+
+
+@contextmanager
+def timed(timings, stage):
+    # Adds the wall time of the block to timings[stage] (seconds). Safe to use in worker processes:
+    # the caller hands the timings back and the API process observes them with observe().
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def observe(pipeline, timings):
+    # Record a timings dict in the stage histogram; list values are one observation per item (e.g. OCR pages)
+    for stage, value in timings.items():
+        for seconds in value if isinstance(value, list) else [value]:
+            STAGE_SECONDS.labels(pipeline=pipeline, stage=stage).observe(seconds)
+
+
+def count_error(pipeline, stage):
+    STAGE_ERRORS.labels(pipeline=pipeline, stage=stage).inc()
+
+
+def metrics_payload():
+    # Exposition for /metrics; aggregates all processes when PROMETHEUS_MULTIPROC_DIR is set
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
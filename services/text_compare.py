@@ -0,0 +1,316 @@
+import difflib
+import os
+import re
+import zlib
+from bisect import bisect_left
+from itertools import islice
+
+import numpy as np
+
+# "exact" scores from the line diff, "approximate" from MinHash sketches, "auto" picks by document size
+COMPARE_MODE = os.getenv("COMPARE_MODE", "auto")
+# In auto mode, documents with more lines than this (both sides together) are scored approximately
+COMPARE_EXACT_MAX_LINES = int(os.getenv("COMPARE_EXACT_MAX_LINES", "20000"))
+# Changed hunks up to this many characters are re-scored character by character in exact mode
+COMPARE_REFINE_MAX_CHARS = int(os.getenv("COMPARE_REFINE_MAX_CHARS", "4000"))
+# Word shingle length and number of hash functions of the MinHash sketch
+COMPARE_SHINGLE_SIZE = int(os.getenv("COMPARE_SHINGLE_SIZE", "3"))
+COMPARE_NUM_PERM = int(os.getenv("COMPARE_NUM_PERM", "128"))
+
+MODES = ("auto", "exact", "approximate")
+
+# Gaps without unique anchor lines smaller than this (len(a) * len(b)) are matched with difflib,
+# larger ones with Myers' O(ND) diff as long as they need at most _MAX_GAP_EDITS inserted/deleted lines
+_SMALL_GAP = 2500
+_MAX_GAP_EDITS = 1000
+_TOKEN_RE = re.compile(r"\w+")
+
+# Multiply-shift hash family, h(x) = ((a * x + b) mod 2^64) >> 32 with odd a.
+# Fixed seed: sketches must be comparable across processes and restarts.
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(0, 1 << 62, size=COMPARE_NUM_PERM, dtype=np.int64).astype(np.uint64) * np.uint64(4) + np.uint64(1)
+_PERM_B = _rng.randint(0, 1 << 62, size=COMPARE_NUM_PERM, dtype=np.int64).astype(np.uint64) * np.uint64(4)
+
+
+def _unique_anchors(a, b, alo, ahi, blo, bhi):
+    # Patience step: lines occurring exactly once on both sides, reduced to their longest increasing run
+    a_pos = {}
+    for i in range(alo, ahi):
+        a_pos[a[i]] = -1 if a[i] in a_pos else i
+    b_pos = {}
+    for j in range(blo, bhi):
+        line = b[j]
+        if a_pos.get(line, -1) >= 0:
+            b_pos[line] = -1 if line in b_pos else j
+    pairs = sorted((a_pos[line], j) for line, j in b_pos.items() if j >= 0)
+    if not pairs:
+        return []
+    # Longest increasing subsequence of the b indices (patience sorting)
+    tails = []
+    tail_index = []
+    back = [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_index.append(k)
+        else:
+            tails[pos] = j
+            tail_index[pos] = k
+        back[k] = tail_index[pos - 1] if pos else None
+    result = []
+    k = tail_index[-1]
+    while k is not None:
+        result.append(pairs[k])
+        k = back[k]
+    result.reverse()
+    return result
+
+
+def _myers_matches(a, b, alo, ahi, blo, bhi, max_edits=_MAX_GAP_EDITS):
+    # Matched (i, j) pairs of a shortest edit script between a[alo:ahi] and b[blo:bhi] (Myers' greedy
+    # O((N+M)D) algorithm), or None if it needs more than max_edits insertions and deletions
+    n, m = ahi - alo, bhi - blo
+    limit = min(n + m, max_edits)
+    offset = limit + 1
+    v = [0] * (2 * limit + 3)
+    # Furthest x reached on each diagonal k = x - y after d edits, for k = -d, -d + 2, ..., d
+    rounds = []
+    done = False
+    for d in range(limit + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            done = done or (x >= n and y >= m)
+        rounds.append(v[offset - d:offset + d + 1:2])
+        if done:
+            break
+    if not done:
+        return None
+    # Walk back from (n, m), collecting the diagonal runs
+    matches = []
+    x, y = n, m
+    for d in range(len(rounds) - 1, 0, -1):
+        previous = rounds[d - 1]
+        k = x - y
+        if k == -d or (k != d and previous[(k - 1 + d - 1) // 2] < previous[(k + 1 + d - 1) // 2]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = previous[(prev_k + d - 1) // 2]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((alo + x, blo + y))
+        x, y = prev_x, prev_y
+    while x > 0 and y > 0:
+        x -= 1
+        y -= 1
+        matches.append((alo + x, blo + y))
+    return matches
+
+
+def matching_lines(a, b):
+    # Patience diff: returns the sorted list of (i, j) pairs of equal lines. Each level is linear in the
+    # size of the region it looks at, so large documents stay close to O(n) instead of difflib's O(n^2).
+    # Regions without unique lines to anchor on (e.g. tables of repeated rows) fall back to Myers' diff,
+    # whose cost grows with the number of differences rather than the size of the region.
+    matches = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo >= ahi or blo >= bhi:
+            continue
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if anchors:
+            prev_i, prev_j = alo, blo
+            for i, j in anchors:
+                matches.append((i, j))
+                stack.append((prev_i, i, prev_j, j))
+                prev_i, prev_j = i + 1, j + 1
+            stack.append((prev_i, ahi, prev_j, bhi))
+        elif (ahi - alo) * (bhi - blo) <= _SMALL_GAP:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, size in matcher.get_matching_blocks():
+                matches.extend((alo + i + k, blo + j + k) for k in range(size))
+        else:
+            # Reported as replaced only when the two sides differ in more than _MAX_GAP_EDITS lines
+            matches.extend(_myers_matches(a, b, alo, ahi, blo, bhi) or ())
+    matches.sort()
+    return matches
+
+
+def opcodes(a, b, matches=None):
+    # difflib-style (tag, i1, i2, j1, j2) opcodes built from the matched line pairs
+    if matches is None:
+        matches = matching_lines(a, b)
+    codes = []
+    i = j = 0
+    for mi, mj in matches + [(len(a), len(b))]:
+        if i < mi and j < mj:
+            codes.append(("replace", i, mi, j, mj))
+        elif i < mi:
+            codes.append(("delete", i, mi, j, j))
+        elif j < mj:
+            codes.append(("insert", i, i, j, mj))
+        if mi < len(a) and mj < len(b):
+            if codes and codes[-1][0] == "equal" and codes[-1][2] == mi and codes[-1][4] == mj:
+                tag, i1, _, j1, _ = codes[-1]
+                codes[-1] = (tag, i1, mi + 1, j1, mj + 1)
+            else:
+                codes.append(("equal", mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return codes
+
+
+def _grouped_opcodes(codes, n=3):
+    # Same hunk grouping as difflib.SequenceMatcher.get_grouped_opcodes
+    codes = list(codes) or [("equal", 0, 1, 0, 1)]
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+
+def _format_range(start, stop):
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f"{beginning}"
+    if not length:
+        beginning -= 1
+    return f"{beginning},{length}"
+
+
+def _unified_lines(a, b, codes, fromfile, tofile, n):
+    started = False
+    for group in _grouped_opcodes(codes, n):
+        if not started:
+            started = True
+            yield f"--- {fromfile}"
+            yield f"+++ {tofile}"
+        first, last = group[0], group[-1]
+        yield f"@@ -{_format_range(first[1], last[2])} +{_format_range(first[3], last[4])} @@"
+        for tag, i1, i2, j1, j2 in group:
+            if tag == "equal":
+                for line in a[i1:i2]:
+                    yield " " + line
+                continue
+            if tag in ("replace", "delete"):
+                for line in a[i1:i2]:
+                    yield "-" + line
+            if tag in ("replace", "insert"):
+                for line in b[j1:j2]:
+                    yield "+" + line
+
+
+def unified_diff(a, b, fromfile="doc1", tofile="doc2", n=3, limit=None, codes=None):
+    # Same output as difflib.unified_diff(..., lineterm=""), stopping after limit lines
+    if codes is None:
+        codes = opcodes(a, b)
+    return list(islice(_unified_lines(a, b, codes, fromfile, tofile, n), limit))
+
+
+def exact_similarity(a, b, codes, total_chars):
+    # Character-level ratio in the spirit of SequenceMatcher.ratio(): equal lines count in full,
+    # small changed hunks are matched character by character, large ones count as different.
+    if not total_chars:
+        return 1.0
+    matched = 0
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal":
+            matched += sum(len(line) + 1 for line in a[i1:i2])
+        elif tag == "replace":
+            left = "\n".join(a[i1:i2])
+            right = "\n".join(b[j1:j2])
+            if len(left) + len(right) <= COMPARE_REFINE_MAX_CHARS:
+                matcher = difflib.SequenceMatcher(None, left, right, autojunk=False)
+                matched += sum(size for _, _, size in matcher.get_matching_blocks())
+    return min(1.0, 2.0 * matched / total_chars)
+
+
+def shingle_hashes(text, k=COMPARE_SHINGLE_SIZE):
+    # Stable 32-bit hashes of the distinct word k-shingles of text, combined with a vectorised rolling hash
+    tokens = _TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return np.empty(0, dtype=np.uint64)
+    token_hashes = np.fromiter((zlib.crc32(t.encode("utf-8")) for t in tokens), dtype=np.uint64, count=len(tokens))
+    k = min(k, len(tokens))
+    count = len(tokens) - k + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(k):
+        hashes = (hashes * np.uint64(1000003) + token_hashes[offset:offset + count]) & np.uint64(0xFFFFFFFF)
+    return np.unique(hashes)
+
+
+def minhash(hashes, chunk_size=4096):
+    # MinHash signature over COMPARE_NUM_PERM universal hash functions, computed in bounded-memory chunks
+    signature = np.full(COMPARE_NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(hashes), chunk_size):
+        chunk = hashes[start:start + chunk_size]
+        permuted = (np.outer(chunk, _PERM_A) + _PERM_B) >> np.uint64(32)
+        signature = np.minimum(signature, permuted.min(axis=0))
+    return signature
+
+
+def approximate_similarity(text1, text2, signature1=None, signature2=None):
+    # Estimated Jaccard similarity of the two shingle sets; precomputed signatures skip the hashing
+    if signature1 is None or signature2 is None:
+        h1, h2 = shingle_hashes(text1), shingle_hashes(text2)
+        if not len(h1) and not len(h2):
+            return 1.0
+        if not len(h1) or not len(h2):
+            return 0.0
+        signature1, signature2 = minhash(h1), minhash(h2)
+    return float(np.mean(signature1 == signature2))
+
+
+def resolve_mode(mode, line_count):
+    mode = mode or COMPARE_MODE
+    if mode not in MODES:
+        raise ValueError(f"Unknown comparison mode: {mode}")
+    if mode == "auto":
+        return "exact" if line_count <= COMPARE_EXACT_MAX_LINES else "approximate"
+    return mode
+
+
+def compare_text(text1, text2, mode=None, diff_limit=200, keys1=None, keys2=None, signature1=None, signature2=None):
+    # Returns (similarity, unified diff lines, mode actually used).
+    # keys1/keys2 are optional per-line hashes used for matching, signature1/signature2 optional MinHash sketches.
+    a, b = text1.splitlines(), text2.splitlines()
+    mode = resolve_mode(mode, len(a) + len(b))
+    codes = opcodes(a if keys1 is None else keys1, b if keys2 is None else keys2)
+    diff = unified_diff(a, b, fromfile="doc1", tofile="doc2", limit=diff_limit, codes=codes)
+    if mode == "exact":
+        similarity = exact_similarity(a, b, codes, len(text1) + len(text2))
+    else:
+        similarity = approximate_similarity(text1, text2, signature1, signature2)
+    return similarity, diff, mode
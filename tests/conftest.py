@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Settings read at import time: the tests run against a scratch SQLite database and upload directory
+_scratch = tempfile.mkdtemp(prefix="doccompare-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_scratch, "test.db")
+os.environ["UPLOAD_DIR"] = os.path.join(_scratch, "uploads")
+os.environ["STORAGE_BACKEND"] = "local"
+os.environ["EXTRACTION_EXECUTOR"] = "thread"
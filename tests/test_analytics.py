@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import Base
+from models import DocumentRollup, MonthlyRollup, PDFFile
+from services import analytics, extracted_data
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def _document(db, doc_id):
+    row = PDFFile(doc_id=doc_id, filename=f"{doc_id}.pdf")
+    db.add(row)
+    db.commit()
+    return row.id
+
+
+def _rollups(db):
+    # (key, month) -> (value_count, numeric_count, total, min, max, document_count)
+    return {
+        (r.key, r.month): (r.value_count, r.numeric_count, r.total, r.min_value, r.max_value, r.document_count)
+        for r in db.query(MonthlyRollup)
+    }
+
+
+def test_parse_number():
+    assert analytics.parse_number("$1,234.50") == 1234.5
+    assert analytics.parse_number("(200)") == -200
+    assert analytics.parse_number("-3.5%") == -3.5
+    assert analytics.parse_number("") is None
+    assert analytics.parse_number("n/a") is None
+    assert analytics.parse_number("12 units") is None
+
+
+def test_rollups_follow_stored_documents(db):
+    first, second = _document(db, "first"), _document(db, "second")
+
+    extracted_data.store_rows(db, first, [
+        ("Amount", "10", "2025-07"),
+        ("Amount", "$1,200.50", "2025-07"),
+        ("Item", "Widget", "2025-07"),
+        ("Amount", "5", "2025-08"),
+        ("Amount", "7", None),
+    ])
+    extracted_data.store_rows(db, second, [
+        ("Amount", "(20)", "2025-07"),
+        ("Item", "Gadget", "2025-07"),
+    ])
+    assert _rollups(db) == {
+        ("Amount", "2025-07"): (3, 3, 1190.5, -20.0, 1200.5, 2),
+        ("Item", "2025-07"): (2, 0, 0.0, None, None, 2),
+        ("Amount", "2025-08"): (1, 1, 5.0, 5.0, 5.0, 1),
+    }
+
+    # Re-extraction replaces the document's contribution, including the maximum it held
+    extracted_data.store_rows(db, first, [
+        ("Amount", "3", "2025-07"),
+        ("Item", "n/a", "2025-07"),
+    ])
+    assert _rollups(db) == {
+        ("Amount", "2025-07"): (2, 2, -17.0, -20.0, 3.0, 2),
+        ("Item", "2025-07"): (2, 0, 0.0, None, None, 2),
+    }
+
+    # A document without rows takes its contribution back out
+    extracted_data.store_rows(db, second, [])
+    assert _rollups(db) == {
+        ("Amount", "2025-07"): (1, 1, 3.0, 3.0, 3.0, 1),
+        ("Item", "2025-07"): (1, 0, 0.0, None, None, 1),
+    }
+    assert db.query(DocumentRollup).filter(DocumentRollup.pdf_file_id == second).count() == 0
+
+    # Storing the same rows again changes nothing
+    extracted_data.store_rows(db, first, [("Amount", "3", "2025-07"), ("Item", "n/a", "2025-07")])
+    assert _rollups(db) == {
+        ("Amount", "2025-07"): (1, 1, 3.0, 3.0, 3.0, 1),
+        ("Item", "2025-07"): (1, 0, 0.0, None, None, 1),
+    }
+
+
+def test_month_rollups_report_the_change_from_the_previous_month(db):
+    document = _document(db, "doc")
+    extracted_data.store_rows(db, document, [
+        ("Amount", "100", "2025-06"),
+        ("Amount", "150", "2025-07"),
+        ("Item", "Widget", "2025-07"),
+    ])
+    rollups, cursor = analytics.month_rollups(db, "2025-07")
+    assert cursor is None
+    assert [(r["key"], r["total"], r["previousMonth"], r["change"], r["changePercent"]) for r in rollups] == [
+        ("Amount", 150.0, "2025-06", 50.0, 50.0),
+        ("Item", None, None, None, None),
+    ]
@@ -0,0 +1,81 @@
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import Base, SessionLocal, engine
+from services import batch_compare, compare_index, documents
+
+
+@pytest.fixture
+def client(monkeypatch):
+    Base.metadata.create_all(engine)
+    # Workers in this process, so the test sees the same document LRU the pool would keep
+    executor = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(batch_compare, "get_executor", lambda: executor)
+    batch_compare._loaded.clear()
+    yield TestClient(main.app)
+    executor.shutdown()
+
+
+def _doc(doc_id, text):
+    return {"id": doc_id, "fileName": f"{doc_id}.pdf", "fileType": "application/pdf",
+            "extractedText": text, "tables": [], "metadata": {}, "errors": []}
+
+
+def _save(db, doc):
+    return documents.save_document(db, doc, index=compare_index.build_index(doc))
+
+
+def _batch(client, doc_ids):
+    lines = [json.loads(line) for line in client.post("/upload/compare/batch", json={"docIds": doc_ids}).text.splitlines()]
+    assert lines[-1]["errors"] == 0
+    return {(line["doc1Id"], line["doc2Id"]): line for line in lines[:-1]}
+
+
+def test_reextracted_document_is_not_served_from_worker_cache(client):
+    text = "\n".join(f"Line {i} of the report" for i in range(50))
+    a, b = str(uuid.uuid4()), str(uuid.uuid4())
+    db = SessionLocal()
+    try:
+        _save(db, _doc(a, text))
+        row = _save(db, _doc(b, text))
+        assert _batch(client, [a, b])[(a, b)]["textSimilarity"] == 1.0
+
+        changed = _doc(b, "\n".join(f"Entirely different line {i}" for i in range(50)))
+        documents.update_document(db, row, changed, index=compare_index.build_index(changed))
+
+        second = _batch(client, [a, b])[(a, b)]
+        assert not second["cached"]
+        assert second["textSimilarity"] < 0.5
+        single = client.post(f"/upload/compare/?doc1_id={a}&doc2_id={b}").json()["result"]
+        assert single["textSimilarity"] == second["textSimilarity"]
+    finally:
+        db.close()
+
+
+def test_blocks_bound_document_loads():
+    ids = [f"doc{i}" for i in range(100)]
+    # Estimate order, the way candidate_pairs returns them: neighbouring pairs rarely share a document
+    pairs = sorted(((a, b, (i * 7919 + j * 104729) % 1000 / 1000) for i, a in enumerate(ids)
+                    for j, b in enumerate(ids) if i < j), key=lambda pair: pair[2], reverse=True)
+    blocks = batch_compare.blocks(pairs, size=16)
+    assert sorted(pair for block in blocks for pair in block) == sorted(pairs)
+    loads = dict.fromkeys(ids, 0)
+    for block in blocks:
+        documents_in_block = {doc_id for pair in block for doc_id in pair[:2]}
+        assert len(documents_in_block) <= 32
+        for doc_id in documents_in_block:
+            loads[doc_id] += 1
+    # Each document is in one row and one column of blocks
+    assert max(loads.values()) <= 2 * -(-len(ids) // 16)
+
+
+def test_reference_batches_keep_the_reference_in_every_block():
+    pairs = [("ref", f"doc{i}", 0.5) for i in range(40)]
+    blocks = batch_compare.blocks(pairs, size=16)
+    assert all(pair[0] == "ref" for block in blocks for pair in block)
+    assert [len(block) for block in blocks] == [15, 16, 9]
@@ -0,0 +1,110 @@
+import io
+import json
+
+import pytest
+
+from services import doc_format
+
+PAGES = ["Première page — naïve café\n", "", "第二页 with \"quotes\", a \\ and a\ttab\n", "emoji 🙂 and \x01 end"]
+TABLES = [
+    [["Item", "Amount", "Note"], ["Widget", "1,200.50"], [None, "7", "ünïcode", "extra"]],
+    [],
+    [[]],
+    [["only", None], [None, None]],
+]
+
+
+def _document():
+    text = "".join(PAGES)
+    offsets = []
+    position = 0
+    for page in PAGES:
+        offsets.append([position, position + len(page)])
+        position += len(page)
+    return {
+        "id": "doc-1",
+        "fileName": "résumé.pdf",
+        "extractedText": text,
+        "pageOffsets": offsets,
+        "metadata": {"pageCount": len(PAGES), "title": "Résumé"},
+        "tables": TABLES,
+        "errors": [],
+    }
+
+
+@pytest.mark.parametrize("compression", doc_format.COMPRESSIONS)
+def test_container_round_trip(compression):
+    doc = _document()
+    data = doc_format.encode_container(doc, compression)
+
+    magic, version, code, header_size = doc_format._PREAMBLE.unpack(data[:doc_format._PREAMBLE.size])
+    assert (magic, version, code) == (doc_format.MAGIC, doc_format.CONTAINER_VERSION, int(compression == "zstd"))
+
+    with doc_format.Container(io.BytesIO(data)) as container:
+        # The header holds every field but the text and tables, in the document's order
+        assert container.order == list(doc)
+        assert set(container.fields) == set(doc) - set(doc_format.BLOCK_FIELDS)
+        assert len(container.page_spans) == len(PAGES)
+        assert len(container.table_spans) == len(TABLES)
+        assert container.document() == doc
+        assert list(container.document()) == list(doc)
+        assert container.pages(1, 2) == PAGES[1:3]
+        assert container.pages(3) == PAGES[3:]
+        assert container.tables(0, 1) == TABLES[:1]
+        assert container.tables(2, 5) == TABLES[2:]
+        assert container.field("metadata") == (True, doc["metadata"])
+        assert container.field("missing") == (False, None)
+
+
+def test_container_reads_from_a_path(tmp_path):
+    path = tmp_path / "doc.udoc"
+    path.write_bytes(doc_format.encode_container(_document(), "zstd"))
+    with doc_format.Container(str(path)) as container:
+        assert container.document() == _document()
+
+
+def test_container_without_page_offsets_is_one_page():
+    doc = {"id": "legacy", "extractedText": "all the text", "tables": []}
+    with doc_format.Container(io.BytesIO(doc_format.encode_container(doc, "none"))) as container:
+        assert container.pages() == ["all the text"]
+        assert container.document() == doc
+
+
+def test_container_rejects_other_files():
+    with pytest.raises(ValueError):
+        doc_format.Container(io.BytesIO(b"{}" + bytes(16)))
+    with pytest.raises(ValueError):
+        doc_format.encode_container(_document(), "lz4")
+
+
+@pytest.mark.parametrize("table", TABLES)
+def test_columnar_tables_keep_ragged_rows(table):
+    assert doc_format.row_table(doc_format.columnar_table(table)) == table
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_json_layout_spans(use_orjson, monkeypatch):
+    if not use_orjson:
+        monkeypatch.setattr(doc_format, "orjson", None)
+    doc = _document()
+    data, layout = doc_format.encode_json(doc)
+    assert json.loads(data) == doc
+    assert layout["bodySize"] == len(data)
+    assert list(layout["sections"]) == list(doc)
+    for key, (start, end) in layout["sections"].items():
+        assert json.loads(data[start:end]) == doc[key]
+    # Page fragments are the escaped page text, and together the whole extractedText string
+    for page, (start, end) in zip(PAGES, layout["pages"]):
+        assert json.loads(b'"' + data[start:end] + b'"') == page
+    text_start, text_end = layout["sections"]["extractedText"]
+    assert layout["pages"][0][0] == text_start + 1 and layout["pages"][-1][1] == text_end - 1
+    for table, (start, end) in zip(TABLES, layout["tables"]):
+        assert json.loads(data[start:end]) == table
+
+
+def test_json_layout_without_usable_page_offsets():
+    doc = _document()
+    doc["pageOffsets"] = [[0, 3], [5, len(doc["extractedText"])]]
+    data, layout = doc_format.encode_json(doc)
+    assert json.loads(data) == doc
+    assert layout["pages"] == []
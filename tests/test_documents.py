@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from services import doc_format, documents
+from services.storage import LocalStorage
+
+PAGES = ["Première page — naïve café\n", "", "第二页 with \"quotes\" and a \\\n", "emoji 🙂 end"]
+TABLES = [
+    [["Item", "Amount", "Note"], ["Widget", "1,200.50"], [None, "7", "ünïcode", "extra"]],
+    [],
+    [["only", None], [None, None]],
+]
+
+# (format, compression) of every way a body can be stored
+LAYOUTS = [("json", None), ("msgpack", "none"), ("msgpack", "zstd")]
+
+
+def _document(doc_id="doc-1"):
+    offsets = []
+    position = 0
+    for page in PAGES:
+        offsets.append([position, position + len(page)])
+        position += len(page)
+    return {
+        "id": doc_id,
+        "fileName": "résumé.pdf",
+        "extractedText": "".join(PAGES),
+        "pageOffsets": offsets,
+        "metadata": {"pageCount": len(PAGES), "title": "Résumé"},
+        "tables": TABLES,
+        "errors": [],
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalStorage(str(tmp_path))
+
+
+@pytest.mark.parametrize("fmt, compression", LAYOUTS)
+def test_ranged_reads_match_the_full_body(store, fmt, compression):
+    doc = _document()
+    documents.write_body(doc, store, fmt, compression)
+    assert documents.body_format(doc["id"], store) == fmt
+    full = documents.read_body(doc["id"], store)
+    assert full == doc
+
+    for start, count in [(0, 1), (1, 2), (3, 5), (0, len(PAGES)), (9, 1)]:
+        assert documents.read_pages(doc["id"], start, count, store) == (len(PAGES), PAGES[start:start + count])
+    for start, count in [(0, 1), (1, 2), (0, len(TABLES)), (5, 1)]:
+        total, data = documents.read_tables_json(doc["id"], start, count, store)
+        assert total == len(TABLES)
+        assert json.loads(data) == TABLES[start:start + count]
+    for name in doc:
+        assert json.loads(documents.read_section_json(doc["id"], name, store)) == full[name]
+    assert documents.read_section_json(doc["id"], "missing", store) is None
+    assert json.loads(b"".join(documents.stream_body(doc["id"], chunk_size=16, store=store))) == doc
+
+
+def test_layout_spans_slice_the_stored_body(store):
+    doc = _document()
+    documents.write_body(doc, store, "json")
+    layout = documents.read_layout(doc["id"], store)
+    body = store.read(documents.body_key(doc["id"]))
+    assert layout["bodySize"] == len(body)
+    for name, (start, end) in layout["sections"].items():
+        assert documents.read_span(doc["id"], start, end, store) == body[start:end]
+        assert json.loads(body[start:end]) == doc[name]
+    # Spans are in bytes of the UTF-8 body, not characters of the text
+    assert [json.loads(b'"' + body[a:b] + b'"') for a, b in layout["pages"]] == PAGES
+    assert [b - a for a, b in layout["pages"]] != [len(page) for page in PAGES]
+    assert [json.loads(body[a:b]) for a, b in layout["tables"]] == TABLES
+
+
+def test_stale_layout_is_ignored(store):
+    doc = _document()
+    documents.write_body(doc, store, "json")
+    # The body rewritten without its sidecar (e.g. by an older version)
+    store.write(documents.body_key(doc["id"]), doc_format.dumps({**doc, "extractedText": "changed"}))
+    assert documents.read_layout(doc["id"], store) is None
+    assert documents.read_pages(doc["id"], 0, 1, store) == (len(PAGES), ["changed"])
+
+
+def test_bodies_without_layout_or_page_offsets(store):
+    doc = {"id": "legacy", "extractedText": "old text", "tables": [["a", None]]}
+    store.write(documents.body_key("legacy"), json.dumps(doc).encode("utf-8"))
+    assert documents.read_layout("legacy", store) is None
+    assert documents.read_pages("legacy", 0, 3, store) == (1, ["old text"])
+    assert documents.read_tables_json("legacy", 0, 1, store) == (1, doc_format.dumps([["a", None]]))
+    assert json.loads(documents.read_section_json("legacy", "extractedText", store)) == "old text"
+
+
+def test_rewriting_in_the_other_format_drops_the_old_copy(store):
+    doc = _document()
+    documents.write_body(doc, store, "json")
+    documents.write_body(doc, store, "msgpack", "zstd")
+    assert not store.exists(documents.body_key(doc["id"]))
+    assert not store.exists(documents.layout_key(doc["id"]))
+    documents.write_body(doc, store, "json")
+    assert not store.exists(documents.container_key(doc["id"]))
+    assert documents.read_body(doc["id"], store) == doc
+    assert documents.read_pages("missing", 0, 1, store) is None
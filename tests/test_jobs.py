@@ -0,0 +1,55 @@
+import os
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from services import checkpoints, jobs
+
+
+@pytest.fixture
+def process_queue(monkeypatch):
+    monkeypatch.setattr(jobs, "EXTRACTION_PAGE_TIMEOUT", 1.0)
+    queue = jobs.ExtractionQueue(max_workers=1, executor_kind="process")
+    yield queue
+    queue.shutdown(wait=False)
+
+
+def test_stalled_extraction_is_killed_and_resumed(process_queue, monkeypatch, tmp_path):
+    # The first attempt hangs on its first page; the workers are forked, so they run the patched function
+    flag = tmp_path / "hung"
+
+    def extract(spec, checkpoint):
+        if not flag.exists():
+            flag.touch()
+            time.sleep(600)
+        return {"summary": {"id": spec["docId"]}, "timings": {}, "errors": []}
+
+    monkeypatch.setattr(jobs, "_process_file", extract)
+    spec = {"sha256": "stalled" + os.urandom(4).hex(), "fileName": "slow.pdf", "docId": "doc"}
+    outcome = Future()
+    process_queue._start(spec, outcome, 1)
+    assert outcome.result(timeout=30)["summary"] == {"id": "doc"}
+    assert flag.exists()
+    assert checkpoints.progress(spec["sha256"]) is None
+
+
+def test_stalled_extraction_fails_once_retries_are_used(process_queue, monkeypatch):
+    monkeypatch.setattr(jobs, "_process_file", lambda spec, checkpoint: time.sleep(600))
+    spec = {"sha256": "stalled" + os.urandom(4).hex(), "fileName": "slow.pdf", "docId": "doc"}
+    outcome = Future()
+    process_queue._start(spec, outcome, 0)
+    with pytest.raises(TimeoutError):
+        outcome.result(timeout=30)
+
+
+
+def test_thread_workers_keep_the_connection_pool(monkeypatch):
+    disposed = []
+    monkeypatch.setattr(jobs.engine, "dispose", lambda *args, **kwargs: disposed.append(kwargs))
+    queue = jobs.ExtractionQueue(max_workers=2, executor_kind="thread")
+    try:
+        assert queue._get_executor().submit(lambda: "ran").result(timeout=5) == "ran"
+    finally:
+        queue.shutdown()
+    assert disposed == []
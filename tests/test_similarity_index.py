@@ -0,0 +1,65 @@
+import os
+import uuid
+
+import numpy as np
+
+from services import text_compare
+from services.similarity_index import SimilarityIndex
+
+
+def _signature(text):
+    return text_compare.minhash(text_compare.shingle_hashes(text))
+
+
+def _corpus(count):
+    return {
+        str(uuid.uuid4()): _signature(" ".join(f"word{i}x{j}" for j in range(60)))
+        for i in range(count)
+    }
+
+
+def test_queries_across_base_and_log(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    corpus = _corpus(20)
+    for doc_id, signature in corpus.items():
+        index.add(doc_id, signature)
+    index.compact()
+    ids = list(corpus)
+
+    # A fresh reader maps the base segment without building a per-id map
+    reader = SimilarityIndex(str(tmp_path))
+    reader.refresh()
+    assert reader._base_order is None
+    assert reader.size() == 20
+    assert np.array_equal(reader.signature_of(ids[3]), corpus[ids[3]])
+    assert reader.signature_of(str(uuid.uuid4())) is None
+    assert reader.query(corpus[ids[5]], k=1) == [(ids[5], 1.0)]
+
+    # A re-extracted document in the log supersedes its base entry
+    changed = _signature("entirely different text " * 20)
+    index.add(ids[5], changed)
+    reader.refresh()
+    assert reader.size() == 20
+    assert np.array_equal(reader.signature_of(ids[5]), changed)
+    assert ids[5] not in [doc_id for doc_id, _ in reader.query(corpus[ids[5]], k=5)]
+    assert reader.query(changed, k=1) == [(ids[5], 1.0)]
+
+    new_id = str(uuid.uuid4())
+    index.add(new_id, _signature("a new document " * 20))
+    assert reader.size() == 21
+
+
+def test_bases_without_an_order_file_are_searched(tmp_path):
+    index = SimilarityIndex(str(tmp_path))
+    corpus = _corpus(10)
+    for doc_id, signature in corpus.items():
+        index.add(doc_id, signature)
+    index.compact()
+    for name in os.listdir(tmp_path):
+        if name.endswith("-order.npy"):
+            os.remove(tmp_path / name)
+
+    reader = SimilarityIndex(str(tmp_path))
+    reader.refresh()
+    for doc_id, signature in corpus.items():
+        assert np.array_equal(reader.signature_of(doc_id), signature)
@@ -0,0 +1,125 @@
+import importlib.util
+import sys
+import threading
+import time
+import types
+
+import boto3
+import pytest
+from moto import mock_aws
+
+from services import storage
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="doccompare-test")
+        yield storage.S3Storage(bucket="doccompare-test", prefix="dc", client=client)
+
+
+def test_local_lock_excludes_other_holders(tmp_path):
+    store = storage.LocalStorage(str(tmp_path))
+    with store.lock("doc"):
+        started = time.monotonic()
+        with pytest.raises(storage.StorageLockTimeout):
+            with store.lock("doc", timeout=0.2):
+                pass
+        assert time.monotonic() - started < 0.5
+    # Released on exit
+    with store.lock("doc", timeout=0.2):
+        pass
+
+
+def test_file_lock_serialises_threads(tmp_path):
+    path = str(tmp_path / "counter.lock")
+    counter = {"value": 0, "inside": 0, "overlap": False}
+
+    def work():
+        for _ in range(20):
+            with storage.file_lock(path):
+                counter["inside"] += 1
+                counter["overlap"] |= counter["inside"] > 1
+                counter["value"] += 1
+                counter["inside"] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter["value"] == 80 and not counter["overlap"]
+
+
+def test_s3_reads_and_writes(s3, tmp_path):
+    s3.write("doc.json", "héllo wörld".encode("utf-8"))
+    assert s3.exists("doc.json") and not s3.exists("other.json")
+    assert s3.read("doc.json").decode("utf-8") == "héllo wörld"
+    assert s3.read("other.json") is None
+    assert s3.size("doc.json") == len("héllo wörld".encode("utf-8"))
+    assert s3.read_range("doc.json", 1, 4) == "héllo".encode("utf-8")[1:4]
+    assert s3.read_range("doc.json", 3, 3) == b""
+    reader = s3.open("doc.json")
+    reader.seek(6)
+    assert reader.read(3) == "héllo wörld".encode("utf-8")[6:9]
+    assert reader.tell() == 9
+    reader.close()
+    assert b"".join(s3.iter_chunks("doc.json", chunk_size=4)) == "héllo wörld".encode("utf-8")
+
+    local = tmp_path / "upload.pdf"
+    local.write_bytes(b"%PDF-1.4 body")
+    s3.put_file("pdf/abc.pdf", str(local))
+    assert not local.exists()
+    with s3.local_copy("pdf/abc.pdf") as path:
+        with open(path, "rb") as f:
+            assert f.read() == b"%PDF-1.4 body"
+
+    s3.write("layout/doc.json", b"{}")
+    assert s3.list() == ["doc.json"]
+    assert s3.list("layout/") == ["doc.json"]
+    s3.delete("doc.json")
+    assert s3.list() == []
+    with pytest.raises(FileNotFoundError):
+        s3.open("doc.json")
+
+
+def test_s3_lock_contention(s3):
+    with s3.lock("doc"):
+        with pytest.raises(storage.StorageLockTimeout):
+            with s3.lock("doc", timeout=0.2):
+                pass
+    with s3.lock("doc", timeout=0.2):
+        pass
+    # Released locks leave nothing behind
+    assert s3.list("locks/") == []
+
+
+def test_s3_stale_lock_is_broken(s3, monkeypatch):
+    # A lock object left behind by a crashed worker
+    s3.client.put_object(Bucket=s3.bucket, Key=s3._key("locks/doc.lock"), Body=b"crashed")
+    with pytest.raises(storage.StorageLockTimeout):
+        with s3.lock("doc", timeout=0.2):
+            pass
+    monkeypatch.setattr(storage, "STORAGE_LOCK_TTL", -1)
+    with s3.lock("doc", timeout=1):
+        assert s3.read("locks/doc.lock") != b"crashed"
+    assert not s3.exists("locks/doc.lock")
+
+
+def test_windows_locks_use_msvcrt(tmp_path, monkeypatch):
+    # Import the module as it would load on Windows (no fcntl) and check file_lock goes through msvcrt
+    calls = []
+    fake_msvcrt = types.ModuleType("msvcrt")
+    fake_msvcrt.LK_NBLCK = 2
+    fake_msvcrt.locking = lambda fileno, mode, size: calls.append((mode, size))
+    monkeypatch.setitem(sys.modules, "fcntl", None)
+    monkeypatch.setitem(sys.modules, "msvcrt", fake_msvcrt)
+    spec = importlib.util.spec_from_file_location("storage_on_windows", storage.__file__)
+    windows_storage = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(windows_storage)
+
+    assert windows_storage.fcntl is None
+    with windows_storage.LocalStorage(str(tmp_path)).lock("doc", timeout=0.2):
+        pass
+    assert calls == [(2, 1)]
@@ -0,0 +1,36 @@
+from services import table_detect
+
+
+def test_ragged_rows_are_placed_under_their_columns():
+    text = "\n".join([
+        "Date        Item        Qty    Amount",
+        "2025-07-01  Widget      2      3.50",
+        "2025-07-02              4       7.25",
+        "            Bolt        3      1.25",
+        "2025-07-04  Nut                0.75",
+    ])
+    assert table_detect.detect_tables(text) == [[
+        ["Date", "Item", "Qty", "Amount"],
+        ["2025-07-01", "Widget", "2", "3.50"],
+        ["2025-07-02", "", "4", "7.25"],
+        ["", "Bolt", "3", "1.25"],
+        ["2025-07-04", "Nut", "", "0.75"],
+    ]]
+
+
+def test_rows_with_a_missing_cell_outnumbering_the_full_ones():
+    text = "\n".join([
+        "Date        Item        Qty    Amount",
+        "2025-07-01              4      7.25",
+        "2025-07-02              5      1.00",
+    ])
+    assert table_detect.detect_tables(text) == [[
+        ["Date", "Item", "Qty", "Amount"],
+        ["2025-07-01", "", "4", "7.25"],
+        ["2025-07-02", "", "5", "1.00"],
+    ]]
+
+
+def test_regular_tables_are_unchanged():
+    text = "Name  Qty\nBolt  3\nNut  4\n\nPlain prose follows."
+    assert table_detect.detect_tables(text) == [[["Name", "Qty"], ["Bolt", "3"], ["Nut", "4"]]]
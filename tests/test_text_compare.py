@@ -0,0 +1,89 @@
+import difflib
+import random
+import re
+
+import pytest
+
+from services import text_compare
+
+
+def _edit(rng, lines, new_lines):
+    # Apply a random script of deletions, insertions and replacements
+    lines = list(lines)
+    for _ in range(rng.randint(0, 8)):
+        position = rng.randint(0, len(lines))
+        op = rng.random()
+        if op < 0.35 and lines:
+            del lines[min(position, len(lines) - 1)]
+        elif op < 0.7:
+            lines.insert(position, rng.choice(new_lines))
+        elif lines:
+            lines[min(position, len(lines) - 1)] = rng.choice(new_lines)
+    return lines
+
+
+def _patch(a, diff):
+    # Rebuild the second document from the first one and a unified diff
+    result, position = [], 0
+    for line in diff[2:]:
+        hunk = re.match(r"@@ -(\d+)(?:,(\d+))? ", line)
+        if hunk:
+            # An empty range names the line before the hunk
+            start = int(hunk.group(1)) - (hunk.group(2) != "0")
+            result.extend(a[position:start])
+            position = start
+        elif line[0] in " -":
+            assert a[position] == line[1:]
+            if line[0] == " ":
+                result.append(line[1:])
+            position += 1
+        else:
+            result.append(line[1:])
+    return result + a[position:]
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_unified_diff_matches_difflib(seed):
+    rng = random.Random(seed)
+    a = [f"line {i}" for i in range(rng.randint(0, 80))]
+    b = _edit(rng, a, [f"new {i}" for i in range(1000)])
+    expected = list(difflib.unified_diff(a, b, "doc1", "doc2", lineterm=""))
+    assert text_compare.unified_diff(a, b) == expected
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_unified_diff_with_repeated_lines_rebuilds_the_document(seed):
+    # Without unique lines the alignment may differ from difflib's, but the diff must still be valid
+    rng = random.Random(seed)
+    a = [rng.choice("wxyz") for _ in range(rng.randint(0, 80))]
+    b = _edit(rng, a, list("vwxyz"))
+    assert _patch(a, text_compare.unified_diff(a, b)) == b
+
+
+def test_repeated_rows_only_report_the_changed_lines():
+    rows = ["2025-07-01  Widget  4  7.25", "2025-07-01  Gadget  2  3.10", "Subtotal 10.35", ""]
+    a = [rows[i % len(rows)] for i in range(300)]
+    b = list(a)
+    b[100] = "2025-07-01  Widget  5  7.25"
+    b[202] = "Subtotal 11.00"
+
+    similarity, diff, mode = text_compare.compare_text("\n".join(a), "\n".join(b), mode="exact")
+
+    assert mode == "exact"
+    assert similarity > 0.99
+    assert [line for line in diff if line[0] in "+-" and line[:3] not in ("---", "+++")] == [
+        "-2025-07-01  Widget  4  7.25", "+2025-07-01  Widget  5  7.25",
+        "-Subtotal 10.35", "+Subtotal 11.00",
+    ]
+    assert _patch(a, diff) == b
+
+
+def test_large_anchorless_gap_is_matched():
+    # Far above the difflib fallback size, still matched line by line
+    a = [f"row {i % 5}" for i in range(5000)]
+    b = list(a)
+    for position in range(0, 5000, 500):
+        b[position] = "changed"
+    matches = text_compare.matching_lines(a, b)
+    assert len(matches) == 4990
+    assert all(a[i] == b[j] for i, j in matches)
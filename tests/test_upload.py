@@ -0,0 +1,61 @@
+import hashlib
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import Base, engine
+from services import ingest, storage
+from services.jobs import extraction_queue
+
+
+@pytest.fixture
+def client():
+    Base.metadata.create_all(engine)
+    return TestClient(main.app)
+
+
+def _stored(content):
+    return storage.storage.exists(ingest.pdf_key(hashlib.sha256(content).hexdigest()))
+
+
+def _files(*named):
+    return [("files", (name, content, "application/pdf")) for name, content in named]
+
+
+def test_refused_uploads_leave_no_pdf_behind(client, monkeypatch):
+    first, second = os.urandom(64), os.urandom(64)
+    store_upload = ingest.store_upload
+
+    async def limited(file, **kwargs):
+        if file.filename == "big.pdf":
+            raise ingest.UploadTooLargeError("big.pdf exceeds the upload limit.")
+        return await store_upload(file, **kwargs)
+
+    monkeypatch.setattr(ingest, "store_upload", limited)
+    response = client.post("/upload/", files=_files(("first.pdf", first), ("big.pdf", second)))
+    assert response.status_code == 413
+    assert not _stored(first)
+
+    monkeypatch.setattr(extraction_queue, "max_pending", 0)
+    response = client.post("/upload/", files=_files(("first.pdf", first), ("second.pdf", second)))
+    assert response.status_code == 503
+    assert not _stored(first) and not _stored(second)
+
+
+def test_failed_extraction_removes_the_pdf_and_hides_the_details(client):
+    content = b"not a PDF " + os.urandom(32)
+    response = client.post("/upload/", files=_files(("broken.pdf", content)))
+    assert response.status_code == 202
+    job_id = response.json()["jobId"]
+    deadline = time.monotonic() + 30
+    while True:
+        job = client.get(f"/upload/jobs/{job_id}").json()["job"]
+        if job["status"] in ("completed", "failed") or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+    assert job["status"] == "failed"
+    assert job["errors"] == [{"fileName": "broken.pdf", "error": "Extraction failed."}]
+    assert not _stored(content)